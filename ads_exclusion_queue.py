@@ -0,0 +1,422 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/ads_exclusion_queue.py
+import os
+import time
+import uuid
+import click
+import ipaddress
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, insert, update, delete, func, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from src.main import db
+from src.models.event_log import AdsExclusionQueueItem, AdsIpExclusion
+from src.services.rule_engine import reason_codes_for
+
+# --- Configuration for Google Ads IP exclusions (can be overridden in .env) ---
+ADS_EXCLUSION_ENABLED = os.getenv("ADS_EXCLUSION_ENABLED", "false").lower() == "true"
+ADS_CUSTOMER_ID = os.getenv("GOOGLE_ADS_CUSTOMER_ID_TO_UPDATE", "")
+# Only clicks flagged by one of these rules get their IP excluded
+ADS_EXCLUSION_REASON_CODES = frozenset(code.strip() for code in os.getenv(
+    "ADS_EXCLUSION_REASON_CODES", "IP_BLACKLISTED,HIGH_IP_FREQUENCY,SUSPICIOUS_USER_AGENT").split(",") if code.strip())
+ADS_EXCLUSION_BATCH_SIZE = int(os.getenv("ADS_EXCLUSION_BATCH_SIZE", "100")) # IPs per campaign per mutate request
+ADS_EXCLUSION_MAX_DELAY_SECONDS = int(os.getenv("ADS_EXCLUSION_MAX_DELAY_SECONDS", "60")) # A partial batch waits at most this long
+ADS_EXCLUSION_POLL_SECONDS = float(os.getenv("ADS_EXCLUSION_POLL_SECONDS", "5"))
+ADS_EXCLUSION_LIST_LIMIT = int(os.getenv("ADS_EXCLUSION_LIST_LIMIT", "500")) # Google Ads allows 500 IP exclusions per campaign
+ADS_EXCLUSION_MAX_ATTEMPTS = int(os.getenv("ADS_EXCLUSION_MAX_ATTEMPTS", "5"))
+ADS_EXCLUSION_LEASE_SECONDS = int(os.getenv("ADS_EXCLUSION_LEASE_SECONDS", "300")) # Claimed rows are retried after this if a worker dies
+ADS_EXCLUSION_CACHE_SECONDS = int(os.getenv("ADS_EXCLUSION_CACHE_SECONDS", "300"))
+# API quotas, per process: mutate requests per second, and the daily operation budget (Basic access: 15,000)
+ADS_MUTATE_REQUESTS_PER_SECOND = float(os.getenv("ADS_MUTATE_REQUESTS_PER_SECOND", "1"))
+ADS_DAILY_OPERATIONS = int(os.getenv("ADS_DAILY_OPERATIONS", "15000")) # 0 disables the daily budget
+ADS_OPERATIONS_BURST = int(os.getenv("ADS_OPERATIONS_BURST", "2000"))
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        """
+        Holds up to `capacity` tokens, refilled continuously at `rate` tokens per second.
+        :param clock: Monotonic time source in seconds (injectable for checks).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` if they are available right now. Returns False (taking nothing) otherwise."""
+        tokens = min(tokens, self.capacity) # A request larger than the bucket would never fit
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        """Seconds until `tokens` will be available."""
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def acquire(self, tokens=1, sleep=time.sleep):
+        """Blocks until `tokens` are taken. Returns the seconds spent waiting."""
+        waited = 0.0
+        while not self.try_acquire(tokens):
+            delay = self.wait_time(tokens)
+            sleep(delay)
+            waited += delay
+        return waited
+
+def normalize_ip(value):
+    """
+    Canonical form of a client IP (the first address of an X-Forwarded-For list).
+    :return: The address string, or None for invalid, private, loopback or otherwise non-routable addresses.
+    """
+    try:
+        address = ipaddress.ip_address(str(value).split(",")[0].strip())
+    except ValueError:
+        return None
+    return str(address) if address.is_global else None
+
+def exclusion_candidate(ip_address, campaign_id, is_valid, invalid_reason, customer_id=None):
+    """
+    Decides whether a processed click should queue its IP for exclusion.
+    :return: Dictionary for enqueue_exclusions(), or None.
+    """
+    if not ADS_EXCLUSION_ENABLED or is_valid or not campaign_id:
+        return None
+    codes = [code for code in reason_codes_for(invalid_reason) if code in ADS_EXCLUSION_REASON_CODES]
+    if not codes:
+        return None
+    return {"ip_address": ip_address, "campaign_id": campaign_id, "customer_id": customer_id, "reason": ",".join(codes)}
+
+class _ExclusionCache:
+    def __init__(self, ttl_seconds=ADS_EXCLUSION_CACHE_SECONDS):
+        """
+        IPs already excluded or queued, per (customer_id, campaign_id), so repeat offenders cost no database write.
+        A campaign's set is loaded on first use and reloaded after `ttl_seconds` (other workers rotate IPs out too).
+        """
+        self.ttl_seconds = ttl_seconds
+        self._entries = {} # (customer_id, campaign_id) -> (loaded_at, set of IPs)
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        customer_id, campaign_id = key
+        queue, exclusions = AdsExclusionQueueItem.__table__, AdsIpExclusion.__table__
+        with db.engine.connect() as connection:
+            ips = {row.ip_address for row in connection.execute(select(exclusions.c.ip_address).where(
+                exclusions.c.customer_id == customer_id, exclusions.c.campaign_id == campaign_id))}
+            ips.update(row.ip_address for row in connection.execute(select(queue.c.ip_address).where(
+                queue.c.customer_id == customer_id, queue.c.campaign_id == campaign_id)))
+        return ips
+
+    def contains(self, key, ip_address):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            entry = (time.monotonic(), self._load(key))
+            with self._lock:
+                self._entries[key] = entry
+        return ip_address in entry[1]
+
+    def add(self, key, ip_addresses):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key][1].update(ip_addresses)
+
+    def discard(self, key, ip_addresses):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key][1].difference_update(ip_addresses)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+exclusion_cache = _ExclusionCache()
+
+def _insert_queue_rows(connection, rows):
+    # INSERT ... ON CONFLICT DO NOTHING: another worker may have queued the same IP since the cache was loaded
+    table = AdsExclusionQueueItem.__table__
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        statement = (postgresql.insert(table) if dialect == "postgresql" else sqlite.insert(table))
+        connection.execute(statement.on_conflict_do_nothing(index_elements=["customer_id", "campaign_id", "ip_address"]), rows)
+        return
+    for row in rows:
+        exists = connection.execute(select(table.c.id).where(table.c.customer_id == row["customer_id"],
+                                                              table.c.campaign_id == row["campaign_id"],
+                                                              table.c.ip_address == row["ip_address"])).first()
+        if exists is None:
+            connection.execute(insert(table), row)
+
+def enqueue_exclusions(candidates):
+    """
+    Queues IPs for a batched exclusion, skipping the ones already excluded or queued for the same campaign.
+    :param candidates: Dictionaries from exclusion_candidate() (ip_address, campaign_id, customer_id, reason).
+    :return: Number of IPs newly queued.
+    """
+    now = datetime.utcnow()
+    rows = []
+    seen = set()
+    for candidate in candidates:
+        customer_id = str(candidate.get("customer_id") or ADS_CUSTOMER_ID)
+        campaign_id = str(candidate["campaign_id"])
+        ip_address = normalize_ip(candidate["ip_address"])
+        key = (customer_id, campaign_id)
+        if not customer_id or ip_address is None or (key, ip_address) in seen:
+            continue
+        seen.add((key, ip_address))
+        if exclusion_cache.contains(key, ip_address):
+            continue
+        rows.append({"customer_id": customer_id, "campaign_id": campaign_id, "ip_address": ip_address,
+                     "reason": candidate.get("reason"), "enqueued_at": now, "next_attempt_at": now, "attempts": 0})
+    if not rows:
+        return 0
+    with db.engine.begin() as connection:
+        _insert_queue_rows(connection, rows)
+    for row in rows:
+        exclusion_cache.add((row["customer_id"], row["campaign_id"]), [row["ip_address"]])
+    exclusion_processor.ensure_started(current_app._get_current_object())
+    return len(rows)
+
+def _default_manager_factory(customer_id):
+    from src.services.google_ads_manager import GoogleAdsManager # Imported on first flush; google-ads is optional
+    return GoogleAdsManager(customer_id)
+
+class ExclusionProcessor:
+    def __init__(self, manager_factory=None, batch_size=ADS_EXCLUSION_BATCH_SIZE, max_delay_seconds=ADS_EXCLUSION_MAX_DELAY_SECONDS,
+                 list_limit=ADS_EXCLUSION_LIST_LIMIT, max_attempts=ADS_EXCLUSION_MAX_ATTEMPTS, request_bucket=None,
+                 operation_bucket=None, clock=datetime.utcnow):
+        """
+        Drains ads_exclusion_queue into one mutate request per campaign batch.
+        A campaign is flushed once `batch_size` IPs are queued for it or its oldest has waited `max_delay_seconds`.
+        When a campaign would exceed `list_limit` exclusions, its oldest exclusions are removed in the same request.
+        The campaign's current exclusions come from the manager's resource cache, so a steady-state batch is a single mutate.
+        :param manager_factory: callable(customer_id) -> GoogleAdsManager; inject one with a fake client for checks.
+        :param request_bucket: TokenBucket for mutate requests (blocks); defaults to ADS_MUTATE_REQUESTS_PER_SECOND.
+        :param operation_bucket: TokenBucket for operations (defers the rest of the queue when empty); defaults to ADS_DAILY_OPERATIONS.
+        """
+        self.manager_factory = manager_factory or _default_manager_factory
+        self.list_limit = list_limit
+        self.batch_size = min(batch_size, list_limit)
+        self.max_delay = timedelta(seconds=max_delay_seconds)
+        self.max_attempts = max_attempts
+        self.request_bucket = request_bucket or (TokenBucket(ADS_MUTATE_REQUESTS_PER_SECOND, 1)
+                                                 if ADS_MUTATE_REQUESTS_PER_SECOND > 0 else None)
+        self.operation_bucket = operation_bucket or (TokenBucket(ADS_DAILY_OPERATIONS / 86400.0, ADS_OPERATIONS_BURST)
+                                                     if ADS_DAILY_OPERATIONS > 0 else None)
+        self.clock = clock
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {"requests": 0, "excluded": 0, "rotated_out": 0, "already_excluded": 0,
+                          "failed_requests": 0, "dropped": 0, "deferred_passes": 0}
+
+    # --- Background loop (one per worker process; leases keep workers from sending the same rows) ---
+    def ensure_started(self, app):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._app = app
+                self._thread = threading.Thread(target=self._run, name="ads-exclusions", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(ADS_EXCLUSION_POLL_SECONDS)
+            with self._app.app_context():
+                try:
+                    self.process()
+                except Exception as e:
+                    print(f"ADS_WARN: Exclusion queue pass failed: {e}")
+
+    # --- Queue processing ---
+    def process(self, force=False):
+        """
+        Sends every due campaign batch.
+        :param force: Flush partial batches regardless of their age.
+        :return: Dictionary of what this pass did (requests, excluded, rotated_out, already_excluded, failed_requests, dropped, deferred).
+        """
+        table = AdsExclusionQueueItem.__table__
+        now = self.clock()
+        with db.engine.connect() as connection:
+            campaigns = connection.execute(
+                select(table.c.customer_id, table.c.campaign_id, func.count().label("queued"), func.min(table.c.enqueued_at).label("oldest"))
+                .where(table.c.next_attempt_at <= now)
+                .group_by(table.c.customer_id, table.c.campaign_id)
+            ).all()
+        result = {"requests": 0, "excluded": 0, "rotated_out": 0, "already_excluded": 0, "failed_requests": 0, "dropped": 0, "deferred": False}
+        for campaign in campaigns:
+            if not force and campaign.queued < self.batch_size and campaign.oldest > now - self.max_delay:
+                continue
+            # Cheap: managers share the process-wide client and resource cache, and a client that failed to load is retried
+            manager = self.manager_factory(campaign.customer_id)
+            if getattr(manager, "client", None) is None:
+                continue # Not configured for this customer; the IPs stay queued
+            while True:
+                claimed = self._claim_batch(campaign.customer_id, campaign.campaign_id, now)
+                if not claimed:
+                    break
+                if not self._send_batch(manager, campaign.customer_id, campaign.campaign_id, claimed, now, result):
+                    result["deferred"] = True
+                    break
+                if len(claimed) < self.batch_size:
+                    break
+            if result["deferred"]:
+                break # Out of daily operations; the rest waits for the bucket to refill
+        with self._stats_lock:
+            for name in ("requests", "excluded", "rotated_out", "already_excluded", "failed_requests", "dropped"):
+                self._counters[name] += result[name]
+            self._counters["deferred_passes"] += 1 if result["deferred"] else 0
+        return result
+
+    def _claim_batch(self, customer_id, campaign_id, now):
+        """Leases up to batch_size due rows of a campaign to this worker. Returns the claimed rows, oldest first."""
+        table = AdsExclusionQueueItem.__table__
+        lease_until = now + timedelta(seconds=ADS_EXCLUSION_LEASE_SECONDS)
+        token = uuid.uuid4().hex
+        campaign_filter = and_(table.c.customer_id == customer_id, table.c.campaign_id == campaign_id)
+        with db.engine.begin() as connection:
+            ids = [row.id for row in connection.execute(
+                select(table.c.id).where(campaign_filter, table.c.next_attempt_at <= now)
+                .order_by(table.c.enqueued_at, table.c.id).limit(self.batch_size))]
+            if not ids:
+                return []
+            # Conditional update: rows another worker claimed in the meantime no longer match
+            connection.execute(update(table).where(table.c.id.in_(ids), table.c.next_attempt_at <= now)
+                               .values(next_attempt_at=lease_until, claim_token=token))
+            return connection.execute(
+                select(table.c.id, table.c.ip_address, table.c.attempts)
+                .where(table.c.id.in_(ids), table.c.claim_token == token)
+                .order_by(table.c.enqueued_at, table.c.id)
+            ).all()
+
+    def _send_batch(self, manager, customer_id, campaign_id, claimed, now, result):
+        """Excludes one claimed batch. Returns False if the operation budget is exhausted (the rows are released)."""
+        queue, exclusions = AdsExclusionQueueItem.__table__, AdsIpExclusion.__table__
+        key = (customer_id, campaign_id)
+        campaign_filter = and_(exclusions.c.customer_id == customer_id, exclusions.c.campaign_id == campaign_id)
+        try:
+            # {ip: resource name} from the manager's resource cache; includes exclusions added outside this app
+            live = manager.ip_exclusions(campaign_id)
+        except Exception as e:
+            from src.services.google_ads_manager import describe_ads_error
+            self._record_failure(claimed, now, describe_ads_error(e), result)
+            return True
+        already = {row.ip_address for row in claimed if row.ip_address in live}
+        new_ips = [row.ip_address for row in claimed if row.ip_address not in already]
+        with db.engine.connect() as connection:
+            ours = connection.execute(select(exclusions.c.ip_address).where(campaign_filter)
+                                      .order_by(exclusions.c.excluded_at, exclusions.c.ip_address)).scalars().all()
+        stale = [ip_address for ip_address in ours if ip_address not in live] # Removed outside this app
+        overflow = len(live) + len(new_ips) - self.list_limit
+        # Full campaign: rotate out our oldest exclusions to make room (recent offenders matter most)
+        rotate_out = [ip_address for ip_address in ours if ip_address in live][:overflow] if overflow > 0 and new_ips else []
+        room = max(self.list_limit - len(live) + len(rotate_out), 0)
+        if len(new_ips) > room: # The rest of the campaign's list was not added by this app, so it is not rotated
+            no_room = set(new_ips[room:])
+            new_ips = new_ips[:room]
+            self._record_failure([row for row in claimed if row.ip_address in no_room], now,
+                                 f"Campaign {campaign_id} already has {len(live)} IP exclusions", result)
+            claimed = [row for row in claimed if row.ip_address not in no_room]
+        claimed_ids = [row.id for row in claimed]
+
+        if new_ips:
+            operations = len(new_ips) + len(rotate_out)
+            if self.operation_bucket is not None and not self.operation_bucket.try_acquire(operations):
+                with db.engine.begin() as connection:
+                    connection.execute(update(queue).where(queue.c.id.in_(claimed_ids)).values(next_attempt_at=now, claim_token=None))
+                return False
+            if self.request_bucket is not None:
+                self.request_bucket.acquire()
+            result["requests"] += 1
+            try:
+                resource_names = manager.apply_ip_exclusions(campaign_id, new_ips, [live[ip_address] for ip_address in rotate_out])
+            except Exception as e:
+                from src.services.google_ads_manager import describe_ads_error
+                self._record_failure(claimed, now, describe_ads_error(e), result)
+                return True
+        else:
+            resource_names = []
+
+        with db.engine.begin() as connection:
+            if rotate_out or stale:
+                connection.execute(delete(exclusions).where(campaign_filter, exclusions.c.ip_address.in_(rotate_out + stale)))
+            if new_ips:
+                connection.execute(insert(exclusions), [{"customer_id": customer_id, "campaign_id": campaign_id, "ip_address": ip_address,
+                                                         "resource_name": resource_name, "excluded_at": now}
+                                                        for ip_address, resource_name in zip(new_ips, resource_names)])
+            if claimed_ids:
+                connection.execute(delete(queue).where(queue.c.id.in_(claimed_ids)))
+        exclusion_cache.discard(key, rotate_out + stale)
+        result["excluded"] += len(new_ips)
+        result["rotated_out"] += len(rotate_out)
+        result["already_excluded"] += len(already)
+        return True
+
+    def _record_failure(self, claimed, now, error, result):
+        # The whole request failed (mutates are atomic): back off per row, give up after max_attempts
+        queue = AdsExclusionQueueItem.__table__
+        result["failed_requests"] += 1
+        print(f"ADS_WARN: Exclusion request for {len(claimed)} IPs failed: {error}")
+        dropped = 0
+        with db.engine.begin() as connection:
+            for row in claimed:
+                attempts = row.attempts + 1
+                if attempts >= self.max_attempts:
+                    connection.execute(delete(queue).where(queue.c.id == row.id))
+                    dropped += 1
+                    continue
+                backoff = min(ADS_EXCLUSION_POLL_SECONDS * 2 ** attempts, 3600)
+                connection.execute(update(queue).where(queue.c.id == row.id).values(
+                    attempts=attempts, last_error=str(error)[:1000], claim_token=None,
+                    next_attempt_at=now + timedelta(seconds=backoff)))
+        if dropped:
+            result["dropped"] += dropped
+            print(f"ADS_WARN: Dropped {dropped} IPs after {self.max_attempts} failed attempts.")
+
+    def stats(self):
+        """Returns the counters since start plus the current queue depth."""
+        with self._stats_lock:
+            counters = dict(self._counters)
+        table = AdsExclusionQueueItem.__table__
+        with db.engine.connect() as connection:
+            counters["queued"] = connection.execute(select(func.count()).select_from(table)).scalar()
+            counters["excluded_total"] = connection.execute(select(func.count()).select_from(AdsIpExclusion.__table__)).scalar()
+        from src.services.google_ads_manager import resource_cache
+        counters["resource_cache"] = resource_cache.stats()
+        counters["batch_size"] = self.batch_size
+        counters["list_limit"] = self.list_limit
+        return counters
+
+# Process-wide processor, started by the first enqueue
+exclusion_processor = ExclusionProcessor()
+
+ads_cli = AppGroup("ads", help="Google Ads IP exclusion queue.")
+
+@ads_cli.command("process-exclusions")
+@click.option("--force", is_flag=True, help="Also flush partial batches that have not waited ADS_EXCLUSION_MAX_DELAY_SECONDS.")
+def process_exclusions_command(force):
+    """Sends the due exclusion batches once (e.g. from cron, or with the web workers' loop disabled)."""
+    result = exclusion_processor.process(force=force)
+    click.echo(f"{result['requests']} requests: {result['excluded']} excluded, {result['rotated_out']} rotated out, "
+               f"{result['already_excluded']} already excluded, {result['failed_requests']} failed, {result['dropped']} dropped"
+               + (" (daily operation budget exhausted)" if result["deferred"] else ""))
+
+@ads_cli.command("exclusion-stats")
+def exclusion_stats_command():
+    """Queue depth and exclusion counts."""
+    for name, value in exclusion_processor.stats().items():
+        click.echo(f"{name}: {value}")
@@ -0,0 +1,128 @@
+# Benchmark: end-to-end live feed latency (POST /api/event -> 'live_events' on every dashboard) with N worker processes.
+#
+# Each worker is a separate Socket.IO server process; one dashboard client connects to each, and events are posted
+# round-robin. Without a message queue a client only sees the events recorded by its own worker.
+#
+# Usage:
+#   python bench_socketio_fanout.py --workers 1,2,4                                  # local fakeredis stand-in
+#   python bench_socketio_fanout.py --message-queue redis://localhost:6379/1 --workers 4
+#   python bench_socketio_fanout.py --no-queue --workers 1,2,4                       # in-process server, for comparison
+# Needs the Socket.IO client (pip install "python-socketio[client]"); the default stand-in needs fakeredis.
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import statistics
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Worker on port {port} did not start")
+
+def _start_fake_redis():
+    from fakeredis import TcpFakeServer
+    port = _free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+def serve(port):
+    """Worker process: the real app, as gunicorn would load it (configuration comes from the environment)."""
+    from src.main import app, socketio
+    socketio.run(app, host="127.0.0.1", port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+def run(workers, args, message_queue):
+    import requests
+    import socketio as socketio_client
+
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=args.database_url, SOCKETIO_MESSAGE_QUEUE=message_queue,
+               LIVE_FEED_WINDOW_MS=str(args.window_ms), RESPONSE_CACHE_MAX_ENTRIES="0")
+    ports = [_free_port() for _ in range(workers)]
+    processes = [subprocess.Popen([sys.executable, __file__, "--serve", str(port)], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for port in ports]
+    clients = []
+    try:
+        for port in ports:
+            _wait_for_port(port)
+        received = {} # (client index, url) -> receive time
+        lock = threading.Lock()
+        for index, port in enumerate(ports):
+            client = socketio_client.Client()
+            def on_live_events(batch, index=index):
+                now = time.perf_counter()
+                with lock:
+                    for event in batch.get("events", []):
+                        received.setdefault((index, event["url_accessed"]), now)
+            client.on("live_events", on_live_events, namespace="/tracking")
+            client.connect(f"http://127.0.0.1:{port}", namespaces=["/tracking"])
+            clients.append(client)
+        time.sleep(1) # Subscriptions are announced to the other workers
+
+        sent = {}
+        session = requests.Session()
+        for i in range(args.events):
+            url = f"/bench/{workers}/{i}"
+            sent[url] = time.perf_counter()
+            session.post(f"http://127.0.0.1:{ports[i % workers]}/api/event", json={"url_accessed": url}, timeout=10)
+            time.sleep(1.0 / args.rate)
+        deadline = time.monotonic() + 5
+        while len(received) < args.events * workers and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        latencies = [(at - sent[url]) * 1000 for (_, url), at in received.items() if url in sent]
+        delivered = len(latencies) / (args.events * workers) * 100
+        if not latencies:
+            print(f"{workers:>7} {'-':>9} {'-':>9} {'-':>9} {delivered:9.1f}%")
+            return
+        cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [latencies[0]] * 99
+        print(f"{workers:>7} {cuts[49]:9.1f} {cuts[94]:9.1f} {max(latencies):9.1f} {delivered:9.1f}%")
+    finally:
+        for client in clients:
+            client.disconnect()
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Time POST /api/event to 'live_events' delivery across N Socket.IO workers.")
+    parser.add_argument("--database-url", default="sqlite:///bench_fanout.db")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100, help="Events posted per second")
+    parser.add_argument("--window-ms", type=int, default=50, help="LIVE_FEED_WINDOW_MS for the workers")
+    parser.add_argument("--message-queue", default="", help="Socket.IO message queue URL (default: fakeredis stand-in)")
+    parser.add_argument("--no-queue", action="store_true", help="Run without a message queue")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve)
+
+    os.environ["SQLALCHEMY_DATABASE_URI"] = args.database_url
+    os.environ.pop("SOCKETIO_MESSAGE_QUEUE", None) # This process only creates the tables
+    from src.main import app, db
+    with app.app_context():
+        db.create_all()
+
+    message_queue = "" if args.no_queue else args.message_queue or _start_fake_redis()
+    print(f"Message queue: {message_queue or 'none (in-process)'}, window {args.window_ms} ms, "
+          f"{args.events} events at {args.rate:g}/s")
+    print(f"{'workers':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'delivered':>10}")
+    for workers in [int(count) for count in args.workers.split(",")]:
+        run(workers, args, message_queue)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Microbenchmark: suspicious User-Agent check with 10 / 1k / 10k signatures.
+# Compares the old linear `in` scan with the compiled automaton, uncached and behind the verdict cache.
+#
+# Usage:
+#   python bench_ua_matcher.py [--lookups 200000] [--distinct-uas 3000]
+import time
+import random
+import string
+import argparse
+from ua_matcher import AhoCorasick, UserAgentMatcher
+
+BROWSER_UAS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.3 Safari/605.1.15",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+]
+BOT_UAS = [
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "python-requests/2.32.3",
+    "curl/8.5.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/124.0.0.0 Safari/537.36",
+]
+REAL_SIGNATURES = ["bot", "crawler", "spider", "headless", "python-requests", "curl", "wget", "scrapy", "selenium", "puppeteer"]
+
+def make_signatures(count, rng):
+    signatures = list(REAL_SIGNATURES[:count])
+    while len(signatures) < count:
+        signatures.append("".join(rng.choice(string.ascii_lowercase + "-/") for _ in range(rng.randint(6, 14))))
+    return signatures
+
+def make_traffic(lookups, distinct, rng):
+    # Real traffic is dominated by a few thousand distinct UAs (browser builds + versions)
+    pool = []
+    for i in range(distinct):
+        base = rng.choice(BOT_UAS if i % 20 == 0 else BROWSER_UAS)
+        pool.append(f"{base} build/{i}")
+    return [rng.choice(pool) for _ in range(lookups)]
+
+def linear_scan(signatures):
+    def check(user_agent):
+        lowered = user_agent.lower()
+        for substring in signatures:
+            if substring in lowered:
+                return substring
+        return None
+    return check
+
+def timed(check, traffic):
+    started = time.perf_counter()
+    for user_agent in traffic:
+        check(user_agent)
+    elapsed = time.perf_counter() - started
+    return elapsed / len(traffic) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the User-Agent signature matcher.")
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--distinct-uas", type=int, default=3000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    traffic = make_traffic(args.lookups, args.distinct_uas, rng)
+
+    print(f"{args.lookups} lookups over {args.distinct_uas} distinct UAs (us per lookup)")
+    print(f"{'signatures':>10} {'linear':>10} {'automaton':>10} {'cached':>10} {'build ms':>10}")
+    for count in (10, 1000, 10000):
+        signatures = make_signatures(count, rng)
+        started = time.perf_counter()
+        automaton = AhoCorasick(signatures)
+        build_ms = (time.perf_counter() - started) * 1000
+        matcher = UserAgentMatcher(signatures, path="")
+        linear_us = timed(linear_scan(signatures), traffic)
+        automaton_us = timed(lambda user_agent: automaton.first_match(user_agent.lower()), traffic)
+        cached_us = timed(matcher.match, traffic)
+        print(f"{count:>10} {linear_us:>10.2f} {automaton_us:>10.2f} {cached_us:>10.2f} {build_ms:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,10 @@ import os
 from datetime import datetime, timedelta
 from src.main import db # Assuming db is initialized in main
 from src.models.event_log import EventLog # To query for IP frequency
+from src.services.ip_frequency import create_ip_frequency_tracker
+from src.services.ua_matcher import UserAgentMatcher
+from src.services.rule_engine import click_rule_engine, DEFAULT_RULES, RULE_TYPES
+from sqlalchemy import func
 
 # --- Configuration for Click Validation (can be moved to .env or a config file) ---
 CLICK_FREQ_LIMIT = int(os.getenv("CLICK_FREQ_LIMIT", "5"))
@@ -18,92 +22,130 @@ SUSPICIOUS_USER_AGENT_SUBSTRINGS = [
     "sogou", "exabot", "facebot", "ia_archiver"
 ]
 
+# Compiled matcher over SUSPICIOUS_USER_AGENT_SUBSTRINGS, or over UA_SIGNATURES_FILE when it is set (hot-reloaded)
+user_agent_matcher = UserAgentMatcher(SUSPICIOUS_USER_AGENT_SUBSTRINGS)
+
+# Sliding-window counter behind the ip_frequency rule; None means the legacy COUNT query (IP_FREQ_BACKEND=db)
+ip_frequency_tracker = create_ip_frequency_tracker(CLICK_FREQ_WINDOW_SECONDS)
+
 EMPTY_OR_GENERIC_USER_AGENTS = [
     "-", "", None, "mozilla/5.0", "generic browser"
 ]
 
+LOCAL_IP_ADDRESSES = ["127.0.0.1", "::1"]
+
+def recent_click_counts(ip_addresses):
+    """
+    Counts recent clicks for several IPs with one grouped query (used by batch ingestion).
+    :param ip_addresses: Iterable of IP address strings.
+    :return: Dictionary {ip_address: count}, or None if the database could not be queried.
+    """
+    ip_addresses = [ip for ip in set(ip_addresses) if ip and ip not in LOCAL_IP_ADDRESSES]
+    if not ip_addresses:
+        return {}
+    try:
+        time_window_start = datetime.utcnow() - timedelta(seconds=CLICK_FREQ_WINDOW_SECONDS)
+        rows = db.session.query(EventLog.ip_address, func.count(EventLog.id)).filter(
+            EventLog.ip_address.in_(ip_addresses),
+            EventLog.timestamp >= time_window_start
+        ).group_by(EventLog.ip_address).all()
+        return {ip: count for ip, count in rows}
+    except Exception as e:
+        print(f"DB_WARN: Could not check IP frequency for batch (DB might be unavailable or not migrated): {e}")
+        return None
+
+_default_rules = {} # parameter -> Rule built from DEFAULT_RULES, for the single-check methods below
+
+def _default_rule(parameter):
+    rule = _default_rules.get(parameter)
+    if rule is None:
+        definition = next(definition for definition in DEFAULT_RULES if definition["parameter"] == parameter)
+        rule = _default_rules[parameter] = RULE_TYPES[parameter](definition["name"], value=definition["value"])
+    return rule
+
 class ClickValidator:
-    def __init__(self, event_data, ip_address, user_agent):
+    def __init__(self, event_data, ip_address, user_agent, recent_clicks_count=None):
         """
         Initializes the ClickValidator.
         :param event_data: Dictionary containing data from the incoming request (e.g., URL, referer).
         :param ip_address: The IP address of the request.
         :param user_agent: The User-Agent string of the request.
+        :param recent_clicks_count: (Optional) Pre-computed clicks from this IP in the frequency window; skips the DB query.
         """
         self.event_data = event_data
         self.ip_address = ip_address
+        self.raw_user_agent = user_agent or ""
         self.user_agent = user_agent.lower() if user_agent else ""
+        self.recent_clicks_count = recent_clicks_count
+        self.campaign_country = None
         self.reasons = [] # To store reasons for invalidation
+        self.reason_codes = [] # Rule codes matching self.reasons (e.g. HIGH_IP_FREQUENCY)
 
+    # Single checks, kept for existing callers: each runs the rule engine's rule with its default settings
     def is_suspicious_user_agent(self):
-        """Checks if the User-Agent is suspicious."""
-        if not self.user_agent or self.user_agent in EMPTY_OR_GENERIC_USER_AGENTS:
-            self.reasons.append("Empty or Generic User Agent")
-            return True
-        
-        for substring in SUSPICIOUS_USER_AGENT_SUBSTRINGS:
-            if substring in self.user_agent:
-                self.reasons.append(f"Suspicious User Agent: contains \'{substring}\'")
-                return True
-        return False
+        """Checks if the User-Agent is empty, generic or suspicious (EmptyUserAgentRule, UserAgentSignatureRule)."""
+        return self._check_default_rules("user_agent_empty", "user_agent_blacklist")
 
     def is_high_frequency_ip(self):
-        """
-        Checks for high-frequency clicks from the same IP address.
-        This method requires database access and assumes EventLog model is available.
-        """
-        if not self.ip_address or self.ip_address in ["127.0.0.1", "::1"]:
-            return False # Do not check local IPs for frequency
-
-        try:
-            time_window_start = datetime.utcnow() - timedelta(seconds=CLICK_FREQ_WINDOW_SECONDS)
-            
-            # This query will only work if the database is up and migrated.
-            recent_clicks_count = EventLog.query.filter(
-                EventLog.ip_address == self.ip_address,
-                EventLog.timestamp >= time_window_start
-            ).count()
-            
-            if recent_clicks_count >= CLICK_FREQ_LIMIT:
-                self.reasons.append(f"High IP Frequency: {recent_clicks_count + 1} clicks in {CLICK_FREQ_WINDOW_SECONDS}s")
-                return True
-        except Exception as e:
-            # Log this error. For now, we assume it means DB is not ready.
-            print(f"DB_WARN: Could not check IP frequency for {self.ip_address} (DB might be unavailable or not migrated): {e}")
-            # Optionally, add a reason indicating inability to check, or simply pass
-            # self.reasons.append("IP Frequency Check Skipped: DB Unavailable")
-            return False # Fail open if DB check fails, or decide on a stricter policy
-        return False
+        """Checks for high-frequency clicks from the same IP address (IpFrequencyRule; records this click's hit)."""
+        return self._check_default_rules("ip_frequency")
 
     def is_inconsistent_geolocation(self, campaign_country=None):
         """
-        Checks if the click's geolocation is inconsistent with campaign targeting (if provided).
+        Checks if the click's geolocation is inconsistent with campaign targeting (GeoMismatchRule).
         :param campaign_country: The expected country for the campaign (e.g., 'BR').
         """
-        # This requires geo_data to be part of self.event_data or passed in
-        click_country = self.event_data.get("country") 
-        
-        if campaign_country and click_country:
-            if click_country.upper() != campaign_country.upper() and click_country not in ["Unknown", "Local"]:
-                self.reasons.append(f"Geolocation Mismatch: Click from {click_country}, expected {campaign_country}")
+        self.campaign_country = campaign_country
+        return self._check_default_rules("geo_mismatch")
+
+    def _check_default_rules(self, *parameters):
+        for parameter in parameters:
+            rule = _default_rule(parameter)
+            reason = rule.check(self)
+            if reason is not None:
+                self.reasons.append(reason)
+                self.reason_codes.append(rule.code)
                 return True
         return False
 
-    def validate(self, campaign_country=None):
+    def validate(self, campaign_country=None, mode=None):
         """
-        Runs all validation checks.
+        Runs the active click rules (see rule_engine.py), cheapest first.
         :param campaign_country: (Optional) Expected country for campaign targeting.
+        :param mode: (Optional) 'first_hit' or 'collect_all'; defaults to CLICK_RULES_MODE.
         :return: Tuple (is_valid: bool, reasons: list[str])
         """
-        # Run checks
-        self.is_suspicious_user_agent() # Appends to self.reasons if true
-        self.is_high_frequency_ip()     # Appends to self.reasons if true
-        # self.is_inconsistent_geolocation(campaign_country) # Example, needs geo_data in event_data
+        self.campaign_country = campaign_country
+        hits = click_rule_engine.evaluate(self, mode=mode)
+        self.reasons.extend(reason for _, reason in hits)
+        self.reason_codes.extend(rule.code for rule, _ in hits)
 
         if self.reasons:
             return False, self.reasons
         return True, []
 
+    @classmethod
+    def validate_batch(cls, events):
+        """
+        Validates a batch of events with a single frequency query for all distinct IPs.
+        Earlier events of the batch count towards the frequency of later ones from the same IP.
+        :param events: List of dicts with keys event_data, ip_address, user_agent and campaign_country.
+        :return: List of tuples (is_valid: bool, reasons: list[str]), in the same order.
+        """
+        # With a sliding-window tracker each validator records its own hit, which already covers the batch
+        counts = recent_click_counts(event["ip_address"] for event in events) if ip_frequency_tracker is None else None
+        seen_in_batch = {}
+        results = []
+        for event in events:
+            ip_address = event["ip_address"]
+            recent_clicks_count = None
+            if counts is not None: # Otherwise each validator falls back to (and fails open on) its own query
+                recent_clicks_count = counts.get(ip_address, 0) + seen_in_batch.get(ip_address, 0)
+            validator = cls(event["event_data"], ip_address, event["user_agent"], recent_clicks_count=recent_clicks_count)
+            results.append(validator.validate(campaign_country=event.get("campaign_country")))
+            seen_in_batch[ip_address] = seen_in_batch.get(ip_address, 0) + 1
+        return results
+
 # Example of how this might be integrated into the events.py route:
 # from src.services.click_validator import ClickValidator
 # ... inside /event route ...
@@ -3,6 +3,17 @@ from datetime import datetime
 
 class EventLog(db.Model):
     __tablename__ = 'event_logs'
+    # Access paths of /metrics, /logs, /export and the IP frequency check (see migrations/versions/8b4e6d2c1a57)
+    __table_args__ = (
+        # (timestamp, id) also serves the /logs keyset seek and its tie-break order (f2c6a1d9b834)
+        db.Index('ix_event_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_event_logs_ip_address_timestamp', 'ip_address', 'timestamp'),
+        db.Index('ix_event_logs_channel_timestamp', 'channel', 'timestamp'),
+        db.Index('ix_event_logs_country_timestamp', 'country', 'timestamp'),
+        db.Index('ix_event_logs_device_type_timestamp', 'device_type', 'timestamp'),
+        db.Index('ix_event_logs_invalid_timestamp', 'timestamp',
+                 postgresql_where=db.text('is_valid_click = false'), sqlite_where=db.text('is_valid_click = 0')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     ip_address = db.Column(db.String(45), nullable=False)
@@ -20,11 +31,26 @@ class EventLog(db.Model):
     device_type = db.Column(db.String(50), nullable=True) # e.g., mobile, desktop, tablet
     is_valid_click = db.Column(db.Boolean, default=True, nullable=False)
     invalid_reason = db.Column(db.String(255), nullable=True) # Reason if click is invalid
-    raw_request_data = db.Column(db.Text, nullable=True) # Store raw JSON payload for audit
+    # Raw JSON payload for audit lives in event_payloads so hot rows stay narrow
+    payload = db.relationship('EventPayload', uselist=False, cascade='all, delete-orphan',
+                              primaryjoin='EventLog.id == foreign(EventPayload.event_id)')
 
     def __repr__(self):
         return f'<EventLog {self.id} - {self.ip_address} at {self.timestamp}>'
 
+    @property
+    def raw_request_data(self):
+        return self.payload.raw_request_data if self.payload is not None else None
+
+    @raw_request_data.setter
+    def raw_request_data(self, value):
+        if value is None:
+            self.payload = None
+        elif self.payload is None:
+            self.payload = EventPayload(raw_request_data=value)
+        else:
+            self.payload.raw_request_data = value
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -45,7 +71,53 @@ class EventLog(db.Model):
             'invalid_reason': self.invalid_reason
         }
 
-# Placeholder for other models like User, InvalidClickRule, etc.
+class EventPayload(db.Model):
+    __tablename__ = 'event_payloads'
+
+    # No foreign key: on PostgreSQL event_logs is partitioned and its primary key is (id, timestamp)
+    event_id = db.Column(db.Integer, primary_key=True)
+    raw_request_data = db.Column(db.Text, nullable=True) # Store raw JSON payload for audit
+
+    def __repr__(self):
+        return f'<EventPayload {self.event_id}>'
+
+class EventReasonCode(db.Model):
+    __tablename__ = 'event_reason_codes'
+    # Structured form of EventLog.invalid_reason, one row per rule code (see rule_engine.reason_codes_for)
+    __table_args__ = (
+        db.Index('ix_event_reason_codes_code_event_id', 'code', 'event_id'),
+    )
+
+    # No foreign key, for the same reason as EventPayload
+    event_id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), primary_key=True) # e.g. HIGH_IP_FREQUENCY
+
+    def __repr__(self):
+        return f'<EventReasonCode {self.event_id} {self.code}>'
+
+class EventRollup(db.Model):
+    __tablename__ = 'event_rollups'
+    # One row per (grain, bucket, dimension combination, validity); maintained by src/services/rollups.py
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket_start', 'channel', 'country', 'device_type', 'is_valid_click',
+                            name='uq_event_rollups_bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(10), nullable=False) # minute, hour or day
+    bucket_start = db.Column(db.DateTime, nullable=False) # UTC, aligned to the grain
+    # Dimensions use '' for "unknown" so the unique constraint (and the upsert) also covers missing values
+    channel = db.Column(db.String(100), nullable=False, default='')
+    country = db.Column(db.String(100), nullable=False, default='')
+    device_type = db.Column(db.String(50), nullable=False, default='')
+    is_valid_click = db.Column(db.Boolean, nullable=False)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    ip_sketch = db.Column(db.LargeBinary, nullable=True) # Serialized HyperLogLog of ip_address (src/services/hyperloglog.py)
+
+    def __repr__(self):
+        return f'<EventRollup {self.grain} {self.bucket_start} {self.event_count}>'
+
+# Placeholder for other models like User, etc.
 # class User(db.Model):
 #     id = db.Column(db.Integer, primary_key=True)
 #     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -54,14 +126,55 @@ class EventLog(db.Model):
 #     def __repr__(self):
 #         return f'<User {self.username}>'
 
-# class InvalidClickRule(db.Model):
-#     id = db.Column(db.Integer, primary_key=True)
-#     name = db.Column(db.String(100), nullable=False)
-#     parameter = db.Column(db.String(100), nullable=False) # e.g., ip_frequency, user_agent_blacklist
-#     value = db.Column(db.String(255), nullable=False) # e.g., 5 (clicks), "crawler|bot"
-#     time_window_seconds = db.Column(db.Integer, nullable=True) # For frequency rules
-#     is_active = db.Column(db.Boolean, default=True)
+class InvalidClickRule(db.Model):
+    __tablename__ = 'invalid_click_rules'
 
-#     def __repr__(self):
-#         return f'<InvalidClickRule {self.name}>'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    parameter = db.Column(db.String(100), nullable=False) # e.g., ip_frequency, user_agent_blacklist
+    value = db.Column(db.String(255), nullable=False) # e.g., 5 (clicks), "crawler|bot"
+    time_window_seconds = db.Column(db.Integer, nullable=True) # For frequency rules
+    is_active = db.Column(db.Boolean, default=True)
+    cost = db.Column(db.Integer, nullable=True) # Evaluation order override; defaults per parameter (cheap rules first)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow) # Drives hot reload
 
+    def __repr__(self):
+        return f'<InvalidClickRule {self.name}>'
+
+class AdsExclusionQueueItem(db.Model):
+    __tablename__ = 'ads_exclusion_queue'
+    # Invalid-click IPs waiting for a batched Google Ads exclusion (see src/services/ads_exclusion_queue.py)
+    __table_args__ = (
+        db.UniqueConstraint('customer_id', 'campaign_id', 'ip_address', name='uq_ads_exclusion_queue_target'),
+        db.Index('ix_ads_exclusion_queue_next_attempt_at', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.String(20), nullable=False)
+    campaign_id = db.Column(db.String(20), nullable=False)
+    ip_address = db.Column(db.String(45), nullable=False)
+    reason = db.Column(db.String(255), nullable=True) # Reason codes of the click that queued it
+    enqueued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Pushed back after a failed mutate
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    claim_token = db.Column(db.String(32), nullable=True) # Set by the worker currently sending the row
+
+    def __repr__(self):
+        return f'<AdsExclusionQueueItem {self.campaign_id} {self.ip_address}>'
+
+class AdsIpExclusion(db.Model):
+    __tablename__ = 'ads_ip_exclusions'
+    # IPs currently excluded per campaign: the de-duplication cache, and the rotation order when a campaign is full
+    __table_args__ = (
+        db.Index('ix_ads_ip_exclusions_campaign_excluded_at', 'customer_id', 'campaign_id', 'excluded_at'),
+    )
+
+    customer_id = db.Column(db.String(20), primary_key=True)
+    campaign_id = db.Column(db.String(20), primary_key=True)
+    ip_address = db.Column(db.String(45), primary_key=True)
+    resource_name = db.Column(db.String(255), nullable=True) # Campaign criterion, needed to remove it again
+    excluded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AdsIpExclusion {self.campaign_id} {self.ip_address}>'
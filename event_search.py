@@ -0,0 +1,132 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/event_search.py
+import os
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Integer, column, insert, select, text
+from src.main import db
+from src.models.event_log import EventLog, EventReasonCode
+from src.services.rule_engine import reason_codes_for
+
+# --- Configuration for /logs substring search (can be overridden in .env) ---
+# 'auto' uses the FTS5 shadow table on SQLite when it exists; 'off' always falls back to ILIKE scans
+LOG_SEARCH_INDEX = os.getenv("LOG_SEARCH_INDEX", "auto").lower()
+
+SEARCH_COLUMNS = ("user_agent", "url_accessed", "invalid_reason")
+FTS_TABLE = "event_logs_fts"
+MIN_TRIGRAM_TERM = 3 # Shorter terms have no trigram to look up; they use the ILIKE scan
+
+# Same statements as migrations/versions/a7e3c5d1f640 (used for databases built with db.create_all())
+SQLITE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "user_agent, url_accessed, invalid_reason, content='event_logs', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS event_logs_fts_ai AFTER INSERT ON event_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, user_agent, url_accessed, invalid_reason) "
+    "VALUES (new.id, new.user_agent, new.url_accessed, new.invalid_reason); END",
+    f"CREATE TRIGGER IF NOT EXISTS event_logs_fts_ad AFTER DELETE ON event_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_agent, url_accessed, invalid_reason) "
+    "VALUES ('delete', old.id, old.user_agent, old.url_accessed, old.invalid_reason); END",
+    f"CREATE TRIGGER IF NOT EXISTS event_logs_fts_au AFTER UPDATE ON event_logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_agent, url_accessed, invalid_reason) "
+    "VALUES ('delete', old.id, old.user_agent, old.url_accessed, old.invalid_reason); "
+    f"INSERT INTO {FTS_TABLE}(rowid, user_agent, url_accessed, invalid_reason) "
+    "VALUES (new.id, new.user_agent, new.url_accessed, new.invalid_reason); END",
+]
+POSTGRESQL_TRGM_DDL = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS ix_event_logs_{name}_trgm ON event_logs USING gin ({name} gin_trgm_ops)"
+    for name in SEARCH_COLUMNS
+]
+
+_fts_available = None
+
+def fts_available():
+    """True if the SQLite FTS5 shadow table exists (checked once per process)."""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = False
+        if db.engine.dialect.name == "sqlite":
+            try:
+                found = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                           {"name": FTS_TABLE}).first()
+                _fts_available = found is not None
+            except Exception as e:
+                print(f"DB_WARN: Could not check for the {FTS_TABLE} search table: {e}")
+    return _fts_available
+
+def contains_filter(column_name, term):
+    """
+    Case-insensitive substring filter on a searchable EventLog column.
+    PostgreSQL answers the ILIKE from the pg_trgm GIN index; SQLite looks the term up in the FTS5
+    trigram table. Terms shorter than a trigram (or LOG_SEARCH_INDEX=off) use the plain ILIKE scan.
+    """
+    if LOG_SEARCH_INDEX == "off" or len(term) < MIN_TRIGRAM_TERM or not fts_available():
+        return getattr(EventLog, column_name).ilike(f"%{term}%")
+    phrase = '"' + term.replace('"', '""') + '"' # Phrase query: the trigrams must be contiguous, i.e. a substring
+    matches = text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match_{column_name}").bindparams(
+        **{f"match_{column_name}": f"{column_name} : {phrase}"}
+    ).columns(column("rowid", Integer))
+    return EventLog.id.in_(matches)
+
+def reason_code_filter(code):
+    """Equality filter on the structured reason codes (see rule_engine.RULE_TYPES) of an event."""
+    return EventLog.id.in_(select(EventReasonCode.event_id).where(EventReasonCode.code == code))
+
+def index_events(connection, ids, rows):
+    """
+    Writes the reason codes for newly inserted events, in the same transaction as the events.
+    :param ids: EventLog IDs, in the same order as `rows`.
+    :param rows: Dictionaries keyed by EventLog column name.
+    """
+    code_rows = [{"event_id": event_id, "code": code}
+                 for event_id, row in zip(ids, rows) for code in reason_codes_for(row.get("invalid_reason"))]
+    if code_rows:
+        connection.execute(insert(EventReasonCode.__table__), code_rows)
+
+def ensure_search_indexes():
+    """Creates the trigram indexes (PostgreSQL) or the FTS5 table and its triggers (SQLite), then fills it."""
+    global _fts_available
+    dialect = db.engine.dialect.name
+    with db.engine.begin() as connection:
+        if dialect == "postgresql":
+            for statement in POSTGRESQL_TRGM_DDL:
+                connection.execute(text(statement))
+        elif dialect == "sqlite":
+            for statement in SQLITE_FTS_DDL:
+                connection.execute(text(statement))
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')"))
+    _fts_available = None
+    return dialect
+
+def backfill_reason_codes(batch_size=10000):
+    """Derives reason codes for invalid events that don't have any yet. Returns the number of codes written."""
+    written = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            batch = connection.execute(
+                select(EventLog.id, EventLog.invalid_reason)
+                .where(EventLog.id > last_id, EventLog.is_valid_click == False, EventLog.invalid_reason.isnot(None))
+                .where(~EventLog.id.in_(select(EventReasonCode.event_id)))
+                .order_by(EventLog.id).limit(batch_size)
+            ).all()
+            if not batch:
+                return written
+            index_events(connection, [row.id for row in batch], [{"invalid_reason": row.invalid_reason} for row in batch])
+            written += sum(len(reason_codes_for(row.invalid_reason)) for row in batch)
+            last_id = batch[-1].id
+
+search_cli = AppGroup("search", help="Substring search indexes and reason codes for /api/logs.")
+
+@search_cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Creates (or rebuilds) the search indexes for the current database."""
+    try:
+        dialect = ensure_search_indexes()
+    except Exception as e:
+        raise click.ClickException(f"Could not create search indexes: {e}")
+    click.echo(f"Search indexes ready ({dialect}).")
+
+@search_cli.command("backfill-reason-codes")
+@click.option("--batch-size", default=10000, show_default=True, type=int)
+def backfill_reason_codes_command(batch_size):
+    """Fills event_reason_codes for events recorded before reason codes existed."""
+    click.echo(f"Wrote {backfill_reason_codes(batch_size)} reason codes.")
@@ -0,0 +1,319 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/event_storage.py
+import os
+import gzip
+import json
+import hashlib
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from src.main import db
+from src.models.event_log import EventLog, EventPayload, EventReasonCode
+from src.services.rule_engine import reason_codes_for
+
+# --- Configuration for event storage tiering (can be overridden in .env) ---
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "180")) # Hot data kept in the database
+EVENT_ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR", "event_archive")
+EVENT_PARTITIONS_AHEAD = int(os.getenv("EVENT_PARTITIONS_AHEAD", "2")) # Future monthly partitions kept ready (PostgreSQL)
+ARCHIVE_EXPORT_BATCH_ROWS = 5000
+MANIFEST_NAME = "manifest.json"
+
+# Partitions are monthly. On PostgreSQL they are native range partitions named event_logs_pYYYYMM
+# (see migrations/versions/c7d91e4f2b08). SQLite has no partitioning, so a partition there is the
+# same month range of the single event_logs table and dropping it is a range DELETE on the timestamp index.
+# Rows that landed in event_logs_default (no monthly partition existed yet) are listed per month as
+# event_logs_default_pYYYYMM; those ranges are archived with a DELETE since the default partition stays.
+
+def _month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+def _next_month(moment):
+    return datetime(moment.year + (moment.month == 12), moment.month % 12 + 1, 1)
+
+def _partition_name(month_start):
+    return f"event_logs_p{month_start:%Y%m}"
+
+def _is_postgresql():
+    return db.engine.dialect.name == "postgresql"
+
+def list_partitions():
+    """
+    Returns the monthly partitions holding data, oldest first, as dicts {name, start, end, drop}.
+    drop is False for month ranges that can only be deleted from a shared table (SQLite, event_logs_default).
+    """
+    if _is_postgresql():
+        rows = db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'event_logs' AND c.relname LIKE 'event_logs_p%' "
+            "ORDER BY c.relname"
+        )).scalars().all()
+        partitions = [_partition(datetime.strptime(name[len("event_logs_p"):], "%Y%m"), _partition_name, True)
+                      for name in rows]
+        if db.session.execute(text("SELECT to_regclass('event_logs_default') IS NOT NULL")).scalar():
+            default_months = db.session.execute(text(
+                "SELECT DISTINCT date_trunc('month', timestamp) FROM event_logs_default"
+            )).scalars().all()
+            partitions.extend(_partition(month, lambda month: f"event_logs_default_p{month:%Y%m}", False)
+                              for month in default_months)
+        return sorted(partitions, key=lambda partition: partition["start"])
+    # Emulated partitions: every month that still has rows (answered from ix_event_logs_timestamp_id)
+    month_keys = db.session.query(db.func.strftime("%Y%m", EventLog.timestamp)).distinct().all()
+    months = sorted(datetime.strptime(key, "%Y%m") for (key,) in month_keys if key)
+    return [_partition(month, _partition_name, False) for month in months]
+
+def _partition(month, name, drop):
+    return {"name": name(month), "start": month, "end": _next_month(month), "drop": drop}
+
+def ensure_partitions(months_ahead=EVENT_PARTITIONS_AHEAD):
+    """
+    Creates the partitions for the current month and the next `months_ahead` months (PostgreSQL only).
+    Rows outside every partition land in event_logs_default, so a missed run never fails inserts; the next
+    run moves that month's rows out of event_logs_default into the new partition (see _create_partition).
+    Each month commits on its own, so one failing month is logged and the later ones are still created.
+    :return: Names of the partitions that were created.
+    """
+    if not _is_postgresql():
+        return []
+    created = []
+    month = _month_start(datetime.utcnow())
+    for _ in range(months_ahead + 1):
+        name = _partition_name(month)
+        try:
+            exists = db.session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+            if not exists:
+                _create_partition(name, month, _next_month(month))
+                created.append(name)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"DB_WARN: Could not create partition {name}: {e}")
+        month = _next_month(month)
+    return created
+
+def _create_partition(name, start, end):
+    # A plain CREATE ... PARTITION OF fails once event_logs_default holds rows of the range, so the table is
+    # built detached, those rows are moved into it and it is attached last, all in the caller's transaction
+    bounds = {"start": start, "end": end}
+    db.session.execute(text(f"CREATE TABLE {name} (LIKE event_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if db.session.execute(text("SELECT to_regclass('event_logs_default') IS NOT NULL")).scalar():
+        db.session.execute(text(
+            f"INSERT INTO {name} SELECT * FROM event_logs_default WHERE timestamp >= :start AND timestamp < :end"
+        ), bounds)
+        db.session.execute(text("DELETE FROM event_logs_default WHERE timestamp >= :start AND timestamp < :end"), bounds)
+    # Attaching creates the partition's copies of the event_logs indexes and primary key
+    db.session.execute(text(
+        f"ALTER TABLE event_logs ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+# --- Archive segments ---
+def _manifest_path(archive_dir):
+    return os.path.join(archive_dir, MANIFEST_NAME)
+
+def read_manifest(archive_dir=EVENT_ARCHIVE_DIR):
+    """Returns the list of archived segments ({file, start, end, rows, sha256}), newest first."""
+    try:
+        with open(_manifest_path(archive_dir), encoding="utf-8") as f:
+            segments = json.load(f)
+    except FileNotFoundError:
+        return []
+    return sorted(segments, key=lambda segment: segment["start"], reverse=True)
+
+def hot_range_start(archive_dir=EVENT_ARCHIVE_DIR):
+    """
+    Start of the range still in the database: the end of the newest archived segment (partitions are archived
+    oldest first), or None if nothing has been archived.
+    """
+    segments = read_manifest(archive_dir)
+    return max(datetime.fromisoformat(segment["end"]) for segment in segments) if segments else None
+
+def _write_manifest(archive_dir, segments):
+    tmp_path = _manifest_path(archive_dir) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(segments, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _manifest_path(archive_dir))
+
+def _archive_row(event, raw_request_data):
+    row = event.to_dict()
+    row["raw_request_data"] = raw_request_data
+    return row
+
+def _segment_contents(segment_path):
+    """Returns (rows, sha256, sum of event IDs) of an existing segment; rows and sha256 as archive_partition records them."""
+    rows = id_sum = 0
+    digest = hashlib.sha256()
+    with gzip.open(segment_path, "rb") as f:
+        for line in f:
+            digest.update(line)
+            id_sum += json.loads(line)["id"]
+            rows += 1
+    return rows, digest.hexdigest(), id_sum
+
+def _manifest_entry(file_name, partition, rows, sha256):
+    return {
+        "file": file_name,
+        "start": partition["start"].isoformat(),
+        "end": partition["end"].isoformat(),
+        "rows": rows,
+        "sha256": sha256,
+        "archived_at": datetime.utcnow().isoformat()
+    }
+
+def archive_partition(partition, archive_dir=EVENT_ARCHIVE_DIR):
+    """
+    Exports one partition into a compressed, read-only NDJSON segment (newest rows first),
+    records it in the manifest, then drops the partition and its payload rows.
+    Resumes a run that stopped after writing the segment: if the segment holds exactly the rows still
+    in the database, it is kept (and recorded if the manifest missed it) and only the drop is redone.
+    :return: Number of rows archived.
+    :raises FileExistsError: If a segment exists but does not match the rows in the database.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    file_name = f"{partition['name']}.ndjson.gz"
+    segment_path = os.path.join(archive_dir, file_name)
+    in_range = [EventLog.timestamp >= partition["start"], EventLog.timestamp < partition["end"]]
+    if os.path.exists(segment_path):
+        rows = _resume_archived_partition(partition, archive_dir, file_name, segment_path, in_range)
+        _drop_archived_partition(partition, in_range)
+        return rows
+
+    query = db.session.query(EventLog, EventPayload.raw_request_data).outerjoin(
+        EventPayload, EventPayload.event_id == EventLog.id
+    ).filter(*in_range).order_by(EventLog.timestamp.desc(), EventLog.id.desc())
+
+    rows = 0
+    digest = hashlib.sha256()
+    tmp_path = segment_path + ".tmp"
+    with open(tmp_path, "wb") as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode="wb") as f:
+            for event, raw_request_data in query.yield_per(ARCHIVE_EXPORT_BATCH_ROWS):
+                line = (json.dumps(_archive_row(event, raw_request_data)) + "\n").encode("utf-8")
+                f.write(line)
+                digest.update(line)
+                rows += 1
+        raw_file.flush()
+        os.fsync(raw_file.fileno())
+    os.replace(tmp_path, segment_path)
+    os.chmod(segment_path, 0o444)
+
+    segments = [segment for segment in read_manifest(archive_dir) if segment["file"] != file_name]
+    segments.append(_manifest_entry(file_name, partition, rows, digest.hexdigest()))
+    _write_manifest(archive_dir, segments)
+
+    # Only drop once the segment and manifest are durable
+    _drop_archived_partition(partition, in_range)
+    return rows
+
+def _resume_archived_partition(partition, archive_dir, file_name, segment_path, in_range):
+    rows, sha256, id_sum = _segment_contents(segment_path)
+    segments = read_manifest(archive_dir)
+    recorded = next((segment for segment in segments if segment["file"] == file_name), None)
+    if recorded and (recorded["rows"], recorded["sha256"]) != (rows, sha256):
+        raise FileExistsError(f"Archive segment {segment_path} does not match its manifest entry; segments are immutable")
+    # Same count and ID sum: the rows still in the database are the ones the segment holds (not late arrivals)
+    rows_in_db, id_sum_in_db = db.session.query(db.func.count(EventLog.id), db.func.sum(EventLog.id)).filter(*in_range).one()
+    if (rows_in_db, id_sum_in_db or 0) != (rows, id_sum):
+        raise FileExistsError(
+            f"Archive segment {segment_path} does not hold the {rows_in_db} rows in the database; "
+            f"segments are immutable"
+        )
+    if recorded is None: # Stopped between writing the segment and the manifest
+        segments.append(_manifest_entry(file_name, partition, rows, sha256))
+        _write_manifest(archive_dir, segments)
+    return rows
+
+def _drop_archived_partition(partition, in_range):
+    ids_in_range = db.session.query(EventLog.id).filter(*in_range)
+    db.session.query(EventPayload).filter(EventPayload.event_id.in_(ids_in_range)).delete(synchronize_session=False)
+    db.session.query(EventReasonCode).filter(EventReasonCode.event_id.in_(ids_in_range)).delete(synchronize_session=False)
+    if _is_postgresql() and partition.get("drop", True):
+        db.session.execute(text(f"DROP TABLE {partition['name']}"))
+    else:
+        db.session.query(EventLog).filter(*in_range).delete(synchronize_session=False)
+    db.session.commit()
+
+def archive_expired_partitions(retention_days=EVENT_RETENTION_DAYS, archive_dir=EVENT_ARCHIVE_DIR):
+    """
+    Archives and drops every partition that ends before the retention window.
+    :return: List of (partition name, rows archived).
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    archived = []
+    for partition in list_partitions():
+        if partition["end"] <= cutoff:
+            archived.append((partition["name"], archive_partition(partition, archive_dir)))
+    return archived
+
+# --- Reading archived ranges ---
+def archived_row_matches(row, filters_dict):
+    """
+    Applies the /logs and /export filters to an archived row (a to_dict() shaped dictionary).
+    Dates in filters_dict are datetimes; the other keys are the raw query parameters.
+    """
+    timestamp = row["timestamp"].rstrip("Z")
+    if filters_dict.get("start_date") and timestamp < filters_dict["start_date"].isoformat():
+        return False
+    if filters_dict.get("end_date") and timestamp > filters_dict["end_date"].isoformat():
+        return False
+    for key in ("channel", "country", "device_type", "ip_address"):
+        if filters_dict.get(key) and row.get(key) != filters_dict[key]:
+            return False
+    for key, column in (("user_agent_contains", "user_agent"), ("url_accessed_contains", "url_accessed"), ("invalid_reason_contains", "invalid_reason")):
+        if filters_dict.get(key) and filters_dict[key].lower() not in (row.get(column) or "").lower():
+            return False
+    if filters_dict.get("reason_code") and filters_dict["reason_code"] not in reason_codes_for(row.get("invalid_reason")):
+        return False
+    status = (filters_dict.get("status") or "all").lower()
+    if status == "valid" and not row["is_valid_click"]:
+        return False
+    if status == "invalid" and row["is_valid_click"]:
+        return False
+    return True
+
+def iter_archived_events(filters_dict, archive_dir=EVENT_ARCHIVE_DIR):
+    """
+    Yields archived rows matching the filters, newest first, reading only the segments that overlap
+    the requested date range. raw_request_data is dropped so rows match EventLog.to_dict().
+    """
+    start_date, end_date = filters_dict.get("start_date"), filters_dict.get("end_date")
+    for segment in read_manifest(archive_dir):
+        if start_date and datetime.fromisoformat(segment["end"]) <= start_date:
+            continue
+        if end_date and datetime.fromisoformat(segment["start"]) > end_date:
+            continue
+        with gzip.open(os.path.join(archive_dir, segment["file"]), "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if archived_row_matches(row, filters_dict):
+                    row.pop("raw_request_data", None)
+                    yield row
+
+# --- CLI: flask storage ensure-partitions | archive | list ---
+storage_cli = AppGroup("storage", help="Event storage tiering: partitions and archive segments.")
+
+@storage_cli.command("ensure-partitions")
+@click.option("--months-ahead", default=EVENT_PARTITIONS_AHEAD, show_default=True)
+def ensure_partitions_command(months_ahead):
+    """Create the current and upcoming monthly partitions (PostgreSQL)."""
+    created = ensure_partitions(months_ahead)
+    click.echo(f"Created partitions: {', '.join(created) if created else 'none'}")
+
+@storage_cli.command("archive")
+@click.option("--retention-days", default=EVENT_RETENTION_DAYS, show_default=True)
+def archive_command(retention_days):
+    """Archive and drop partitions older than the retention window."""
+    archived = archive_expired_partitions(retention_days)
+    for name, rows in archived:
+        click.echo(f"Archived {rows} rows from {name}")
+    if not archived:
+        click.echo("Nothing to archive.")
+
+@storage_cli.command("list")
+def list_command():
+    """Show hot partitions and archived segments."""
+    for partition in list_partitions():
+        click.echo(f"hot      {partition['name']}  {partition['start']:%Y-%m-%d} .. {partition['end']:%Y-%m-%d}")
+    for segment in read_manifest():
+        click.echo(f"archived {segment['file']}  {segment['start'][:10]} .. {segment['end'][:10]}  {segment['rows']} rows")
@@ -0,0 +1,200 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/event_writer.py
+import os
+import time
+import threading
+from sqlalchemy import insert
+from src.main import db
+from src.models.event_log import EventLog, EventPayload
+from src.services.rollups import record_events
+from src.services.event_search import index_events
+
+# --- Configuration for EventLog writes (can be overridden in .env) ---
+EVENT_WRITE_MODE = os.getenv("EVENT_WRITE_MODE", "single").lower() # 'single' (commit per event) or 'group'
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "200"))
+GROUP_COMMIT_MAX_DELAY_MS = int(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "20"))
+GROUP_COMMIT_WAIT_TIMEOUT_SECONDS = float(os.getenv("GROUP_COMMIT_WAIT_TIMEOUT_SECONDS", "10"))
+
+def insert_event_rows(connection, rows):
+    """
+    Inserts EventLog rows as one multi-row INSERT ... RETURNING id (plus their payloads, reason codes and rollup increments).
+    :param connection: SQLAlchemy connection inside an open transaction.
+    :param rows: List of dictionaries keyed by EventLog column name.
+    :return: List of new IDs, in the same order as `rows`.
+    """
+    if not rows:
+        return []
+    rows = [dict(row) for row in rows]
+    payloads = [row.pop("raw_request_data", None) for row in rows] # Stored in the event_payloads side table
+    table = EventLog.__table__
+    statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    ids = [row.id for row in connection.execute(statement, rows)]
+    payload_rows = [{"event_id": row_id, "raw_request_data": payload} for row_id, payload in zip(ids, payloads) if payload is not None]
+    if payload_rows:
+        connection.execute(insert(EventPayload.__table__), payload_rows)
+    index_events(connection, ids, rows)
+    record_events(connection, rows)
+    return ids
+
+class PendingWrite:
+    """Handle returned to the caller of GroupCommitWriter.submit()."""
+    def __init__(self, row):
+        self.row = row
+        self.id = None
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _resolve(self, row_id=None, error=None):
+        with self._lock:
+            self.id = row_id
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception as e:
+            print(f"DB_WARN: Callback for a group-committed row failed: {e}")
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback(pending) once the row's group has been committed or has failed (on the flusher
+        thread, inside the app context), or right away if that already happened.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def wait(self, timeout=GROUP_COMMIT_WAIT_TIMEOUT_SECONDS):
+        """
+        Blocks until the row's group has been committed.
+        :return: The new EventLog ID.
+        :raises: The database error if this row was not persisted, TimeoutError if no flush happened in time.
+                 A timed-out row is still queued and will normally be written; see add_done_callback().
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("Group commit did not complete in time")
+        if self.error is not None:
+            raise self.error
+        return self.id
+
+class GroupCommitWriter:
+    def __init__(self, max_rows=GROUP_COMMIT_MAX_ROWS, max_delay_ms=GROUP_COMMIT_MAX_DELAY_MS):
+        """
+        Gathers EventLog rows from concurrent requests and flushes them in a single transaction.
+        A flush happens when `max_rows` rows are pending or `max_delay_ms` has passed since the oldest one.
+        """
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000.0
+        self._pending = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._app = None
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._counters = {"rows": 0, "flushes": 0, "failed_rows": 0, "batch_fallbacks": 0}
+
+    def submit(self, app, row):
+        """
+        Queues a row for the next group commit.
+        :param app: The Flask application; the flusher thread pushes its app context.
+        :param row: Dictionary keyed by EventLog column name.
+        :return: PendingWrite whose wait() returns the new ID.
+        """
+        self._ensure_started(app)
+        pending = PendingWrite(row)
+        with self._condition:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(pending)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_rows:
+                self._condition.notify() # Start the delay timer, or flush a full group early
+        return pending
+
+    def write(self, app, row, timeout=GROUP_COMMIT_WAIT_TIMEOUT_SECONDS):
+        """Submits a row and waits for its commit. Returns the new ID."""
+        return self.submit(app, row).wait(timeout)
+
+    def _ensure_started(self, app):
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is None:
+                # Started lazily so each gunicorn worker gets its own flusher after the fork
+                self._app = app
+                self._thread = threading.Thread(target=self._run, name="event-group-commit", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                while len(self._pending) < self.max_rows:
+                    remaining = self._oldest + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_rows]
+                self._pending = self._pending[self.max_rows:]
+                self._oldest = time.monotonic() if self._pending else None
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # The only flusher must survive (e.g. app_context() failing); fail the rows it didn't settle
+                print(f"DB_WARN: Group commit flush of {len(batch)} rows failed: {e}")
+                unresolved = [pending for pending in batch if not pending._done.is_set()]
+                for pending in unresolved:
+                    pending._resolve(error=e)
+                self._record(0, failed_rows=len(unresolved))
+
+    def _flush(self, batch):
+        with self._app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    ids = insert_event_rows(connection, [p.row for p in batch])
+                for pending, row_id in zip(batch, ids):
+                    pending._resolve(row_id=row_id)
+                self._record(len(batch), flushes=1)
+                return
+            except Exception as e:
+                print(f"DB_WARN: Group commit of {len(batch)} rows failed, retrying rows individually: {e}")
+                self._record(0, batch_fallbacks=1)
+
+            # One bad row must not fail its neighbours: fall back to a transaction per row
+            for pending in batch:
+                try:
+                    with db.engine.begin() as connection:
+                        pending._resolve(row_id=insert_event_rows(connection, [pending.row])[0])
+                    self._record(1, flushes=1)
+                except Exception as e:
+                    print(f"Error saving event: {e}")
+                    pending._resolve(error=e)
+                    self._record(0, failed_rows=1)
+
+    def _record(self, rows, flushes=0, failed_rows=0, batch_fallbacks=0):
+        with self._stats_lock:
+            self._counters["rows"] += rows
+            self._counters["flushes"] += flushes
+            self._counters["failed_rows"] += failed_rows
+            self._counters["batch_fallbacks"] += batch_fallbacks
+
+    def stats(self):
+        """Returns row/flush counters and the average number of rows per flush."""
+        with self._stats_lock:
+            counters = dict(self._counters)
+        with self._condition:
+            counters["pending"] = len(self._pending)
+        counters["avg_rows_per_flush"] = round(counters["rows"] / counters["flushes"], 2) if counters["flushes"] else 0.0
+        counters["max_rows"] = self.max_rows
+        counters["max_delay_ms"] = int(self.max_delay * 1000)
+        return counters
+
+# Process-wide writer, only used when EVENT_WRITE_MODE=group
+event_writer = GroupCommitWriter()
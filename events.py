@@ -1,25 +1,57 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from src.main import db, socketio # Assuming db and socketio are initialized in main
 from src.models.event_log import EventLog # Import the EventLog model
 from src.services.click_validator import ClickValidator # Import the ClickValidator
+from src.services.geo_cache import geo_cache
+from src.services.geo_ip_table import get_ip_range_table
+from src.services.ingest_pipeline import IngestPipeline, INGEST_MODE
+from src.services.event_writer import event_writer, insert_event_rows, EVENT_WRITE_MODE
+from src.services.rollups import record_events, sketch_buffer
+from src.services.event_search import index_events
+from src.services.serialization import event_row_dict
+from src.services.live_feed import live_feed, parse_subscription
+from src.services.ads_exclusion_queue import exclusion_candidate, enqueue_exclusions
+from src.services.instrumentation import timed_stage, record_validation
 from datetime import datetime
 import json
 import os
+import hmac
+import uuid
 import requests # For ipapi.co
 
 events_bp = Blueprint("events", __name__)
 
-# --- Helper function to get Geolocation Data ---
-def get_geolocation_data(ip_address):
-    if not ip_address or ip_address == "127.0.0.1" or ip_address == "::1": # Avoid local/invalid IPs
-        return {
-            "country": "Local",
-            "city": "Local",
-            "region": "Local",
-            "isp": "Local Network",
-            "latitude": None,
-            "longitude": None
-        }
+# "remote" calls ipapi.co (behind geo_cache); "local" uses the compiled IP-range table (see geo_ip_table.py)
+GEO_PROVIDER = os.getenv("GEO_PROVIDER", "remote").lower()
+
+# Bulk ingestion (POST /api/events/batch)
+EVENT_BATCH_MAX_ITEMS = int(os.getenv("EVENT_BATCH_MAX_ITEMS", "1000"))
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonlines")
+# Per-item ip_address/user_agent in a batch are only honoured with "Authorization: Bearer <token>"; otherwise the
+# request's own headers are used, so anonymous callers can't forge one IP per item
+EVENT_COLLECTOR_TOKEN = os.getenv("EVENT_COLLECTOR_TOKEN", "")
+
+LOCAL_GEOLOCATION = {
+    "country": "Local",
+    "city": "Local",
+    "region": "Local",
+    "isp": "Local Network",
+    "latitude": None,
+    "longitude": None
+}
+
+UNKNOWN_GEOLOCATION = {
+    "country": "Unknown",
+    "city": "Unknown",
+    "region": "Unknown",
+    "isp": "Unknown",
+    "latitude": None,
+    "longitude": None
+}
+
+# --- Helper functions to get Geolocation Data ---
+def _fetch_geolocation_remote(ip_address):
+    """Calls ipapi.co. Returns a tuple (geo_data, ok) so failures can be cached with a shorter TTL."""
     try:
         # IPAPI_CO_KEY is optional for ipapi.co, but good to have if you have a key for higher limits
         # api_key = os.getenv("IPAPI_CO_KEY") 
@@ -35,95 +67,337 @@ def get_geolocation_data(ip_address):
             "isp": data.get("org"),
             "latitude": data.get("latitude"),
             "longitude": data.get("longitude")
-        }
+        }, True
     except requests.exceptions.RequestException as e:
         print(f"Error fetching geolocation for {ip_address}: {e}")
-        return {
-            "country": "Unknown",
-            "city": "Unknown",
-            "region": "Unknown",
-            "isp": "Unknown",
-            "latitude": None,
-            "longitude": None
-        }
+        return dict(UNKNOWN_GEOLOCATION), False
 
-@events_bp.route("/event", methods=["POST"])
-def record_event():
-    data = request.json
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+def get_geolocation_data(ip_address):
+    if not ip_address or ip_address == "127.0.0.1" or ip_address == "::1": # Avoid local/invalid IPs
+        return dict(LOCAL_GEOLOCATION)
+    if GEO_PROVIDER == "local":
+        table = get_ip_range_table()
+        if table is not None: # Falls back to the remote provider if the table could not be mapped
+            geo_data = table.lookup(ip_address)
+            return geo_data if geo_data is not None else dict(UNKNOWN_GEOLOCATION)
+    # Repeat visitors are served from the in-process LRU or the shared on-disk tier
+    return geo_cache.get_or_fetch(ip_address, lambda: _fetch_geolocation_remote(ip_address))
 
-    # Extract common fields
-    ip_address = request.headers.get("X-Forwarded-For", request.remote_addr)
-    user_agent = request.headers.get("User-Agent")
-    url_accessed = data.get("url_accessed", request.referrer) # or data.get("page_url")
-    referer_url = data.get("referer_url", request.referrer)
-    channel = data.get("channel")
-    device_type = data.get("device_type") # Client should ideally send this
-    campaign_country_target = data.get("campaign_country_target") # Optional: for geo-validation
+# --- Event processing stages (run inline, or by the background ingest workers in async mode) ---
+def _build_event_context(data, ip_address=None, user_agent=None):
+    """
+    Parses and stamps an incoming event. Only this step needs the request.
+    ip_address/user_agent override the request headers (trusted edge collectors send them per click).
+    """
+    return {
+        "ingest_id": uuid.uuid4().hex,
+        "ip_address": ip_address or request.headers.get("X-Forwarded-For", request.remote_addr),
+        "user_agent": user_agent or request.headers.get("User-Agent"),
+        "url_accessed": data.get("url_accessed", request.referrer), # or data.get("page_url")
+        "referer_url": data.get("referer_url", request.referrer),
+        "channel": data.get("channel"),
+        "device_type": data.get("device_type"), # Client should ideally send this
+        "campaign_country_target": data.get("campaign_country_target"), # Optional: for geo-validation
+        "google_campaign_id": data.get("google_campaign_id"), # Optional: invalid clicks can get their IP excluded there
+        "timestamp": datetime.utcnow(),
+        "raw_request_data": json.dumps(data) # Store the original payload
+    }
 
-    # Get Geolocation
-    geo_data = get_geolocation_data(ip_address)
+def _stage_geolocate(ctx):
+    ctx["geo_data"] = get_geolocation_data(ctx["ip_address"])
 
+def _stage_validate(ctx):
     # Prepare event data for validator and logging
     current_event_data_for_validator = {
-        "url_accessed": url_accessed,
-        "referer_url": referer_url,
-        "channel": channel,
-        "device_type": device_type,
-        "country": geo_data.get("country") # Pass fetched country to validator if needed
+        "url_accessed": ctx["url_accessed"],
+        "referer_url": ctx["referer_url"],
+        "channel": ctx["channel"],
+        "device_type": ctx["device_type"],
+        "country": ctx["geo_data"].get("country") # Pass fetched country to validator if needed
     }
 
     # Validate Click using the ClickValidator service
-    validator = ClickValidator(event_data=current_event_data_for_validator, ip_address=ip_address, user_agent=user_agent)
-    is_valid, reasons_list = validator.validate(campaign_country=campaign_country_target)
-    reason_string = ", ".join(reasons_list) if reasons_list else None
-
-    # Create EventLog entry
-    new_event = EventLog(
-        ip_address=ip_address,
-        user_agent=user_agent,
-        timestamp=datetime.utcnow(),
-        url_accessed=url_accessed,
-        referer_url=referer_url,
-        country=geo_data.get("country"),
-        city=geo_data.get("city"),
-        region=geo_data.get("region"),
-        isp=geo_data.get("isp"),
-        latitude=geo_data.get("latitude"),
-        longitude=geo_data.get("longitude"),
-        channel=channel,
-        device_type=device_type,
-        is_valid_click=is_valid,
-        invalid_reason=reason_string,
-        raw_request_data=json.dumps(data) # Store the original payload
-    )
+    validator = ClickValidator(event_data=current_event_data_for_validator, ip_address=ctx["ip_address"], user_agent=ctx["user_agent"])
+    is_valid, reasons_list = validator.validate(campaign_country=ctx["campaign_country_target"])
+    ctx["is_valid"] = is_valid
+    ctx["reason_string"] = ", ".join(reasons_list) if reasons_list else None
+    record_validation(is_valid, ctx["reason_string"])
 
-    try:
-        db.session.add(new_event)
-        db.session.commit()
+def _event_row(ctx):
+    """EventLog column values for a processed event context."""
+    geo_data = ctx["geo_data"]
+    return {
+        "ip_address": ctx["ip_address"],
+        "user_agent": ctx["user_agent"],
+        "timestamp": ctx["timestamp"],
+        "url_accessed": ctx["url_accessed"],
+        "referer_url": ctx["referer_url"],
+        "country": geo_data.get("country"),
+        "city": geo_data.get("city"),
+        "region": geo_data.get("region"),
+        "isp": geo_data.get("isp"),
+        "latitude": geo_data.get("latitude"),
+        "longitude": geo_data.get("longitude"),
+        "channel": ctx["channel"],
+        "device_type": ctx["device_type"],
+        "is_valid_click": ctx["is_valid"],
+        "invalid_reason": ctx["reason_string"],
+        "raw_request_data": ctx["raw_request_data"]
+    }
+
+def _stage_persist(ctx):
+    row = _event_row(ctx)
+    if EVENT_WRITE_MODE == "group":
+        # Concurrent requests share one multi-row INSERT; each still gets its own ID back
+        pending = event_writer.submit(current_app._get_current_object(), row)
+        try:
+            row_id = pending.wait()
+        except TimeoutError:
+            # Still queued, so it will be written: reporting a failure would make the client retry into a duplicate.
+            # The remaining stages run once the group commits and the caller answers 202 with the ingest_id.
+            ctx["deferred"] = True
+            pending.add_done_callback(lambda pending: _finish_deferred_event(ctx, row, pending))
+            return
+        new_event = EventLog(id=row_id, **row)
+    else:
+        new_event = EventLog(**row)
+        try:
+            db.session.add(new_event)
+            db.session.flush() # Assigns the ID the reason codes are keyed by
+            index_events(db.session.connection(), [new_event.id], [row])
+            record_events(db.session.connection(), [row], sketches=False) # Rollup counts commit with the event
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        sketch_buffer.add(current_app._get_current_object(), [row]) # Unique-IP sketches merge in the background
+    ctx["event_id"] = new_event.id
+    ctx["event_data"] = event_row_dict(new_event.id, row)
+
+def _stage_exclude(ctx):
+    # Queued for a batched Google Ads exclusion (see ads_exclusion_queue.py); never fails the event itself
+    candidate = exclusion_candidate(ctx["ip_address"], ctx.get("google_campaign_id"), ctx["is_valid"], ctx["reason_string"])
+    if candidate:
+        try:
+            enqueue_exclusions([candidate])
+        except Exception as e:
+            print(f"ADS_WARN: Could not queue IP exclusion for {ctx['ip_address']}: {e}")
+
+def _stage_emit(ctx):
+    # Queued for the live feed's next window (see live_feed.py)
+    live_feed.publish([dict(ctx["event_data"], ingest_id=ctx["ingest_id"])])
 
-        # Emit event via WebSocket
-        event_data_for_socket = new_event.to_dict()
-        socketio.emit("new_event", event_data_for_socket, namespace="/tracking")
+EVENT_STAGES = [
+    ("geo", _stage_geolocate),
+    ("validate", _stage_validate),
+    ("persist", _stage_persist),
+    ("exclude", _stage_exclude),
+    ("emit", _stage_emit),
+]
 
-        # TODO: If click is invalid and meets certain criteria, trigger Google Ads IP exclusion
-        # if not is_valid and ip_address: # and other conditions
-        #     from src.services.google_ads_manager import add_ip_to_exclusion_list
-        #     campaign_id = data.get("google_campaign_id") # Assuming client sends this
-        #     if campaign_id:
-        #        add_ip_to_exclusion_list(ip_address, campaign_id)
+def _finish_deferred_event(ctx, row, pending):
+    # Runs on the group-commit flusher once a row whose wait() timed out has been written (or has failed)
+    if pending.error is not None:
+        print(f"Error saving event {ctx['ingest_id']}: {pending.error}")
+        return
+    ctx["event_id"] = pending.id
+    ctx["event_data"] = event_row_dict(pending.id, row)
+    for name, stage in EVENT_STAGES[EVENT_STAGES.index(("persist", _stage_persist)) + 1:]:
+        try:
+            stage(ctx)
+        except Exception as e:
+            print(f"INGEST_ERROR: Stage '{name}' failed for event {ctx['ingest_id']}: {e}")
 
-        return jsonify({"message": "Event recorded successfully", "event_id": new_event.id, "is_valid": is_valid, "reason": reason_string}), 201
+ingest_pipeline = IngestPipeline(EVENT_STAGES) if INGEST_MODE == "async" else None
+
+@events_bp.route("/event", methods=["POST"])
+def record_event():
+    data = request.json
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+
+    ctx = _build_event_context(data)
+
+    if ingest_pipeline is not None:
+        # Async mode: geo, validation, persistence and emit happen on the background workers
+        if not ingest_pipeline.submit(current_app._get_current_object(), ctx):
+            response = jsonify({"error": "Ingest queue is full, retry later"})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        # No event ID exists yet; ingest_id is the one the live feed reports with the recorded event
+        return jsonify({"message": "Event accepted", "ingest_id": ctx["ingest_id"]}), 202
+
+    try:
+        for name, stage in EVENT_STAGES:
+            with timed_stage(name, "sync"):
+                stage(ctx)
+            if ctx.get("deferred"):
+                # The group commit is running late but still holds the row; retrying would duplicate it
+                return jsonify({"message": "Event accepted", "ingest_id": ctx["ingest_id"], "is_valid": ctx["is_valid"], "reason": ctx["reason_string"]}), 202
+
+        return jsonify({"message": "Event recorded successfully", "event_id": ctx["event_id"], "is_valid": ctx["is_valid"], "reason": ctx["reason_string"]}), 201
     except Exception as e:
-        db.session.rollback()
         print(f"Error saving event: {e}") # Log this properly
         return jsonify({"error": "Failed to record event", "details": str(e)}), 500
 
+def _read_batch_items():
+    """
+    Reads a batch body: a JSON array, or NDJSON (one object per line) streamed from the request.
+    :return: List of items; an item that could not be parsed is replaced by a ValueError.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            if len(items) >= EVENT_BATCH_MAX_ITEMS:
+                raise OverflowError
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(ValueError("Invalid JSON line"))
+        return items
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise TypeError
+    if len(data) > EVENT_BATCH_MAX_ITEMS:
+        raise OverflowError
+    return data
+
+def _is_trusted_collector():
+    authorization = request.headers.get("Authorization", "")
+    return bool(EVENT_COLLECTOR_TOKEN) and hmac.compare_digest(authorization, f"Bearer {EVENT_COLLECTOR_TOKEN}")
+
+@events_bp.route("/events/batch", methods=["POST"])
+def record_events_batch():
+    try:
+        items = _read_batch_items()
+    except TypeError:
+        return jsonify({"error": "Body must be a JSON array of events or NDJSON (application/x-ndjson)"}), 400
+    except OverflowError:
+        return jsonify({"error": f"Batch too large. Send at most {EVENT_BATCH_MAX_ITEMS} events per request."}), 413
+    if not items:
+        return jsonify({"error": "No data provided"}), 400
+
+    results = [None] * len(items)
+    contexts = [] # (index, ctx) for the items that parsed
+    trusted_collector = _is_trusted_collector()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item:
+            results[index] = {"index": index, "error": str(item) if isinstance(item, ValueError) else "Event must be a non-empty JSON object"}
+            continue
+        if trusted_collector:
+            ctx = _build_event_context(item, ip_address=item.get("ip_address"), user_agent=item.get("user_agent"))
+            ctx["ip_from_body"] = bool(item.get("ip_address"))
+        else:
+            ctx = _build_event_context(item)
+        contexts.append((index, ctx))
+
+    # Geolocation once per distinct IP
+    geo_by_ip = {}
+    with timed_stage("geo", "batch"):
+        for _, ctx in contexts:
+            if ctx["ip_address"] not in geo_by_ip:
+                geo_by_ip[ctx["ip_address"]] = get_geolocation_data(ctx["ip_address"])
+            ctx["geo_data"] = geo_by_ip[ctx["ip_address"]]
+
+    # One ClickValidator pass over the whole batch (single frequency query for all IPs)
+    with timed_stage("validate", "batch"):
+        verdicts = ClickValidator.validate_batch([{
+            "event_data": {
+                "url_accessed": ctx["url_accessed"],
+                "referer_url": ctx["referer_url"],
+                "channel": ctx["channel"],
+                "device_type": ctx["device_type"],
+                "country": ctx["geo_data"].get("country")
+            },
+            "ip_address": ctx["ip_address"],
+            "user_agent": ctx["user_agent"],
+            "campaign_country": ctx["campaign_country_target"]
+        } for _, ctx in contexts])
+    for (_, ctx), (is_valid, reasons_list) in zip(contexts, verdicts):
+        ctx["is_valid"] = is_valid
+        ctx["reason_string"] = ", ".join(reasons_list) if reasons_list else None
+        record_validation(is_valid, ctx["reason_string"])
+
+    # Single transaction for the whole batch
+    rows = [_event_row(ctx) for _, ctx in contexts]
+    try:
+        with timed_stage("persist", "batch"), db.engine.begin() as connection:
+            ids = insert_event_rows(connection, rows)
+    except Exception as e:
+        print(f"Error saving event batch: {e}") # Log this properly
+        return jsonify({"error": "Failed to record events", "details": str(e)}), 500
+
+    events_for_socket = []
+    for (index, ctx), row, event_id in zip(contexts, rows, ids):
+        results[index] = {"index": index, "event_id": event_id, "is_valid": ctx["is_valid"], "reason": ctx["reason_string"]}
+        events_for_socket.append(event_row_dict(event_id, row))
+
+    if events_for_socket:
+        with timed_stage("emit", "batch"):
+            live_feed.publish(events_for_socket)
+
+    # Body-supplied IPs are never excluded in Google Ads, even from a trusted collector
+    candidates = [exclusion_candidate(ctx["ip_address"], ctx.get("google_campaign_id"), ctx["is_valid"], ctx["reason_string"])
+                  for _, ctx in contexts if not ctx.get("ip_from_body")]
+    candidates = [candidate for candidate in candidates if candidate]
+    if candidates:
+        try:
+            with timed_stage("exclude", "batch"):
+                enqueue_exclusions(candidates) # One insert for the whole batch
+        except Exception as e:
+            print(f"ADS_WARN: Could not queue IP exclusions for the batch: {e}")
+
+    return jsonify({
+        "message": "Batch processed",
+        "received": len(items),
+        "recorded": len(ids),
+        "rejected": len(items) - len(ids),
+        "results": results
+    }), 201
+
+@events_bp.route("/ingest/stats", methods=["GET"])
+def get_ingest_stats():
+    if ingest_pipeline is None:
+        stats = {"mode": INGEST_MODE, "message": "Async ingest is disabled. Set INGEST_MODE=async to enable it."}
+    else:
+        stats = ingest_pipeline.stats()
+    stats["write_mode"] = EVENT_WRITE_MODE
+    if EVENT_WRITE_MODE == "group":
+        stats["group_commit"] = event_writer.stats()
+    else:
+        stats["rollup_sketches"] = sketch_buffer.stats()
+    return jsonify(stats), 200
+
+@events_bp.route("/live/stats", methods=["GET"])
+def get_live_feed_stats():
+    # Published, coalesced, summarized and dropped counts for the /tracking live feed
+    return jsonify(live_feed.stats()), 200
+
+@events_bp.route("/geolocation/cache/stats", methods=["GET"])
+def get_geolocation_cache_stats():
+    # Hit, miss and eviction counters for sizing GEO_CACHE_MAX_ENTRIES / TTLs
+    return jsonify(geo_cache.stats()), 200
+
 @socketio.on("connect", namespace="/tracking")
 def handle_tracking_connect():
     print("Client connected to /tracking namespace")
+    live_feed.subscribe(request.sid, {}) # Everything until the client sends 'subscribe'
+
+@socketio.on("subscribe", namespace="/tracking")
+def handle_tracking_subscribe(data=None):
+    """Narrows the client's live feed, e.g. {"channel": "Google Ads", "status": "invalid"}. The ack carries the result."""
+    try:
+        filters = parse_subscription(data)
+    except ValueError as ve:
+        return {"error": str(ve)}
+    live_feed.subscribe(request.sid, filters)
+    return {"subscribed": filters}
 
 @socketio.on("disconnect", namespace="/tracking")
-def handle_tracking_disconnect():
+def handle_tracking_disconnect(*args):
     print("Client disconnected from /tracking namespace")
+    live_feed.unsubscribe(request.sid)
@@ -1,61 +1,53 @@
-from flask import Blueprint, request, jsonify, send_file
-from src.main import db
-from src.models.event_log import EventLog
-from sqlalchemy import and_
-from datetime import datetime
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context, url_for
+from src.services.serialization import csv_chunks, ndjson_chunks
+from src.services.export_jobs import (iter_export_events, iter_export_records, iter_columnar_chunks, columnar_available,
+                                      parse_fields, render_pdf, submit_export_job, read_job, job_file_path,
+                                      EXPORT_FORMATS, COLUMNAR_FORMATS, EXPORT_FIELDS, CSV_DEFAULT_FIELDS, PDF_DEFAULT_FIELDS)
+from itertools import chain
 import io
-import csv
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
+import os
+import re
+import zlib
 
 export_bp = Blueprint("export", __name__)
 
-def _get_filtered_events(filters_dict):
-    query = EventLog.query
-    filters = []
-
-    start_date_str = filters_dict.get("start_date")
-    end_date_str = filters_dict.get("end_date")
-    channel = filters_dict.get("channel")
-    country = filters_dict.get("country")
-    device_type = filters_dict.get("device_type")
-    status = filters_dict.get("status")
-
-    if start_date_str:
-        try:
-            start_date = datetime.fromisoformat(start_date_str.replace("Z", ""))
-            filters.append(EventLog.timestamp >= start_date)
-        except ValueError:
-            raise ValueError("Invalid start_date format. Use ISO format.")
-    
-    if end_date_str:
-        try:
-            end_date = datetime.fromisoformat(end_date_str.replace("Z", ""))
-            filters.append(EventLog.timestamp <= end_date)
-        except ValueError:
-            raise ValueError("Invalid end_date format. Use ISO format.")
-
-    if channel:
-        filters.append(EventLog.channel == channel)
-    if country:
-        filters.append(EventLog.country == country)
-    if device_type:
-        filters.append(EventLog.device_type == device_type)
-    
-    if status:
-        if status.lower() == "valid":
-            filters.append(EventLog.is_valid_click == True)
-        elif status.lower() == "invalid":
-            filters.append(EventLog.is_valid_click == False)
-        elif status.lower() != "all":
-            raise ValueError("Invalid status value. Use 'valid', 'invalid', or 'all'.")
-
-    if filters:
-        query = query.filter(and_(*filters))
-    
-    return query.order_by(EventLog.timestamp.desc()).all()
+# --- Configuration for streamed exports (can be overridden in .env) ---
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536")) # CSV/NDJSON bytes buffered before a chunk is sent
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+TEXT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"} # Streamed, optionally gzipped
+
+def _gzip_chunks(chunks):
+    """Compresses a chunk stream on the fly into a single gzip member."""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def _log_stream_errors(chunks):
+    # Once the first chunk is out the status can't change; log and end the (truncated) download
+    try:
+        yield from chunks
+    except Exception as e:
+        print(f"Error streaming export, response truncated: {e}")
+
+def _wants_gzip():
+    """compress=gzip asks for a .gz file; otherwise gzip is used as Content-Encoding when the client accepts it."""
+    compress = request.args.get("compress", "").lower()
+    if compress in ("gzip", "none"):
+        return compress
+    return "encoding" if "gzip" in request.accept_encodings else None
+
+def _stream_response(chunks, mimetype, download_name, content_encoding=None):
+    response = Response(stream_with_context(_log_stream_errors(chunks)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+    response.headers["X-Accel-Buffering"] = "no" # Let nginx pass chunks through as they are produced
+    response.vary.add("Accept-Encoding")
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding
+    return response
 
 @export_bp.route("/export", methods=["GET"])
 def export_data():
@@ -67,11 +59,31 @@ def export_data():
         "channel": request.args.get("channel"),
         "country": request.args.get("country"),
         "device_type": request.args.get("device_type"),
-        "status": request.args.get("status")
+        "status": request.args.get("status"),
+        "include_archived": request.args.get("include_archived", "false").lower() == "true"
     }
 
+    compress = request.args.get("compress", "").lower()
+    if export_format not in TEXT_FORMATS and export_format not in COLUMNAR_FORMATS and export_format != "pdf":
+        return jsonify({"error": "Invalid export format. Use 'csv', 'ndjson', 'parquet', 'arrow' or 'pdf'."}), 400
+    if compress not in ("", "gzip", "none"):
+        return jsonify({"error": "Invalid compress value. Use 'gzip' or 'none'."}), 400
+    if compress == "gzip" and export_format not in TEXT_FORMATS:
+        return jsonify({"error": "compress=gzip is only supported for csv and ndjson exports."}), 400
+    if export_format in COLUMNAR_FORMATS and not columnar_available():
+        return jsonify({"error": f"format={export_format} requires pyarrow, which is not installed on this server."}), 501
+    try:
+        # fields= limits the SELECT itself; without it each format keeps its usual columns
+        fields = parse_fields(request.args.get("fields"))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    if fields is None:
+        fields = {"csv": CSV_DEFAULT_FIELDS, "pdf": PDF_DEFAULT_FIELDS}.get(export_format, EXPORT_FIELDS)
+
+    # Row tuples straight from the cursor; only the PDF renderer takes to_dict()-formatted dictionaries
+    rows = iter_export_events(filter_params, fields) if export_format == "pdf" else iter_export_records(filter_params, fields)
     try:
-        events = _get_filtered_events(filter_params)
+        first_row = next(rows, None) # Runs the query; rows after the first are streamed
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
@@ -81,65 +93,32 @@ def export_data():
             "details": str(e)
         }), 503
 
-    if not events:
+    if first_row is None:
         return jsonify({"message": "No data to export for the given filters."}), 200
+    rows = chain([first_row], rows)
 
-    if export_format == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        header = [key for key in EventLog.to_dict(events[0]).keys() if key != 'id' and key != 'raw_request_data']
-        writer.writerow(header)
-        
-        # Data rows
-        for event in events:
-            event_dict = event.to_dict()
-            writer.writerow([event_dict.get(col) for col in header])
-        
-        output.seek(0)
-        return send_file(
-            io.BytesIO(output.getvalue().encode("utf-8")),
-            mimetype="text/csv",
-            as_attachment=True,
-            download_name="exported_events.csv"
-        )
-
-    elif export_format == "pdf":
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-
-        story.append(Paragraph("Event Log Export", styles["h1"]))
-        story.append(Spacer(1, 12))
-
-        # Define table header
-        header = [key.replace("_", " ").title() for key in EventLog.to_dict(events[0]).keys() if key not in ['id', 'raw_request_data', 'latitude', 'longitude', 'isp', 'city', 'region']]
-        data_keys = [key for key in EventLog.to_dict(events[0]).keys() if key not in ['id', 'raw_request_data', 'latitude', 'longitude', 'isp', 'city', 'region']]
-
-        table_data = [header]
-        for event in events:
-            event_dict = event.to_dict()
-            row = [str(event_dict.get(key, "")) for key in data_keys]
-            table_data.append(row)
-        
-        if not table_data or len(table_data) <=1: # only header
-             story.append(Paragraph("No data to display in PDF for the given filters.", styles["Normal"]))
+    if export_format in TEXT_FORMATS:
+        if export_format == "csv":
+            chunks = csv_chunks(rows, fields, EXPORT_CHUNK_BYTES)
         else:
-            table = Table(table_data, hAlign='LEFT')
-            table.setStyle(TableStyle([
-                ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
-                ("BACKGROUND", (0, 1), (-1, -1), colors.beige),
-                ("GRID", (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(table)
-
-        doc.build(story)
+            chunks = ndjson_chunks(rows, fields, EXPORT_CHUNK_BYTES)
+        gzip_mode = _wants_gzip()
+        download_name = f"exported_events.{export_format}"
+        mimetype = TEXT_FORMATS[export_format]
+        if gzip_mode in ("gzip", "encoding"):
+            chunks = _gzip_chunks(chunks)
+        if gzip_mode == "gzip":
+            download_name, mimetype = f"{download_name}.gz", "application/gzip"
+        return _stream_response(chunks, mimetype, download_name, "gzip" if gzip_mode == "encoding" else None)
+
+    elif export_format in COLUMNAR_FORMATS:
+        return _stream_response(iter_columnar_chunks(rows, fields, export_format), COLUMNAR_FORMATS[export_format],
+                                f"exported_events.{export_format}")
+
+    else: # pdf
+        # Synchronous rendering ties up this worker; large ranges should go through POST /exports
+        buffer = io.BytesIO()
+        render_pdf(rows, buffer)
         buffer.seek(0)
         return send_file(
             buffer,
@@ -148,6 +127,67 @@ def export_data():
             download_name="exported_events.pdf"
         )
 
-    else:
-        return jsonify({"error": "Invalid export format. Use 'csv' or 'pdf'."}), 400
-
+# --- Background export jobs ---
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+
+def _job_response(job):
+    job_id = job["job_id"]
+    body = {key: job.get(key) for key in ("job_id", "format", "status", "phase", "progress", "rows_written", "rows_total",
+                                          "error", "created_at", "finished_at", "expires_at")}
+    body["status_url"] = url_for("export.get_export_job", job_id=job_id)
+    if job["status"] == "done":
+        body["download_url"] = url_for("export.download_export_job", job_id=job_id)
+    return body
+
+@export_bp.route("/exports", methods=["POST"])
+def create_export_job():
+    """
+    Queues an export to be rendered in the background. Takes the /export parameters as a JSON body
+    (or query string). A request identical to a queued, running or finished job returns that job.
+    """
+    params = request.get_json(silent=True) or request.args
+    export_format = (params.get("format") or "csv").lower()
+    include_archived = params.get("include_archived", False)
+    filter_params = {
+        "start_date": params.get("start_date"),
+        "end_date": params.get("end_date"),
+        "channel": params.get("channel"),
+        "country": params.get("country"),
+        "device_type": params.get("device_type"),
+        "status": params.get("status"),
+        "include_archived": include_archived is True or str(include_archived).lower() == "true"
+    }
+    try:
+        job, created = submit_export_job(export_format, filter_params)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        print(f"Error queuing export job: {e}")
+        return jsonify({"error": "Export job could not be queued.", "details": str(e)}), 503
+
+    body = dict(_job_response(job), deduplicated=not created)
+    response = jsonify(body)
+    response.status_code = 200 if job["status"] == "done" else 202
+    response.headers["Location"] = body["status_url"]
+    return response
+
+@export_bp.route("/exports/<job_id>", methods=["GET"])
+def get_export_job(job_id):
+    job = read_job(job_id) if JOB_ID_PATTERN.match(job_id) else None
+    if job is None:
+        return jsonify({"error": "Export job not found or expired."}), 404
+    return jsonify(_job_response(job)), 200
+
+@export_bp.route("/exports/<job_id>/download", methods=["GET"])
+def download_export_job(job_id):
+    job = read_job(job_id) if JOB_ID_PATTERN.match(job_id) else None
+    if job is None:
+        return jsonify({"error": "Export job not found or expired."}), 404
+    if job["status"] != "done":
+        return jsonify(dict(_job_response(job), error=job.get("error") or "Export job has not finished yet.")), 409
+    return send_file(
+        os.path.abspath(job_file_path(job)),
+        mimetype=EXPORT_FORMATS[job["format"]],
+        as_attachment=True,
+        download_name=f"exported_events.{job['format']}"
+    )
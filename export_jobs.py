@@ -0,0 +1,460 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/export_jobs.py
+import os
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy import and_, select
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib import colors
+from src.main import db
+from src.models.event_log import EventLog
+from src.services.event_storage import iter_archived_events
+from src.services.serialization import EVENT_FIELDS, csv_chunks, format_timestamp
+
+# --- Configuration for exports and background export jobs (can be overridden in .env) ---
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "1000")) # Rows fetched per round trip (server-side cursor on PostgreSQL)
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "2")) # Render processes per web worker
+EXPORT_JOB_DIR = os.getenv("EXPORT_JOB_DIR", "export_jobs") # Job state and finished files (shared by all web workers)
+EXPORT_JOB_TTL_SECONDS = int(os.getenv("EXPORT_JOB_TTL_SECONDS", "3600")) # Finished files are reused, then deleted
+EXPORT_JOB_STALE_SECONDS = int(os.getenv("EXPORT_JOB_STALE_SECONDS", "300")) # A running job without progress this long is lost
+EXPORT_PDF_ROWS_PER_TABLE = int(os.getenv("EXPORT_PDF_ROWS_PER_TABLE", "30")) # About one letter page of rows
+EXPORT_ROW_GROUP_ROWS = int(os.getenv("EXPORT_ROW_GROUP_ROWS", "50000")) # Rows per Parquet row group / Arrow record batch
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "snappy")
+
+EXPORT_FORMATS = {"csv": "text/csv", "pdf": "application/pdf"}
+COLUMNAR_FORMATS = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.stream"}
+JOB_ACTIVE_STATUSES = ("queued", "running", "done")
+EXPORT_FIELDS = EVENT_FIELDS # Exportable columns, in EventLog.to_dict() order
+CSV_DEFAULT_FIELDS = EXPORT_FIELDS[1:]
+PDF_DEFAULT_FIELDS = tuple(field for field in EXPORT_FIELDS
+                           if field not in ('id', 'latitude', 'longitude', 'isp', 'city', 'region'))
+PDF_TABLE_STYLE = TableStyle([
+    ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+    ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
+    ("BACKGROUND", (0, 1), (-1, -1), colors.beige),
+    ("GRID", (0, 0), (-1, -1), 1, colors.black)
+])
+PROGRESS_WRITE_INTERVAL_SECONDS = 0.5
+
+# --- Event selection shared by /export and the jobs ---
+def export_filters(filters_dict):
+    """
+    EventLog filters for the export parameters.
+    :return: (filters, start_date, end_date)
+    :raises ValueError: With a message suitable for a 400 response.
+    """
+    filters = []
+    start_date = end_date = None
+
+    if filters_dict.get("start_date"):
+        try:
+            start_date = datetime.fromisoformat(filters_dict["start_date"].replace("Z", ""))
+            filters.append(EventLog.timestamp >= start_date)
+        except ValueError:
+            raise ValueError("Invalid start_date format. Use ISO format.")
+    if filters_dict.get("end_date"):
+        try:
+            end_date = datetime.fromisoformat(filters_dict["end_date"].replace("Z", ""))
+            filters.append(EventLog.timestamp <= end_date)
+        except ValueError:
+            raise ValueError("Invalid end_date format. Use ISO format.")
+
+    if filters_dict.get("channel"):
+        filters.append(EventLog.channel == filters_dict["channel"])
+    if filters_dict.get("country"):
+        filters.append(EventLog.country == filters_dict["country"])
+    if filters_dict.get("device_type"):
+        filters.append(EventLog.device_type == filters_dict["device_type"])
+
+    status = filters_dict.get("status")
+    if status:
+        if status.lower() == "valid":
+            filters.append(EventLog.is_valid_click == True)
+        elif status.lower() == "invalid":
+            filters.append(EventLog.is_valid_click == False)
+        elif status.lower() != "all":
+            raise ValueError("Invalid status value. Use 'valid', 'invalid', or 'all'.")
+    return filters, start_date, end_date
+
+def parse_fields(value):
+    """
+    Column projection from a `fields=` parameter ("ip_address,timestamp,...").
+    :return: Tuple of column names in the requested order, or None when no projection was asked for.
+    :raises ValueError: For unknown or repeated columns.
+    """
+    if not value:
+        return None
+    fields = tuple(field.strip() for field in value.split(",") if field.strip())
+    unknown = [field for field in fields if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Invalid fields: {', '.join(unknown)}. Available: {', '.join(EXPORT_FIELDS)}.")
+    if not fields or len(set(fields)) != len(fields):
+        raise ValueError("fields must list each column at most once.")
+    return fields
+
+def iter_export_records(filters_dict, fields=EXPORT_FIELDS):
+    """
+    Yields the matching events as tuples of `fields` (typed values, timestamps as datetimes), newest first.
+    Only the requested columns are selected, on a streaming cursor fetching EXPORT_YIELD_PER rows at a time
+    (server-side on PostgreSQL); archived rows follow when include_archived is set.
+    Filter errors raise ValueError when the first row is requested.
+    """
+    filters, start_date, end_date = export_filters(filters_dict)
+    statement = select(*[getattr(EventLog, field) for field in fields])
+    if filters:
+        statement = statement.where(and_(*filters))
+    statement = statement.order_by(EventLog.timestamp.desc())
+    # Own connection: the request's session is removed when the view returns, while rows are still streaming
+    with db.engine.connect() as connection:
+        for row in connection.execution_options(yield_per=EXPORT_YIELD_PER).execute(statement):
+            yield tuple(row)
+    if filters_dict.get("include_archived"):
+        # Archived partitions are older than every hot row, so appending keeps timestamp desc order
+        for row in iter_archived_events(dict(filters_dict, start_date=start_date, end_date=end_date)):
+            yield tuple(datetime.fromisoformat(row[field].rstrip("Z")) if field == "timestamp" else row.get(field)
+                        for field in fields)
+
+def iter_export_events(filters_dict, fields=EXPORT_FIELDS):
+    """Like iter_export_records, as dictionaries formatted the way EventLog.to_dict() formats them."""
+    timestamp_index = fields.index("timestamp") if "timestamp" in fields else None
+    for record in iter_export_records(filters_dict, fields):
+        event_dict = dict(zip(fields, record))
+        if timestamp_index is not None:
+            event_dict["timestamp"] = format_timestamp(record[timestamp_index])
+        yield event_dict
+
+def count_export_events(filters_dict):
+    """Number of hot rows an export will contain (archived rows aren't counted)."""
+    filters, _, _ = export_filters(filters_dict)
+    query = db.session.query(db.func.count(EventLog.id))
+    if filters:
+        query = query.filter(and_(*filters))
+    return query.scalar()
+
+# --- Renderers ---
+def render_csv(records, fields, path, progress=None):
+    """Writes row tuples (see iter_export_records) as CSV with a `fields` header. Returns the number of rows."""
+    rows = [0]
+    def counted():
+        for record in records:
+            rows[0] += 1
+            if progress and rows[0] % EXPORT_YIELD_PER == 0:
+                progress("writing", rows[0], None)
+            yield record
+    with open(path, "wb") as output:
+        for chunk in csv_chunks(counted(), fields):
+            output.write(chunk)
+    return rows[0]
+
+def render_pdf(events, output, progress=None, rows_per_table=EXPORT_PDF_ROWS_PER_TABLE):
+    """
+    Writes events as a PDF made of page-sized tables instead of one table holding every row. Laying out
+    a huge reportlab Table means splitting it again for every page; small tables keep layout time linear
+    in the row count. Tables are built while the layout consumes them (see _StreamedStory), so only a
+    couple exist at a time; the finished pages are what remains in memory until the file is written.
+    :param events: Iterable of to_dict() dictionaries; every key becomes a column (see PDF_DEFAULT_FIELDS).
+    :param output: File path or binary file object.
+    :param progress: Optional callable(phase, done, total), called with the rows laid out so far.
+    :return: Number of rows rendered.
+    """
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    styles = getSampleStyleSheet()
+    rows = [0]
+
+    def story():
+        yield Paragraph("Event Log Export", styles["h1"])
+        yield Spacer(1, 12)
+        data_keys = header = None
+        chunk = []
+        for event_dict in events:
+            if data_keys is None:
+                data_keys = list(event_dict.keys())
+                header = [key.replace("_", " ").title() for key in data_keys]
+            chunk.append([str(event_dict.get(key, "")) for key in data_keys])
+            if len(chunk) == rows_per_table:
+                yield _pdf_table(header, chunk)
+                chunk = []
+                rows[0] += rows_per_table
+                if progress: # Resumed once the previous table has been laid out
+                    progress("rendering", rows[0], None)
+        if chunk:
+            yield _pdf_table(header, chunk)
+            rows[0] += len(chunk)
+        if data_keys is None:
+            yield Paragraph("No data to display in PDF for the given filters.", styles["Normal"])
+
+    doc.build(_StreamedStory(story()))
+    return rows[0]
+
+class _StreamedStory(list):
+    """
+    Flowable list that refills itself from a generator as doc.build() consumes it from the front.
+    build() only uses len(), [0], del [0] and front inserts of split parts; keep-with-next groups
+    look ahead through len(), so a couple of flowables are kept queued.
+    """
+    def __init__(self, flowables, lookahead=2):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+
+    def __len__(self):
+        while list.__len__(self) < self._lookahead:
+            flowable = next(self._source, None)
+            if flowable is None:
+                break
+            self.append(flowable)
+        return list.__len__(self)
+
+def _pdf_table(header, rows):
+    # repeatRows: a table that straddles a page break repeats its header on the next page
+    table = Table([header] + rows, hAlign='LEFT', repeatRows=1)
+    table.setStyle(PDF_TABLE_STYLE)
+    return table
+
+def columnar_available():
+    try:
+        import pyarrow # Optional dependency, only needed for format=parquet and format=arrow
+        return True
+    except ImportError:
+        return False
+
+class _ChunkSink:
+    """Write-only file object that collects what pyarrow writes until the response generator drains it."""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+def _arrow_type(pa, field):
+    column_type = EventLog.__table__.c[field].type
+    if isinstance(column_type, db.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, db.Integer):
+        return pa.int64()
+    if isinstance(column_type, db.Float):
+        return pa.float64()
+    if isinstance(column_type, db.DateTime):
+        return pa.timestamp("us") # Naive UTC, like the column
+    return pa.string()
+
+def iter_columnar_chunks(records, fields, export_format, batch_rows=EXPORT_ROW_GROUP_ROWS):
+    """
+    Encodes record tuples (see iter_export_records) as a Parquet file or an Arrow IPC stream and yields the
+    bytes as they are produced. Rows are converted `batch_rows` at a time, so at most one row group is in memory.
+    :param export_format: 'parquet' or 'arrow'.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(field, _arrow_type(pa, field)) for field in fields])
+    sink = _ChunkSink()
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression=EXPORT_PARQUET_COMPRESSION)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    def record_batch(rows):
+        columns = zip(*rows)
+        return pa.RecordBatch.from_arrays([pa.array(column, type=schema.field(i).type) for i, column in enumerate(columns)],
+                                          schema=schema)
+    try:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_rows:
+                writer.write_batch(record_batch(batch))
+                batch = []
+                yield from sink.drain()
+        if batch:
+            writer.write_batch(record_batch(batch))
+    finally:
+        writer.close() # Parquet footer / Arrow end-of-stream marker
+    yield from sink.drain()
+
+# --- Job state (one JSON file per job, so every web worker sees the same jobs) ---
+def job_id_for(export_format, filters_dict):
+    """Identical requests (same format and normalized filters) map to the same job."""
+    normalized = {key: (value.lower() if key == "status" else value)
+                  for key, value in filters_dict.items() if value not in (None, "", False)}
+    if (normalized.get("status") or "all") == "all":
+        normalized.pop("status", None)
+    raw = json.dumps({"format": export_format, "filters": normalized}, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _state_path(job_id, job_dir):
+    return os.path.join(job_dir, f"{job_id}.json")
+
+def job_file_path(job, job_dir=EXPORT_JOB_DIR):
+    return os.path.join(job_dir, f"{job['job_id']}.{job['format']}")
+
+def _write_job(job, job_dir):
+    job["updated_at"] = time.time()
+    path = _state_path(job["job_id"], job_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+def _remove_job(job, job_dir):
+    for path in (_state_path(job["job_id"], job_dir), job_file_path(job, job_dir)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def read_job(job_id, job_dir=EXPORT_JOB_DIR):
+    """
+    Current state of a job, or None if it doesn't exist or its file has expired (expired jobs are deleted).
+    Running jobs whose worker stopped reporting progress are returned as failed.
+    """
+    try:
+        with open(_state_path(job_id, job_dir)) as f:
+            job = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    now = time.time()
+    if job["status"] == "done" and job["expires_at"] <= now:
+        _remove_job(job, job_dir)
+        return None
+    if job["status"] in ("queued", "running") and now - job["updated_at"] > EXPORT_JOB_STALE_SECONDS:
+        job.update(status="failed", error="Export job stopped reporting progress")
+    return job
+
+def purge_expired_jobs(job_dir=EXPORT_JOB_DIR):
+    """Deletes finished files past their expiry and failed jobs. Returns the number of jobs removed."""
+    removed = 0
+    if not os.path.isdir(job_dir):
+        return removed
+    for name in os.listdir(job_dir):
+        if name.endswith(".json"):
+            job = read_job(name[:-len(".json")], job_dir)
+            if job is None:
+                removed += 1
+            elif job["status"] == "failed" and time.time() - job["updated_at"] > EXPORT_JOB_TTL_SECONDS:
+                _remove_job(job, job_dir)
+                removed += 1
+    return removed
+
+# --- Execution ---
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: children start clean instead of inheriting the web worker's threads and DB connections
+            _executor = ProcessPoolExecutor(max_workers=EXPORT_JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def submit_export_job(export_format, filters_dict, job_dir=EXPORT_JOB_DIR):
+    """
+    Starts a background export, or returns the job already producing (or holding) the same file.
+    :param export_format: 'csv' or 'pdf'.
+    :param filters_dict: The /export filter parameters.
+    :return: Tuple (job state dictionary, created: bool).
+    :raises ValueError: For an unknown format or invalid filters.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    export_filters(filters_dict) # Report bad filters now rather than as a failed job
+    os.makedirs(job_dir, exist_ok=True)
+    purge_expired_jobs(job_dir)
+
+    job_id = job_id_for(export_format, filters_dict)
+    job = read_job(job_id, job_dir)
+    if job is not None and job["status"] in JOB_ACTIVE_STATUSES:
+        return job, False
+    if job is not None:
+        _remove_job(job, job_dir) # Failed or lost: start over
+
+    now = time.time()
+    job = {
+        "job_id": job_id, "format": export_format, "filters": filters_dict, "status": "queued",
+        "progress": 0.0, "rows_written": 0, "rows_total": None, "error": None,
+        "created_at": now, "updated_at": now, "finished_at": None, "expires_at": None
+    }
+    try:
+        # Exclusive create: when two workers race on the same request only one of them starts the job
+        with open(_state_path(job_id, job_dir), "x") as f:
+            json.dump(job, f)
+    except FileExistsError:
+        return read_job(job_id, job_dir) or job, False
+
+    future = _get_executor().submit(run_export_job, job_id, export_format, filters_dict, job_dir)
+    future.add_done_callback(lambda done: _record_crash(done, job, job_dir))
+    return job, True
+
+def _record_crash(future, job, job_dir):
+    # run_export_job records its own errors; this covers the process dying (BrokenProcessPool and the like)
+    error = future.exception()
+    if error is not None:
+        print(f"Export job {job['job_id']} crashed: {error}")
+        _write_job(dict(job, status="failed", error=str(error)), job_dir)
+
+def run_export_job(job_id, export_format, filters_dict, job_dir=EXPORT_JOB_DIR):
+    """Renders one export in a pool process, writing progress into the job state file."""
+    from src.main import app
+    job = read_job(job_id, job_dir)
+    if job is None:
+        return
+    last_write = [0.0]
+
+    def progress(phase, done, total):
+        # Both formats report rows written (PDF lays out each table as it is read)
+        job["rows_written"] = done
+        fraction = done / job["rows_total"] if job["rows_total"] else 0.0
+        job.update(phase=phase, progress=round(min(fraction, 0.99), 4))
+        now = time.monotonic()
+        if now - last_write[0] >= PROGRESS_WRITE_INTERVAL_SECONDS:
+            last_write[0] = now
+            _write_job(job, job_dir)
+
+    output_path = job_file_path(job, job_dir)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with app.app_context():
+            if not filters_dict.get("include_archived"):
+                job["rows_total"] = count_export_events(filters_dict)
+            job["status"] = "running"
+            _write_job(job, job_dir)
+            if export_format == "pdf":
+                rows = render_pdf(iter_export_events(filters_dict, PDF_DEFAULT_FIELDS), tmp_path, progress)
+            else:
+                rows = render_csv(iter_export_records(filters_dict, CSV_DEFAULT_FIELDS), CSV_DEFAULT_FIELDS, tmp_path, progress)
+        os.replace(tmp_path, output_path)
+        finished = time.time()
+        job.update(status="done", phase=None, progress=1.0, rows_written=rows, finished_at=finished,
+                   expires_at=finished + EXPORT_JOB_TTL_SECONDS)
+    except Exception as e:
+        print(f"Export job {job_id} failed: {e}")
+        job.update(status="failed", error=str(e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _write_job(job, job_dir)
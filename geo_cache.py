@@ -0,0 +1,166 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/geo_cache.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# --- Configuration for the Geolocation Cache (can be overridden in .env) ---
+GEO_CACHE_MAX_ENTRIES = int(os.getenv("GEO_CACHE_MAX_ENTRIES", "10000"))
+GEO_CACHE_TTL_SECONDS = int(os.getenv("GEO_CACHE_TTL_SECONDS", "86400"))
+GEO_CACHE_FAILURE_TTL_SECONDS = int(os.getenv("GEO_CACHE_FAILURE_TTL_SECONDS", "60"))
+# Shared on-disk tier, readable by every gunicorn worker. Set to an empty string to disable it.
+GEO_CACHE_DB_PATH = os.getenv("GEO_CACHE_DB_PATH", "geo_cache.sqlite3")
+GEO_CACHE_PRUNE_EVERY_WRITES = 500
+
+class GeoCache:
+    def __init__(self, max_entries=GEO_CACHE_MAX_ENTRIES, ttl_seconds=GEO_CACHE_TTL_SECONDS,
+                 failure_ttl_seconds=GEO_CACHE_FAILURE_TTL_SECONDS, db_path=GEO_CACHE_DB_PATH):
+        """
+        Two-tier cache for geolocation lookups.
+        Tier 1 is an in-process LRU with TTL; tier 2 is a SQLite file shared by all workers on the host.
+        :param max_entries: Maximum number of IPs kept in the in-process LRU.
+        :param ttl_seconds: How long a successful lookup stays valid.
+        :param failure_ttl_seconds: How long a failed lookup is remembered, so an outage doesn't hit every request.
+        :param db_path: Path of the shared SQLite tier, or None/"" to run memory-only.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.failure_ttl_seconds = failure_ttl_seconds
+        self.db_path = db_path or None
+        self._entries = OrderedDict() # ip -> (expires_at, data, ok)
+        self._lock = threading.Lock()
+        self._local = threading.local() # One sqlite3 connection per thread
+        self._counters = {
+            "memory_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "failures_cached": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "shared_errors": 0,
+            "shared_writes": 0,
+        }
+
+    # --- Shared (SQLite) tier ---
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS geo_cache ("
+                "ip TEXT PRIMARY KEY, data TEXT NOT NULL, ok INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _shared_get(self, ip_address, now):
+        if not self.db_path:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT data, ok, expires_at FROM geo_cache WHERE ip = ? AND expires_at > ?",
+                (ip_address, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._bump("shared_errors")
+            print(f"GEO_CACHE_WARN: Could not read shared cache for {ip_address}: {e}")
+            return None
+        if row is None:
+            return None
+        return row[2], json.loads(row[0]), bool(row[1])
+
+    def _shared_put(self, ip_address, data, ok, expires_at):
+        if not self.db_path:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO geo_cache (ip, data, ok, expires_at) VALUES (?, ?, ?, ?)",
+                (ip_address, json.dumps(data), int(ok), expires_at)
+            )
+            if self._bump("shared_writes") % GEO_CACHE_PRUNE_EVERY_WRITES == 0:
+                conn.execute("DELETE FROM geo_cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            self._bump("shared_errors")
+            print(f"GEO_CACHE_WARN: Could not write shared cache for {ip_address}: {e}")
+
+    # --- In-process (LRU) tier ---
+    def _bump(self, counter):
+        """Increments a counter under the lock (request threads share them). Returns the new value."""
+        with self._lock:
+            self._counters[counter] += 1
+            return self._counters[counter]
+
+    def _memory_get(self, ip_address, now):
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[ip_address]
+                self._counters["expirations"] += 1
+                return None
+            self._entries.move_to_end(ip_address)
+            return entry
+
+    def _memory_put(self, ip_address, data, ok, expires_at):
+        with self._lock:
+            self._entries[ip_address] = (expires_at, data, ok)
+            self._entries.move_to_end(ip_address)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def get_or_fetch(self, ip_address, fetcher):
+        """
+        Returns the cached geolocation for an IP, calling `fetcher` only on a miss in both tiers.
+        :param ip_address: The IP address to look up.
+        :param fetcher: Callable returning a tuple (geo_data: dict, ok: bool).
+        :return: A copy of the geolocation dictionary.
+        """
+        now = time.time()
+        entry = self._memory_get(ip_address, now)
+        if entry is not None:
+            self._bump("memory_hits")
+            return dict(entry[1])
+
+        entry = self._shared_get(ip_address, now)
+        if entry is not None:
+            self._bump("shared_hits")
+            self._memory_put(ip_address, entry[1], entry[2], entry[0])
+            return dict(entry[1])
+
+        self._bump("misses")
+        data, ok = fetcher()
+        ttl = self.ttl_seconds if ok else self.failure_ttl_seconds
+        if not ok:
+            self._bump("failures_cached")
+        expires_at = time.time() + ttl
+        self._memory_put(ip_address, data, ok, expires_at)
+        self._shared_put(ip_address, data, ok, expires_at)
+        return dict(data)
+
+    def clear(self):
+        """Drops every entry from the in-process tier (the shared tier expires on its own)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the current tier sizes."""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_entries"] = len(self._entries)
+        lookups = counters["memory_hits"] + counters["shared_hits"] + counters["misses"]
+        counters["hit_ratio"] = round((counters["memory_hits"] + counters["shared_hits"]) / lookups, 4) if lookups else 0.0
+        counters["max_entries"] = self.max_entries
+        counters["ttl_seconds"] = self.ttl_seconds
+        counters["failure_ttl_seconds"] = self.failure_ttl_seconds
+        counters["shared_tier_enabled"] = bool(self.db_path)
+        return counters
+
+# Process-wide instance used by the events blueprint
+geo_cache = GeoCache()
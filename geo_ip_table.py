@@ -0,0 +1,192 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/geo_ip_table.py
+import os
+import csv
+import math
+import mmap
+import struct
+import argparse
+import ipaddress
+import threading
+
+# --- Configuration for the local (offline) geolocation provider ---
+GEO_LOCAL_DB_PATH = os.getenv("GEO_LOCAL_DB_PATH", "geo_ip_ranges.bin")
+
+# Binary layout (all integers big-endian):
+#   header:  magic (8s) | version (I) | record_count (I) | strings_offset (Q)
+#   records: start (16s) | end (16s) | country, region, city, isp string offsets (4I) | latitude, longitude (2f)
+#   strings: u16 length + UTF-8 bytes, de-duplicated
+# IPv4 addresses are stored as IPv4-mapped IPv6 (::ffff:a.b.c.d) so both families share one sorted table.
+MAGIC = b"GEOIPTB1"
+VERSION = 1
+HEADER = struct.Struct(">8sIIQ")
+RECORD = struct.Struct(">16s16s4I2f")
+NO_STRING = 0xFFFFFFFF
+CSV_COLUMNS = ["ip_start", "ip_end", "country", "region", "city", "isp", "latitude", "longitude"]
+
+def _ip_to_int(value):
+    """Converts an IPv4/IPv6 string (or a decimal integer string) into a 128-bit integer."""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return number + 0xFFFF00000000 if number <= 0xFFFFFFFF else number
+    ip = ipaddress.ip_address(value)
+    if ip.version == 4:
+        return int(ip) + 0xFFFF00000000
+    return int(ip)
+
+def build_table(csv_path, output_path):
+    """
+    Compiles a CSV of IP ranges into the binary range table.
+    The CSV must have a header row with the columns in CSV_COLUMNS; ranges must not overlap.
+    :return: Number of ranges written.
+    """
+    strings = {}
+    pool = bytearray()
+
+    def intern(text):
+        if text is None or text == "":
+            return NO_STRING
+        if text not in strings:
+            encoded = text.encode("utf-8")[:0xFFFF]
+            strings[text] = len(pool)
+            pool.extend(struct.pack(">H", len(encoded)))
+            pool.extend(encoded)
+        return strings[text]
+
+    def as_float(text):
+        try:
+            return float(text)
+        except (TypeError, ValueError):
+            return math.nan
+
+    rows = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            start = _ip_to_int(row["ip_start"])
+            end = _ip_to_int(row["ip_end"])
+            if end < start:
+                raise ValueError(f"Range end before start: {row['ip_start']} - {row['ip_end']}")
+            rows.append((start, end, row.get("country"), row.get("region"), row.get("city"),
+                         row.get("isp"), as_float(row.get("latitude")), as_float(row.get("longitude"))))
+    rows.sort(key=lambda r: r[0])
+
+    for previous, current in zip(rows, rows[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError(f"Overlapping ranges starting at {ipaddress.ip_address(previous[0])} and {ipaddress.ip_address(current[0])}")
+
+    records = bytearray()
+    for start, end, country, region, city, isp, latitude, longitude in rows:
+        records.extend(RECORD.pack(
+            start.to_bytes(16, "big"), end.to_bytes(16, "big"),
+            intern(country), intern(region), intern(city), intern(isp),
+            latitude, longitude
+        ))
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(rows), HEADER.size + len(records)))
+        f.write(records)
+        f.write(pool)
+    os.replace(tmp_path, output_path) # Atomic swap so running workers never see a half-written file
+    return len(rows)
+
+class IpRangeTable:
+    def __init__(self, path):
+        """
+        Read-only view over a compiled range table.
+        The file is memory-mapped, so every worker process shares the same page-cache pages.
+        :param path: Path to a file produced by build_table().
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.record_count, self._strings_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a geolocation range table (version {VERSION})")
+
+    def _string(self, offset):
+        if offset == NO_STRING:
+            return None
+        position = self._strings_offset + offset
+        (length,) = struct.unpack_from(">H", self._mm, position)
+        return self._mm[position + 2:position + 2 + length].decode("utf-8")
+
+    def lookup(self, ip_address):
+        """
+        Finds the range containing an IP by binary search over the sorted starts.
+        :return: Geolocation dictionary (same keys as get_geolocation_data) or None if not covered.
+        """
+        try:
+            key = _ip_to_int(ip_address).to_bytes(16, "big")
+        except ValueError:
+            return None
+
+        mm = self._mm
+        lo, hi = 0, self.record_count
+        while lo < hi: # Rightmost record whose start <= key
+            mid = (lo + hi) // 2
+            position = HEADER.size + mid * RECORD.size
+            if mm[position:position + 16] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+
+        _, end, country, region, city, isp, latitude, longitude = RECORD.unpack_from(mm, HEADER.size + (lo - 1) * RECORD.size)
+        if key > end:
+            return None
+        return {
+            "country": self._string(country),
+            "city": self._string(city),
+            "region": self._string(region),
+            "isp": self._string(isp),
+            "latitude": None if math.isnan(latitude) else round(latitude, 4),
+            "longitude": None if math.isnan(longitude) else round(longitude, 4)
+        }
+
+    def close(self):
+        self._mm.close()
+
+_table = None
+_table_lock = threading.Lock()
+_table_failed = False
+
+def get_ip_range_table():
+    """
+    Returns the process-wide table, mapping it on first use (i.e. after gunicorn forks).
+    Returns None if the compiled file is missing or invalid.
+    """
+    global _table, _table_failed
+    if _table is None and not _table_failed:
+        with _table_lock:
+            if _table is None and not _table_failed:
+                try:
+                    _table = IpRangeTable(GEO_LOCAL_DB_PATH)
+                except (OSError, ValueError) as e:
+                    _table_failed = True
+                    print(f"GEO_WARN: Local geolocation table unavailable at {GEO_LOCAL_DB_PATH}: {e}")
+    return _table
+
+# --- Build command ---
+# python geo_ip_table.py build ranges.csv geo_ip_ranges.bin
+# python geo_ip_table.py lookup geo_ip_ranges.bin 8.8.8.8
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile and query the offline IP-range geolocation table.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Compile a CSV of IP ranges into the binary format.")
+    build_parser.add_argument("csv_path")
+    build_parser.add_argument("output_path", nargs="?", default=GEO_LOCAL_DB_PATH)
+    lookup_parser = subparsers.add_parser("lookup", help="Look up one or more IPs in a compiled table.")
+    lookup_parser.add_argument("table_path")
+    lookup_parser.add_argument("ips", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_table(args.csv_path, args.output_path)
+        print(f"Wrote {count} ranges to {args.output_path}")
+    else:
+        table = IpRangeTable(args.table_path)
+        for ip in args.ips:
+            print(f"{ip}: {table.lookup(ip)}")
@@ -1,7 +1,14 @@
 # /home/ubuntu/traffic_tracker_backend/src/services/google_ads_manager.py
 import os
-from google.ads.googleads.client import GoogleAdsClient
-from google.ads.googleads.errors import GoogleAdsException
+import time
+import threading
+try:
+    from google.ads.googleads.client import GoogleAdsClient
+    from google.ads.googleads.errors import GoogleAdsException
+except ImportError: # Optional dependency; a client can still be passed in (e.g. the fake one in tests/fake_google_ads.py)
+    GoogleAdsClient = None
+    class GoogleAdsException(Exception):
+        pass
 
 # --- Configuration - These should be securely managed, likely via .env or a config service ---
 # These are placeholders. Actual implementation requires a google-ads.yaml or direct credential passing.
@@ -15,69 +22,207 @@ from google.ads.googleads.errors import GoogleAdsException
 # It is highly recommended to use a google-ads.yaml file for credentials.
 # For this example, we'll assume the client library is configured to find it or uses environment variables.
 
+# --- Configuration for the client registry and resource cache (can be overridden in .env) ---
+GOOGLE_ADS_RESOURCE_CACHE_TTL_SECONDS = int(os.getenv("GOOGLE_ADS_RESOURCE_CACHE_TTL_SECONDS", "3600"))
+
+# --- Process-wide clients: loading one re-reads the configuration and builds new gRPC channels ---
+_clients = {} # customer ID -> GoogleAdsClient
+_clients_lock = threading.Lock()
+
+def _load_client():
+    # It will look for a google-ads.yaml file in your home directory by default,
+    # or you can configure it with a dictionary or environment variables.
+    return GoogleAdsClient.load_from_storage() # or GoogleAdsClient.load_from_env()
+
+def get_ads_client(customer_id, loader=None):
+    """
+    Returns the process-wide client for a customer, creating it on first use.
+    :param loader: callable() -> client used on a miss; defaults to GoogleAdsClient.load_from_storage().
+    :return: The client, or None if it could not be created (the next call tries again).
+    """
+    with _clients_lock:
+        client = _clients.get(customer_id)
+        if client is not None:
+            return client
+        if loader is None and GoogleAdsClient is None:
+            print("ERROR_ADS: The google-ads package is not installed.")
+            return None
+        try:
+            client = (loader or _load_client)()
+        except Exception as e:
+            print(f"ERROR_ADS: Failed to initialize GoogleAdsClient: {e}. Ensure google-ads.yaml is configured or environment variables are set.")
+            return None
+        _clients[customer_id] = client
+        return client
+
+def forget_ads_client(customer_id):
+    """Drops a customer's client so the next get_ads_client() loads a fresh one."""
+    with _clients_lock:
+        _clients.pop(customer_id, None)
+
+class ResourceCache:
+    def __init__(self, ttl_seconds=GOOGLE_ADS_RESOURCE_CACHE_TTL_SECONDS):
+        """
+        Resolved Google Ads resources (e.g. a campaign's IP exclusion criteria) keyed by (customer ID, kind, key).
+        Entries expire after `ttl_seconds`, and are dropped early when the API answers NOT_FOUND for them.
+        """
+        self.ttl_seconds = ttl_seconds
+        self._entries = {} # (customer_id, kind, key) -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, customer_id, kind, key):
+        entry_key = (customer_id, kind, str(key))
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(entry_key, None)
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def set(self, customer_id, kind, key, value):
+        with self._lock:
+            self._entries[(customer_id, kind, str(key))] = (time.monotonic() + self.ttl_seconds, value)
+
+    def invalidate(self, customer_id, kind=None, key=None):
+        """Drops one entry, every entry of a kind, or (with only customer_id) everything cached for the customer."""
+        with self._lock:
+            stale = [entry_key for entry_key in self._entries if entry_key[0] == customer_id
+                     and (kind is None or entry_key[1] == kind) and (key is None or entry_key[2] == str(key))]
+            for entry_key in stale:
+                del self._entries[entry_key]
+            self._counters["invalidations"] += len(stale)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries), ttl_seconds=self.ttl_seconds)
+
+resource_cache = ResourceCache()
+
+def _error_codes(error):
+    # Failure error codes print as e.g. "mutate_error: RESOURCE_NOT_FOUND"; the gRPC status as StatusCode.NOT_FOUND
+    codes = [str(failure_error.error_code) for failure_error in getattr(getattr(error, "failure", None), "errors", [])]
+    status = getattr(error, "error", None)
+    if status is not None and callable(getattr(status, "code", None)):
+        codes.append(str(status.code()))
+    return " ".join(codes) if codes else str(error)
+
+def is_not_found(error):
+    """True for NOT_FOUND failures (a removed campaign or criterion, an unknown customer): cached resource names are stale."""
+    return "NOT_FOUND" in _error_codes(error)
+
+
 class GoogleAdsManager:
-    def __init__(self, customer_id):
+    def __init__(self, customer_id, client=None):
         """
-        Initializes the GoogleAdsManager.
+        Initializes the GoogleAdsManager. Cheap: the client comes from the process-wide registry.
         :param customer_id: The Google Ads customer ID (the account to be modified, not MCC).
+        :param client: An already configured GoogleAdsClient (or a stand-in with get_service/get_type); from get_ads_client() when None.
         """
         self.customer_id = customer_id
+        self.client = client if client is not None else get_ads_client(customer_id)
+
+    def _invalidate_on_not_found(self, error, campaign_id=None):
+        if not is_not_found(error):
+            return
+        if "CUSTOMER_NOT_FOUND" in _error_codes(error) or campaign_id is None:
+            resource_cache.invalidate(self.customer_id)
+            forget_ads_client(self.customer_id)
+        else:
+            resource_cache.invalidate(self.customer_id, "ip_exclusions", campaign_id)
+
+    def ip_exclusions(self, campaign_id):
+        """
+        The campaign's current IP exclusions, including ones added outside this app.
+        Served from the resource cache; a miss costs one GoogleAdsService search.
+        :return: Dictionary {ip_address: criterion resource name}.
+        :raises: GoogleAdsException if the search fails, RuntimeError if the client is not initialized.
+        """
+        cached = resource_cache.get(self.customer_id, "ip_exclusions", campaign_id)
+        if cached is not None:
+            return dict(cached)
+        if not self.client:
+            raise RuntimeError("Google Ads client not initialized.")
+        query = ("SELECT campaign_criterion.resource_name, campaign_criterion.ip_block.ip_address FROM campaign_criterion "
+                 f"WHERE campaign.id = {int(campaign_id)} AND campaign_criterion.type = IP_BLOCK AND campaign_criterion.negative = TRUE")
         try:
-            # Initialize the Google Ads client.
-            # It will look for a google-ads.yaml file in your home directory by default,
-            # or you can configure it with a dictionary or environment variables.
-            # For sandbox/testing, ensure you have a valid configuration.
-            self.client = GoogleAdsClient.load_from_storage() # or GoogleAdsClient.load_from_env()
+            rows = self.client.get_service("GoogleAdsService").search(customer_id=self.customer_id, query=query)
+            exclusions = {row.campaign_criterion.ip_block.ip_address: row.campaign_criterion.resource_name for row in rows}
         except Exception as e:
-            print(f"ERROR_ADS: Failed to initialize GoogleAdsClient: {e}. Ensure google-ads.yaml is configured or environment variables are set.")
-            self.client = None
+            self._invalidate_on_not_found(e, campaign_id)
+            raise
+        resource_cache.set(self.customer_id, "ip_exclusions", campaign_id, exclusions)
+        return dict(exclusions)
+
+    def apply_ip_exclusions(self, campaign_id, ip_addresses, remove_resource_names=()):
+        """
+        Excludes IPs from a campaign in a single CampaignCriterionService mutate (negative IpBlock criteria),
+        removing older exclusions in the same request. The request is atomic: nothing is applied if it fails.
+
+        :param campaign_id: The ID of the campaign to apply the exclusions to.
+        :param ip_addresses: IP address strings to exclude.
+        :param remove_resource_names: Resource names of existing exclusion criteria to remove (rotation).
+        :return: Resource names of the new criteria, in the order of `ip_addresses`.
+        :raises: GoogleAdsException if the request fails, RuntimeError if the client is not initialized.
+        """
+        if not self.client:
+            raise RuntimeError("Google Ads client not initialized.")
+        campaign_path = self.client.get_service("CampaignService").campaign_path(self.customer_id, campaign_id)
+        operations = []
+        for resource_name in remove_resource_names:
+            operation = self.client.get_type("CampaignCriterionOperation")
+            operation.remove = resource_name
+            operations.append(operation)
+        for ip_address in ip_addresses:
+            operation = self.client.get_type("CampaignCriterionOperation")
+            criterion = operation.create
+            criterion.campaign = campaign_path
+            criterion.negative = True
+            criterion.ip_block.ip_address = ip_address
+            operations.append(operation)
+        try:
+            response = self.client.get_service("CampaignCriterionService").mutate_campaign_criteria(
+                customer_id=self.customer_id, operations=operations)
+        except Exception as e:
+            self._invalidate_on_not_found(e, campaign_id)
+            raise
+        # Results follow the order of the operations: removals first
+        resource_names = [result.resource_name for result in response.results[len(remove_resource_names):]]
+
+        # Keep a cached exclusion list current, so the next batch needs no search
+        cached = resource_cache.get(self.customer_id, "ip_exclusions", campaign_id)
+        if cached is not None:
+            removed = set(remove_resource_names)
+            exclusions = {ip: name for ip, name in cached.items() if name not in removed}
+            exclusions.update(zip(ip_addresses, resource_names))
+            resource_cache.set(self.customer_id, "ip_exclusions", campaign_id, exclusions)
+        return resource_names
 
     def add_ip_to_exclusion_list(self, ip_address, campaign_id, ip_exclusion_list_name="Blocked_Invalid_Traffic_IPs"):
         """
-        Adds an IP address to a shared IP exclusion list and applies it to a campaign.
-        If the list doesn't exist, it attempts to create it.
+        Excludes a single IP from a campaign, one API round trip per call.
+        Invalid clicks go through src/services/ads_exclusion_queue.py instead, which batches and de-duplicates them.
 
         :param ip_address: The IP address string to exclude (e.g., "192.168.1.1").
         :param campaign_id: The ID of the campaign to apply the exclusion to.
-        :param ip_exclusion_list_name: The name of the shared IP exclusion list.
+        :param ip_exclusion_list_name: Kept for compatibility; the API has no shared IP exclusion lists, only campaign criteria.
         :return: Tuple (success: bool, message: str)
         """
         if not self.client:
             return False, "Google Ads client not initialized."
 
         try:
-            # This is a simplified workflow. A robust implementation would involve:
-            # 1. Checking if the IP exclusion list already exists.
-            # 2. Creating it if it doesn't.
-            # 3. Adding the IP to the list.
-            # 4. Ensuring the list is associated with the campaign.
-
-            # For now, this is a placeholder for the complex API interaction logic.
-            # Actual API calls would involve services like:
-            # - SharedSetService to create/get the IP exclusion list (a type of SharedSet).
-            # - SharedCriterionService to add the IP to the list.
-            # - CampaignSharedSetService to link the list to the campaign.
-
-            print(f"ADS_INFO: Attempting to add IP {ip_address} to exclusion list for campaign {campaign_id} (via list '{ip_exclusion_list_name}').")
-            # --- Placeholder for actual Google Ads API calls ---
-            # Example (conceptual, not runnable without full setup and services):
-            # shared_set_service = self.client.get_service("SharedSetService")
-            # criterion_service = self.client.get_service("SharedCriterionService")
-            # campaign_shared_set_service = self.client.get_service("CampaignSharedSetService")
-            
-            # 1. Find or create shared IP exclusion list (SharedSet of type IP_EXCLUSION)
-            # 2. Create an IpBlock shared criterion for the IP address.
-            # 3. Add the criterion to the shared set.
-            # 4. Link the shared set to the campaign if not already linked.
-            
-            # Simulate success for now
-            message = f"Successfully (simulated) added IP {ip_address} to exclusion list '{ip_exclusion_list_name}' and applied to campaign {campaign_id}."
+            print(f"ADS_INFO: Attempting to add IP {ip_address} to exclusion list for campaign {campaign_id}.")
+            resource_names = self.apply_ip_exclusions(campaign_id, [ip_address])
+            message = f"Successfully excluded IP {ip_address} from campaign {campaign_id} ({resource_names[0]})."
             print(f"ADS_SUCCESS: {message}")
             return True, message
 
         except GoogleAdsException as ex:
-            error_message = f"Google Ads API request failed: {ex.failure.errors[0].message}"
-            for error in ex.failure.errors:
+            error_message = f"Google Ads API request failed: {describe_ads_error(ex)}"
+            for error in getattr(getattr(ex, "failure", None), "errors", []):
                 print(f"\tError with message \"{error.message}\".")
                 if error.location:
                     for field_path_element in error.location.field_path_elements:
@@ -87,6 +232,11 @@ class GoogleAdsManager:
             print(f"ERROR_ADS: An unexpected error occurred: {e}")
             return False, f"An unexpected error occurred: {str(e)}"
 
+def describe_ads_error(error):
+    """First API error message of a GoogleAdsException (or str() of any other error)."""
+    errors = getattr(getattr(error, "failure", None), "errors", None)
+    return errors[0].message if errors else str(error)
+
 # --- How to use (example, would be called from events.py or a task queue) ---
 # if __name__ == "__main__":
 #     # This requires a valid google-ads.yaml or environment variables for authentication
@@ -0,0 +1,120 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/hyperloglog.py
+import math
+import struct
+import zlib
+import hashlib
+
+DEFAULT_PRECISION = 12 # 4096 registers: ~1.6% standard error, at most 4 KB per sketch before compression
+FORMAT_VERSION = 1
+SPARSE, DENSE = 0, 1
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION):
+        """
+        Mergeable distinct-count sketch. Small sketches (a minute of traffic) stay sparse, as an
+        {register: rank} dict, and switch to a dense bytearray once that stops being smaller.
+        :param precision: log2 of the register count; sketches only merge with the same precision.
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.precision = precision
+        self.m = 1 << precision
+        self._sparse = {}
+        self._dense = None
+
+    @property
+    def standard_error(self):
+        """Relative standard error of estimate() (1.04 / sqrt(m))."""
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        self._set(index, (64 - self.precision) - remainder.bit_length() + 1)
+
+    def _set(self, index, rank):
+        if self._dense is not None:
+            if rank > self._dense[index]:
+                self._dense[index] = rank
+            return
+        if rank > self._sparse.get(index, 0):
+            self._sparse[index] = rank
+            if len(self._sparse) * 3 > self.m: # Sparse pairs cost 3 bytes each when serialized
+                self._densify()
+
+    def _densify(self):
+        self._dense = bytearray(self.m)
+        for index, rank in self._sparse.items():
+            self._dense[index] = rank
+        self._sparse = {}
+
+    def merge(self, other):
+        """Folds `other` into this sketch (register-wise max). Returns self."""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog sketches with precision {self.precision} and {other.precision}")
+        if other._dense is None:
+            for index, rank in other._sparse.items():
+                self._set(index, rank)
+            return self
+        if self._dense is None:
+            self._densify()
+        self._dense = bytearray(_bytewise_max(self._dense, other._dense))
+        return self
+
+    def estimate(self):
+        registers = self._dense
+        if registers is None:
+            zeros = self.m - len(self._sparse)
+            harmonic = zeros + sum(2.0 ** -rank for rank in self._sparse.values())
+        else:
+            zeros = registers.count(0)
+            harmonic = sum(registers.count(rank) * 2.0 ** -rank for rank in range(0, 66 - self.precision))
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / harmonic
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros) # Linear counting for small cardinalities
+        return int(round(estimate))
+
+    # --- Serialization: version, precision, encoding, then (index, rank) pairs or zlib'd registers ---
+    def to_bytes(self):
+        header = struct.pack(">BBB", FORMAT_VERSION, self.precision, SPARSE if self._dense is None else DENSE)
+        if self._dense is None:
+            return header + b"".join(struct.pack(">HB", index, rank) for index, rank in sorted(self._sparse.items()))
+        return header + zlib.compress(bytes(self._dense))
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, precision, encoding = struct.unpack_from(">BBB", data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported HyperLogLog format version {version}")
+        sketch = cls(precision)
+        body = data[3:]
+        if encoding == SPARSE:
+            sketch._sparse = {index: rank for index, rank in struct.iter_unpack(">HB", body)}
+        else:
+            sketch._dense = bytearray(zlib.decompress(body))
+        return sketch
+
+def _bytewise_max(left, right):
+    """
+    Register-wise max of two dense sketches using whole-buffer integer arithmetic (registers are < 0x80):
+    (a | 0x80) - b keeps the 0x80 bit of each byte exactly where a >= b.
+    """
+    size = len(left)
+    high_bits = int.from_bytes(b"\x80" * size, "big")
+    a, b = int.from_bytes(left, "big"), int.from_bytes(right, "big")
+    a_wins = (((a | high_bits) - b) & high_bits) >> 7
+    mask = a_wins * 0xFF
+    return ((a & mask) | (b & ~mask & ((1 << (8 * size)) - 1))).to_bytes(size, "big")
+
+def merge_serialized(blobs, precision=DEFAULT_PRECISION):
+    """Merges serialized sketches (None entries are skipped) into one HyperLogLog."""
+    merged = HyperLogLog(precision)
+    for blob in blobs:
+        if blob is not None:
+            merged.merge(HyperLogLog.from_bytes(blob))
+    return merged
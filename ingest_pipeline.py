@@ -0,0 +1,256 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/ingest_pipeline.py
+import os
+import glob
+import json
+import time
+import queue
+import threading
+import uuid
+from datetime import datetime
+from src.services.instrumentation import observe_stage
+
+# --- Configuration for the asynchronous ingest mode (can be overridden in .env) ---
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").lower() # 'sync' (default) or 'async'
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_BACKPRESSURE = os.getenv("INGEST_BACKPRESSURE", "shed").lower() # 'block', 'shed' or 'spill'
+INGEST_BLOCK_TIMEOUT_SECONDS = float(os.getenv("INGEST_BLOCK_TIMEOUT_SECONDS", "2"))
+INGEST_SPILL_PATH = os.getenv("INGEST_SPILL_PATH", "ingest_spill.ndjson")
+
+BACKPRESSURE_POLICIES = ("block", "shed", "spill")
+
+class _StageTimer:
+    """Count / total / max latency for a single pipeline stage."""
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms, failed=False):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        if failed:
+            self.errors += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3)
+        }
+
+class IngestPipeline:
+    def __init__(self, stages, queue_size=INGEST_QUEUE_SIZE, workers=INGEST_WORKERS,
+                 backpressure=INGEST_BACKPRESSURE, spill_path=INGEST_SPILL_PATH):
+        """
+        Bounded in-memory queue drained by a pool of background worker threads.
+        :param stages: Ordered list of (name, callable(context)) run by the workers for each event.
+        :param queue_size: Maximum number of queued events before backpressure applies.
+        :param workers: Number of background worker threads.
+        :param backpressure: What submit() does on a full queue: 'block', 'shed' or 'spill' (to disk).
+        :param spill_path: Base path of the NDJSON spill file; the process ID is appended.
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Invalid INGEST_BACKPRESSURE '{backpressure}'. Use one of {BACKPRESSURE_POLICIES}.")
+        self.stages = stages
+        self.workers = workers
+        self.backpressure = backpressure
+        self.spill_path = f"{spill_path}.{os.getpid()}"
+        self.quarantine_path = f"{spill_path}.corrupt"
+        self._spill_base = spill_path
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._app = None
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._timers = {name: _StageTimer() for name, _ in stages}
+        self._timers["queue_wait"] = _StageTimer()
+        self._counters = {"accepted": 0, "processed": 0, "failed": 0, "shed": 0, "spilled": 0, "recovered_from_spill": 0, "quarantined": 0}
+
+    # --- Producer side (request handlers) ---
+    def submit(self, app, context):
+        """
+        Queues an event context for background processing.
+        :param app: The Flask application; workers push its app context.
+        :param context: Dictionary produced by the request handler (must be JSON-serializable apart from datetimes).
+        :return: True if the event was queued or spilled, False if it was shed.
+        """
+        self._ensure_started(app)
+        item = (time.perf_counter(), context)
+        try:
+            if self.backpressure == "block":
+                self._queue.put(item, timeout=INGEST_BLOCK_TIMEOUT_SECONDS)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            if self.backpressure == "spill" and self._spill(context):
+                self._bump("spilled")
+                self._bump("accepted")
+                return True
+            self._bump("shed")
+            return False
+        self._bump("accepted")
+        return True
+
+    def _ensure_started(self, app):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            # Started lazily so each gunicorn worker gets its own threads after the fork
+            self._app = app
+            self._recover_orphaned_spills()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # --- Disk spill ---
+    def _spill(self, context):
+        try:
+            line = json.dumps(context, default=lambda v: {"__datetime__": v.isoformat()} if isinstance(v, datetime) else str(v))
+            with self._spill_lock:
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            return True
+        except OSError as e:
+            print(f"INGEST_ERROR: Could not spill event to {self.spill_path}: {e}")
+            return False
+
+    @staticmethod
+    def _decode_spilled(line):
+        return json.loads(line, object_hook=lambda d: datetime.fromisoformat(d["__datetime__"]) if "__datetime__" in d else d)
+
+    def _drain_spill(self, path):
+        """Processes spilled events once the queue has drained (called from a worker thread)."""
+        claimed = f"{path}.draining"
+        if not os.path.exists(claimed): # Otherwise an earlier drain stopped part-way: finish that file first
+            try:
+                with self._spill_lock:
+                    os.replace(path, claimed) # New spills start a fresh file while we drain this one
+            except OSError:
+                return
+        self._drain_claimed(claimed)
+
+    def _drain_claimed(self, claimed):
+        """Processes a spill file this process owns, then removes it. Lines that cannot be decoded are quarantined."""
+        with open(claimed, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    context = self._decode_spilled(line)
+                    if not isinstance(context, dict):
+                        raise ValueError("not a JSON object")
+                except (ValueError, TypeError) as e: # e.g. a line truncated by a crash mid-write
+                    self._quarantine(line, e)
+                    continue
+                # Processed inline: re-queueing from a worker could deadlock on a full queue
+                self._bump("recovered_from_spill")
+                self._process(context)
+        os.remove(claimed)
+
+    def _quarantine(self, line, error):
+        self._bump("quarantined")
+        print(f"INGEST_ERROR: Skipping unreadable spilled event ({error}); kept in {self.quarantine_path}")
+        try:
+            with self._spill_lock:
+                with open(self.quarantine_path, "a", encoding="utf-8") as f:
+                    f.write(line if line.endswith("\n") else line + "\n")
+        except OSError as e:
+            print(f"INGEST_ERROR: Could not write to {self.quarantine_path}: {e}")
+
+    def _recover_orphaned_spills(self):
+        """
+        Claims spill files left behind by processes that are no longer running: their spill file, and any
+        <pid>.draining / <pid>.recovering.* file a crash interrupted mid-drain.
+        """
+        for path in glob.glob(f"{self._spill_base}.*"):
+            owner = path[len(self._spill_base) + 1:].split(".", 1)[0]
+            if not owner.isdigit() or int(owner) == os.getpid():
+                continue
+            try:
+                os.kill(int(owner), 0)
+                continue # Owner is still alive
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue
+            # Renamed under our PID first: if several workers start at once only one claims the file, and if this
+            # process dies while draining it, the next one recovers it in turn
+            claimed = f"{self.spill_path}.recovering.{uuid.uuid4().hex}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            threading.Thread(target=self._recover_claimed, args=(claimed,), name="ingest-spill-recovery", daemon=True).start()
+
+    def _recover_claimed(self, claimed):
+        try:
+            self._drain_claimed(claimed)
+        except Exception as e:
+            print(f"INGEST_ERROR: Could not recover spilled events from {claimed}: {e}")
+
+    # --- Consumer side (background workers) ---
+    def _run(self):
+        while True:
+            try:
+                enqueued_at, context = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                if self.backpressure == "spill" and (os.path.exists(self.spill_path) or os.path.exists(f"{self.spill_path}.draining")):
+                    try:
+                        self._drain_spill(self.spill_path)
+                    except Exception as e: # The worker must survive; the rest of the file stays in <spill>.draining
+                        print(f"INGEST_ERROR: Draining {self.spill_path} failed: {e}")
+                continue
+            self._observe("queue_wait", (time.perf_counter() - enqueued_at) * 1000)
+            try:
+                self._process(context)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, context):
+        with self._app.app_context():
+            for name, stage in self.stages:
+                started = time.perf_counter()
+                try:
+                    stage(context)
+                except Exception as e:
+                    self._observe(name, (time.perf_counter() - started) * 1000, failed=True)
+                    observe_stage(name, "async", time.perf_counter() - started, failed=True)
+                    self._bump("failed")
+                    print(f"INGEST_ERROR: Stage '{name}' failed for event {context.get('ingest_id')}: {e}")
+                    return
+                self._observe(name, (time.perf_counter() - started) * 1000)
+                observe_stage(name, "async", time.perf_counter() - started)
+                if context.get("deferred"):
+                    break # The stage finishes the event itself later (a group commit that outlived its wait)
+            self._bump("processed")
+
+    # --- Metrics ---
+    def _bump(self, counter):
+        with self._stats_lock:
+            self._counters[counter] += 1
+
+    def _observe(self, name, elapsed_ms, failed=False):
+        with self._stats_lock:
+            self._timers[name].observe(elapsed_ms, failed)
+
+    def stats(self):
+        """Returns queue depth, counters and per-stage latency."""
+        with self._stats_lock:
+            return {
+                "mode": INGEST_MODE,
+                "backpressure": self.backpressure,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "workers": len(self._threads),
+                "counters": dict(self._counters),
+                "stages": {name: timer.to_dict() for name, timer in self._timers.items()}
+            }
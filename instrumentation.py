@@ -0,0 +1,238 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/instrumentation.py
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# --- Configuration for instrumentation and /internal/metrics (can be overridden in .env) ---
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# When set, /internal/* and POST /api/rules/reload require "Authorization: Bearer <token>"; when empty, they only answer direct loopback requests
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_LATENCY_BUCKETS = tuple(sorted(float(bound) for bound in os.getenv(
+    "METRICS_LATENCY_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "30"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_sample(name, labels, value):
+    label_text = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+    if value == float("inf"):
+        value_text = "+Inf"
+    elif isinstance(value, float) and not value.is_integer():
+        value_text = repr(value)
+    else:
+        value_text = str(int(value))
+    return f"{name}{{{label_text}}} {value_text}" if label_text else f"{name} {value_text}"
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+class CounterMetric(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {} # label values -> count
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, list(zip(self.labels, label_values)), value
+
+class HistogramMetric(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [per-bucket counts (last one is +Inf), sum]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value) # First bucket whose upper bound (le) is >= value
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {label_values: (list(counts), total) for label_values, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + [("le", "+Inf" if bound == float("inf") else repr(bound))], cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Counters and histograms updated on the hot path, plus collectors that read existing stats() at scrape time.
+        render() produces the Prometheus text exposition format (version 0.0.4).
+        """
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = CounterMetric(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        metric = HistogramMetric(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        """
+        Registers a scrape-time collector (usable as a decorator).
+        :param function: callable() -> iterable of (name, kind, help, [(labels dict, value), ...]).
+        """
+        self._collectors.append(function)
+        return function
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(_format_sample(name, labels, value) for name, labels, value in metric.samples())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e: # A broken collector must not take the whole scrape down
+                print(f"METRICS_WARN: Collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(_format_sample(name, sorted(labels.items()), value) for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry scraped by GET /internal/metrics (each gunicorn worker reports its own series)
+metrics_registry = MetricsRegistry()
+
+request_seconds = metrics_registry.histogram(
+    "traffic_http_request_duration_seconds", "Time to build the response, per endpoint (streamed bodies not included).",
+    ("endpoint", "method", "status"))
+stage_seconds = metrics_registry.histogram(
+    "traffic_event_stage_duration_seconds", "Time spent in each event processing stage (geo, validate, persist, exclude, emit).",
+    ("stage", "mode"))
+stage_errors = metrics_registry.counter(
+    "traffic_event_stage_errors_total", "Event processing stages that raised.", ("stage", "mode"))
+validations = metrics_registry.counter(
+    "traffic_click_validations_total", "Clicks validated, by outcome.", ("outcome",))
+invalid_reasons = metrics_registry.counter(
+    "traffic_invalid_click_reasons_total", "Rule hits on invalid clicks, by reason code.", ("code",))
+db_errors = metrics_registry.counter(
+    "traffic_db_errors_total", "Errors raised by the database driver, by exception type.", ("error",))
+
+@contextmanager
+def timed_stage(stage, mode):
+    """
+    Times an event processing stage into traffic_event_stage_duration_seconds; counts it as an error if it raises.
+    :param mode: "sync" (inline in the request), "async" (ingest workers) or "batch" (POST /events/batch, whole batch).
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage, mode)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage, mode)
+
+def observe_stage(stage, mode, seconds, failed=False):
+    """Records a stage duration measured by the caller (see timed_stage)."""
+    if METRICS_ENABLED:
+        stage_seconds.observe(seconds, stage, mode)
+        if failed:
+            stage_errors.inc(stage, mode)
+
+def record_validation(is_valid, reason_string):
+    if not METRICS_ENABLED:
+        return
+    validations.inc("valid" if is_valid else "invalid")
+    if not is_valid:
+        from src.services.rule_engine import reason_codes_for # Imported lazily: rule_engine needs the app (src.main)
+        for code in reason_codes_for(reason_string):
+            invalid_reasons.inc(code)
+
+@event.listens_for(Engine, "handle_error")
+def _count_db_error(exception_context):
+    # Every engine in the process: request handlers, ingest workers, background loops and CLI commands
+    if METRICS_ENABLED:
+        db_errors.inc(type(exception_context.original_exception).__name__)
+
+# --- Sampling profiler (off unless a profile is requested; then one thread samples every other thread's stack) ---
+class SamplingProfiler:
+    def __init__(self, max_seconds=PROFILER_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    def run(self, seconds, interval_ms=PROFILER_INTERVAL_MS):
+        """
+        Samples the stacks of all other threads every `interval_ms` for `seconds` (capped at max_seconds), in the calling thread.
+        :return: Dictionary with the sample count and a Counter of folded stacks ("thread;module:function;..." -> samples),
+                 or None if another profile is already running.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            seconds = min(max(seconds, 0.0), self.max_seconds)
+            interval = max(interval_ms, 1.0) / 1000
+            own_ident = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        frames.append(f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}")
+                        frame = frame.f_back
+                    frames.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(frames))] += 1
+                samples += 1
+                time.sleep(interval)
+            return {"seconds": seconds, "interval_ms": interval * 1000, "samples": samples, "stacks": stacks}
+        finally:
+            self._lock.release()
+
+def folded_stacks(stacks, limit=None):
+    """Folded-stack text (one "frame;frame;... count" line per stack) for flamegraph.pl or speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common(limit))
+
+sampling_profiler = SamplingProfiler()
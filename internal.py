@@ -0,0 +1,93 @@
+from flask import Blueprint, Response, request, jsonify, g
+from src.main import db
+from src.services.instrumentation import (metrics_registry, request_seconds, sampling_profiler, folded_stacks,
+                                          METRICS_ENABLED, METRICS_TOKEN, PROMETHEUS_CONTENT_TYPE, PROFILER_INTERVAL_MS)
+from src.services.geo_cache import geo_cache
+from src.services.response_cache import response_cache
+import hmac
+import time
+
+internal_bp = Blueprint("internal", __name__)
+
+# --- Request latency for every endpoint (app-wide hooks, so event, metrics, logs and export are all covered) ---
+@internal_bp.before_app_request
+def _start_request_timer():
+    if METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+@internal_bp.after_app_request
+def _observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, request.endpoint or "unmatched", request.method,
+                                f"{response.status_code // 100}xx")
+    return response
+
+LOOPBACK_ADDRESSES = {"127.0.0.1", "::1"}
+
+def require_internal_access():
+    """
+    Gate for operator endpoints (/internal/*, POST /api/rules/reload). Fails closed: without METRICS_TOKEN only
+    direct loopback requests get in (a proxied request carries X-Forwarded-For even when the proxy connects
+    from localhost).
+    :return: An error response to return as-is, or None if the request may proceed.
+    """
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+            return jsonify({"error": "Unauthorized"}), 401
+    elif request.remote_addr not in LOOPBACK_ADDRESSES or "X-Forwarded-For" in request.headers:
+        return jsonify({"error": "Forbidden. Set METRICS_TOKEN to reach this endpoint from other hosts."}), 403
+    return None
+
+@internal_bp.before_request
+def _require_token():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Instrumentation is disabled. Set METRICS_ENABLED=true to enable it."}), 404
+    return require_internal_access()
+
+# --- Scrape-time collectors (read the existing stats; nothing extra on the hot path) ---
+@metrics_registry.collector
+def _db_pool_metrics():
+    pool = db.engine.pool
+    labels = {"pool": type(pool).__name__}
+    for name, help_text, method in (
+            ("traffic_db_pool_size", "Connections the pool keeps open.", "size"),
+            ("traffic_db_pool_checked_out", "Pool connections currently in use.", "checkedout"),
+            ("traffic_db_pool_checked_in", "Idle connections in the pool.", "checkedin"),
+            ("traffic_db_pool_overflow", "Connections beyond the pool size (negative while below it).", "overflow")):
+        if callable(getattr(pool, method, None)): # NullPool/StaticPool only have some of these
+            yield name, "gauge", help_text, [(labels, getattr(pool, method)())]
+
+@metrics_registry.collector
+def _cache_metrics():
+    from src.services.google_ads_manager import resource_cache # Imports without google-ads installed
+    geo, response, ads = geo_cache.stats(), response_cache.stats(), resource_cache.stats()
+    lookups = [("geo", geo["memory_hits"] + geo["shared_hits"], geo["misses"]),
+               ("response", response["hits"], response["misses"]),
+               ("google_ads_resources", ads["hits"], ads["misses"])]
+    yield ("traffic_cache_lookups_total", "counter", "Cache lookups by result.",
+           [({"cache": cache, "result": result}, count) for cache, hits, misses in lookups
+            for result, count in (("hit", hits), ("miss", misses))])
+
+@internal_bp.route("/metrics", methods=["GET"])
+def get_prometheus_metrics():
+    # Prometheus text format; each gunicorn worker answers with its own series, so scrape every worker
+    return Response(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@internal_bp.route("/profile", methods=["GET"])
+def get_profile():
+    # Samples every thread of this worker for a few seconds (this request blocks meanwhile) and returns folded stacks:
+    # curl 'localhost:5000/internal/profile?seconds=5' > out.folded, then flamegraph.pl or speedscope
+    try:
+        seconds = float(request.args.get("seconds", 5))
+        interval_ms = float(request.args.get("interval_ms", PROFILER_INTERVAL_MS))
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+    except ValueError:
+        return jsonify({"error": "seconds and interval_ms must be numbers, limit an integer"}), 400
+    profile = sampling_profiler.run(seconds, interval_ms)
+    if profile is None:
+        return jsonify({"error": "A profile is already running in this worker, retry later"}), 409
+    response = Response(folded_stacks(profile["stacks"], limit), mimetype="text/plain")
+    response.headers["X-Profile-Samples"] = str(profile["samples"])
+    response.headers["X-Profile-Seconds"] = str(profile["seconds"])
+    return response
@@ -0,0 +1,109 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/ip_frequency.py
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# --- Configuration for the IP frequency tracker (can be overridden in .env) ---
+# 'memory' (per process), 'redis' (shared by all workers) or 'db' (legacy COUNT query on event_logs)
+IP_FREQ_BACKEND = os.getenv("IP_FREQ_BACKEND", "memory").lower()
+IP_FREQ_REDIS_URL = os.getenv("IP_FREQ_REDIS_URL", "redis://localhost:6379/0")
+IP_FREQ_MAX_TRACKED_IPS = int(os.getenv("IP_FREQ_MAX_TRACKED_IPS", "100000"))
+IP_FREQ_BUCKETS = int(os.getenv("IP_FREQ_BUCKETS", "10")) # Buckets per window; more buckets = finer sliding edge
+
+class MemoryIpFrequencyTracker:
+    def __init__(self, window_seconds, max_tracked_ips=IP_FREQ_MAX_TRACKED_IPS, buckets=IP_FREQ_BUCKETS):
+        """
+        Per-process sliding-window click counter keyed by IP.
+        Each IP holds a fixed ring of `buckets` counters, so memory per IP is constant and
+        a lookup touches at most `buckets` slots. At most `max_tracked_ips` IPs are kept;
+        the least recently seen are evicted first (idle IPs are always the oldest).
+        """
+        self.window_seconds = window_seconds
+        self.buckets = buckets
+        self.bucket_width = window_seconds / buckets
+        self.max_tracked_ips = max_tracked_ips
+        self._rings = OrderedDict() # ip -> (last_bucket, [bucket_id, ...], [count, ...])
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def hit(self, ip_address, now=None):
+        """
+        Records a click and returns how many clicks this IP made in the window before it.
+        """
+        current = int((now if now is not None else time.time()) / self.bucket_width)
+        oldest = current - self.buckets + 1
+        slot = current % self.buckets
+        with self._lock:
+            ring = self._rings.get(ip_address)
+            if ring is None:
+                ring = (current, [None] * self.buckets, [0] * self.buckets)
+            _, ids, counts = ring
+            prior = 0
+            for i in range(self.buckets):
+                if ids[i] is not None and ids[i] >= oldest:
+                    prior += counts[i]
+            if ids[slot] != current:
+                ids[slot] = current
+                counts[slot] = 0
+            counts[slot] += 1
+            self._rings[ip_address] = (current, ids, counts)
+            self._rings.move_to_end(ip_address)
+            self._evict(oldest)
+        return prior
+
+    def _evict(self, oldest):
+        # Drop idle IPs (outside the window) and, under IP-spray, the least recently seen beyond the cap
+        while self._rings:
+            ip_address, (last_bucket, _, _) = next(iter(self._rings.items()))
+            if last_bucket >= oldest and len(self._rings) <= self.max_tracked_ips:
+                break
+            del self._rings[ip_address]
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "tracked_ips": len(self._rings), "max_tracked_ips": self.max_tracked_ips, "evictions": self.evictions}
+
+class RedisIpFrequencyTracker:
+    def __init__(self, client, window_seconds, buckets=IP_FREQ_BUCKETS, prefix="ipfreq"):
+        """
+        Bucketed counters in Redis (or any Redis-compatible server), shared by every worker.
+        Each bucket is a key with an expiry, so idle IPs disappear on their own.
+        """
+        self.client = client
+        self.window_seconds = window_seconds
+        self.buckets = buckets
+        self.bucket_width = window_seconds / buckets
+        self.prefix = prefix
+        self.ttl_seconds = int(window_seconds * 2) + 1
+
+    def hit(self, ip_address, now=None):
+        current = int((now if now is not None else time.time()) / self.bucket_width)
+        keys = [f"{self.prefix}:{ip_address}:{bucket}" for bucket in range(current - self.buckets + 1, current + 1)]
+        pipe = self.client.pipeline()
+        pipe.mget(keys)
+        pipe.incr(keys[-1])
+        pipe.expire(keys[-1], self.ttl_seconds)
+        counts, _, _ = pipe.execute()
+        return sum(int(count) for count in counts if count is not None)
+
+    def stats(self):
+        return {"backend": "redis", "url": IP_FREQ_REDIS_URL}
+
+def create_ip_frequency_tracker(window_seconds):
+    """
+    Builds the tracker selected by IP_FREQ_BACKEND.
+    :return: A tracker with hit(ip_address), or None for the legacy 'db' backend.
+    """
+    if IP_FREQ_BACKEND == "db":
+        return None
+    if IP_FREQ_BACKEND == "redis":
+        try:
+            import redis # Optional dependency, only needed for the shared backend
+            client = redis.Redis.from_url(IP_FREQ_REDIS_URL)
+            client.ping()
+            return RedisIpFrequencyTracker(client, window_seconds)
+        except Exception as e:
+            print(f"FREQ_WARN: Redis IP frequency backend unavailable at {IP_FREQ_REDIS_URL}, using in-memory tracker: {e}")
+    return MemoryIpFrequencyTracker(window_seconds)
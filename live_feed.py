@@ -0,0 +1,299 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/live_feed.py
+import os
+import time
+import threading
+from collections import Counter
+from urllib.parse import urlencode, parse_qsl
+from flask_socketio import join_room, leave_room
+from src.main import socketio
+from src.services.socket_fanout import external_emitter, shared_redis_client, SOCKETIO_CHANNEL
+
+# --- Configuration for the /tracking live feed (can be overridden in .env) ---
+LIVE_FEED_WINDOW_MS = int(os.getenv("LIVE_FEED_WINDOW_MS", "250")) # Events published within a window go out as one message
+LIVE_FEED_MAX_EVENTS_PER_WINDOW = int(os.getenv("LIVE_FEED_MAX_EVENTS_PER_WINDOW", "500")) # Above this a room gets summary counts
+LIVE_FEED_BUFFER_SIZE = int(os.getenv("LIVE_FEED_BUFFER_SIZE", "20000")) # Events held per window; the rest are only counted
+LIVE_FEED_ROOM_TTL_SECONDS = int(os.getenv("LIVE_FEED_ROOM_TTL_SECONDS", "15")) # Shared rooms not refreshed by any worker expire
+
+LIVE_FEED_NAMESPACE = "/tracking"
+LIVE_FEED_EVENT = "live_events"
+SUBSCRIPTION_FILTERS = ("channel", "country", "status") # status: 'valid', 'invalid' or 'all' (as in /api/logs)
+
+def parse_subscription(data):
+    """
+    Validates a 'subscribe' payload.
+    :param data: Dictionary with any of SUBSCRIPTION_FILTERS; None or {} subscribes to every event.
+    :return: Dictionary of the filters that narrow the feed.
+    :raises: ValueError if a filter is unknown or has an invalid value.
+    """
+    data = data or {}
+    if not isinstance(data, dict):
+        raise ValueError("Subscription must be an object with channel, country and/or status.")
+    unknown = sorted(set(data) - set(SUBSCRIPTION_FILTERS))
+    if unknown:
+        raise ValueError(f"Unknown subscription filters: {', '.join(unknown)}. Use {', '.join(SUBSCRIPTION_FILTERS)}.")
+    filters = {name: str(data[name]) for name in SUBSCRIPTION_FILTERS if data.get(name)}
+    if "status" in filters:
+        filters["status"] = filters["status"].lower()
+        if filters["status"] not in ("valid", "invalid", "all"):
+            raise ValueError("Invalid status. Use 'valid', 'invalid' or 'all'.")
+        if filters["status"] == "all":
+            del filters["status"]
+    return filters
+
+def room_for(filters):
+    """Room shared by every client with the same filters, so matching runs once per distinct subscription."""
+    return "live:" + urlencode(sorted(filters.items()))
+
+def filters_for(room):
+    """Inverse of room_for(), for rooms announced by other workers. Returns None for a malformed name."""
+    if not room.startswith("live:"):
+        return None
+    try:
+        return parse_subscription(dict(parse_qsl(room[len("live:"):])))
+    except ValueError:
+        return None
+
+def _matches(filters, channel, country, is_valid):
+    if "channel" in filters and filters["channel"] != channel:
+        return False
+    if "country" in filters and filters["country"] != country:
+        return False
+    if "status" in filters and (filters["status"] == "valid") != bool(is_valid):
+        return False
+    return True
+
+def _summary(tally):
+    # tally: Counter of (channel, country, is_valid) -> events
+    by_channel, by_country = Counter(), Counter()
+    valid = 0
+    for (channel, country, is_valid), count in tally.items():
+        by_channel[channel or "Unknown"] += count
+        by_country[country or "Unknown"] += count
+        if is_valid:
+            valid += count
+    total = sum(tally.values())
+    return {"count": total, "valid_clicks": valid, "invalid_clicks": total - valid,
+            "by_channel": dict(by_channel), "by_country": dict(by_country)}
+
+class SharedRoomRegistry:
+    def __init__(self, client, key=f"{SOCKETIO_CHANNEL}:live_rooms", ttl_seconds=LIVE_FEED_ROOM_TTL_SECONDS):
+        """
+        Subscription rooms of every worker, in a Redis sorted set scored by when a worker last had members in them.
+        With a message queue a worker must emit to rooms whose clients are connected to other workers.
+        """
+        self.client = client
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+
+    def touch(self, rooms):
+        now = time.time()
+        pipe = self.client.pipeline()
+        if rooms:
+            pipe.zadd(self.key, {room: now for room in rooms})
+        pipe.zremrangebyscore(self.key, 0, now - self.ttl_seconds)
+        pipe.execute()
+
+    def rooms(self):
+        return self.client.zrangebyscore(self.key, time.time() - self.ttl_seconds, "+inf")
+
+def create_room_registry():
+    """SharedRoomRegistry when Socket.IO uses a Redis message queue, otherwise None (rooms are per process)."""
+    client = shared_redis_client()
+    return SharedRoomRegistry(client) if client is not None else None
+
+class LiveFeed:
+    def __init__(self, window_ms=LIVE_FEED_WINDOW_MS, max_events_per_window=LIVE_FEED_MAX_EVENTS_PER_WINDOW,
+                 buffer_size=LIVE_FEED_BUFFER_SIZE, registry=None):
+        """
+        Coalesces published events into one Socket.IO message per window and subscription room.
+        A room whose share of a window exceeds `max_events_per_window` gets summary counts instead of the events;
+        events published after `buffer_size` in the same window are not kept, only counted in those summaries.
+        :param registry: SharedRoomRegistry for multi-worker deployments; created on first use when None.
+        """
+        self.window = window_ms / 1000.0
+        self.max_events_per_window = max_events_per_window
+        self.buffer_size = buffer_size
+        self._registry = registry
+        self._registry_resolved = registry is not None
+        self._registry_touched = 0.0
+        self._buffer = []
+        self._overflow = Counter() # (channel, country, is_valid) -> events that did not fit in the buffer
+        self._lock = threading.Lock()
+        self._subscriptions = {} # room -> {"filters": dict, "members": set of sids}
+        self._client_rooms = {} # sid -> room
+        self._started = False
+        self._counters = {"published": 0, "windows": 0, "event_messages": 0, "events_sent": 0,
+                          "summary_messages": 0, "summarized": 0, "dropped": 0}
+
+    # --- Subscriptions (called from the /tracking socket handlers) ---
+    def subscribe(self, sid, filters):
+        """Moves a client to the room for `filters` (a client has one subscription). Returns the room name."""
+        room = room_for(filters)
+        self._ensure_started() # Also keeps this worker's rooms announced while it publishes nothing itself
+        with self._lock:
+            previous = self._client_rooms.get(sid)
+            if previous == room:
+                return room
+            self._remove_member(sid)
+            subscription = self._subscriptions.setdefault(room, {"filters": filters, "members": set()})
+            subscription["members"].add(sid)
+            self._client_rooms[sid] = room
+        if previous:
+            leave_room(previous, sid=sid, namespace=LIVE_FEED_NAMESPACE)
+        join_room(room, sid=sid, namespace=LIVE_FEED_NAMESPACE)
+        self._announce([room]) # Other workers fan out to it from their next window
+        return room
+
+    def unsubscribe(self, sid):
+        """Forgets a disconnected client; Flask-SocketIO already removed it from its rooms."""
+        with self._lock:
+            self._remove_member(sid)
+
+    def _remove_member(self, sid):
+        room = self._client_rooms.pop(sid, None)
+        if room is None:
+            return
+        members = self._subscriptions[room]["members"]
+        members.discard(sid)
+        if not members:
+            del self._subscriptions[room] # No one left to filter for
+
+    # --- Producer side ---
+    def publish(self, events):
+        """
+        Queues events for the next window; never blocks on the socket send loop.
+        :param events: List of to_dict()-shaped event dictionaries.
+        """
+        self._ensure_started()
+        with self._lock:
+            self._counters["published"] += len(events)
+            space = max(self.buffer_size - len(self._buffer), 0)
+            self._buffer.extend(events[:space])
+            for event in events[space:]:
+                self._overflow[(event.get("channel"), event.get("country"), event.get("is_valid_click"))] += 1
+            self._counters["dropped"] += len(events[space:])
+
+    # --- Shared rooms (SOCKETIO_MESSAGE_QUEUE) ---
+    def _shared_registry(self):
+        if not self._registry_resolved:
+            self._registry = create_room_registry()
+            self._registry_resolved = True
+        return self._registry
+
+    def _announce(self, rooms):
+        registry = self._shared_registry()
+        if registry is None:
+            return
+        try:
+            registry.touch(rooms)
+            self._registry_touched = time.monotonic()
+        except Exception as e:
+            print(f"SOCKET_WARN: Could not announce live feed rooms: {e}")
+
+    def _rooms(self, local):
+        """Local rooms plus, with a shared registry, the rooms other workers announced."""
+        registry = self._shared_registry()
+        if registry is None:
+            return local
+        try:
+            shared = registry.rooms()
+        except Exception as e:
+            print(f"SOCKET_WARN: Shared live feed rooms unavailable, fanning out to this worker's clients only: {e}")
+            return local
+        rooms = dict(local)
+        for room in shared:
+            if room not in rooms:
+                filters = filters_for(room)
+                if filters is not None:
+                    rooms[room] = filters
+        return rooms
+
+    # --- Flusher ---
+    def _emitter(self):
+        # A process that serves no sockets (e.g. a background ingest worker) publishes through the message queue
+        return socketio if socketio.server is not None else external_emitter()
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if not self._started:
+                # Started lazily so each worker process gets its own flusher; a background task also works under eventlet
+                self._started = True
+                if socketio.server is not None:
+                    socketio.start_background_task(self._run, socketio.sleep)
+                else:
+                    threading.Thread(target=self._run, args=(time.sleep,), name="live-feed", daemon=True).start()
+
+    def _run(self, sleep):
+        while True:
+            sleep(self.window)
+            try:
+                if time.monotonic() - self._registry_touched > LIVE_FEED_ROOM_TTL_SECONDS / 3:
+                    with self._lock:
+                        local = list(self._subscriptions)
+                    self._announce(local) # Keep this worker's rooms alive in the shared registry
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing live feed window: {e}")
+
+    def flush(self):
+        """Sends the current window to every subscription room. Returns the number of messages emitted."""
+        with self._lock:
+            events, self._buffer = self._buffer, []
+            overflow, self._overflow = self._overflow, Counter()
+            local = {room: subscription["filters"] for room, subscription in self._subscriptions.items()}
+        if not events and not overflow:
+            return 0
+        emitter = self._emitter()
+        if emitter is None:
+            return 0 # No clients here and no message queue to reach others
+
+        messages = []
+        event_messages = events_sent = summary_messages = summarized = 0
+        for room, filters in self._rooms(local).items():
+            matched = [event for event in events
+                       if _matches(filters, event.get("channel"), event.get("country"), event.get("is_valid_click"))]
+            missed = Counter({key: count for key, count in overflow.items() if _matches(filters, *key)})
+            if not matched and not missed:
+                continue
+            if missed or len(matched) > self.max_events_per_window:
+                # Overloaded: counts only, so the window still costs one small message per room
+                tally = missed + Counter((e.get("channel"), e.get("country"), e.get("is_valid_click")) for e in matched)
+                payload = dict(_summary(tally), mode="summary", window_ms=int(self.window * 1000), events=[])
+                summary_messages += 1
+                summarized += len(matched)
+            else:
+                valid = sum(1 for event in matched if event.get("is_valid_click"))
+                payload = {"mode": "events", "window_ms": int(self.window * 1000), "count": len(matched),
+                           "valid_clicks": valid, "invalid_clicks": len(matched) - valid, "events": matched}
+                event_messages += 1
+                events_sent += len(matched)
+            messages.append((room, payload))
+
+        for room, payload in messages:
+            emitter.emit(LIVE_FEED_EVENT, payload, namespace=LIVE_FEED_NAMESPACE, to=room)
+        with self._lock:
+            self._counters["windows"] += 1
+            self._counters["event_messages"] += event_messages
+            self._counters["events_sent"] += events_sent
+            self._counters["summary_messages"] += summary_messages
+            self._counters["summarized"] += summarized
+        return len(messages)
+
+    def stats(self):
+        """Returns publish/delivery counters; 'coalesced' is the number of per-event messages saved by batching."""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["buffered"] = len(self._buffer)
+            counters["subscriptions"] = len(self._subscriptions)
+            counters["clients"] = len(self._client_rooms)
+        counters["shared_rooms"] = self._registry is not None
+        counters["coalesced"] = counters["events_sent"] - counters["event_messages"]
+        counters["window_ms"] = int(self.window * 1000)
+        counters["max_events_per_window"] = self.max_events_per_window
+        counters["buffer_size"] = self.buffer_size
+        return counters
+
+# Process-wide feed used by the event routes
+live_feed = LiveFeed()
@@ -1,12 +1,158 @@
 from flask import Blueprint, request, jsonify
 from src.main import db
 from src.models.event_log import EventLog
-from sqlalchemy import and_
+from src.services.event_storage import iter_archived_events, hot_range_start
+from src.services.event_search import contains_filter, reason_code_filter
+from src.services.rule_engine import REASON_CODES
+from src.services.serialization import event_columns, event_dicts, json_response
+from src.services.response_cache import watermark_cached
+from src.services.rollups import count_events
+from sqlalchemy import and_, tuple_
 from datetime import datetime
+import base64
+import json
 
 logs_bp = Blueprint("logs", __name__)
 
+def _page_with_archive(query, archive_filters, page, per_page):
+    """
+    Offset pagination over the hot rows followed by the archived ones. Archived segments only hold
+    partitions older than anything still in the database, so the combined order stays timestamp desc.
+    """
+    offset = (page - 1) * per_page
+    hot_total = query.order_by(None).count()
+    logs_data = event_dicts(query.with_entities(*event_columns()).offset(offset).limit(per_page).all())
+    archived_offset = max(0, offset - hot_total)
+    archived_wanted = per_page - len(logs_data)
+    archived_total = 0
+    for row in iter_archived_events(archive_filters):
+        if archived_offset <= archived_total < archived_offset + archived_wanted:
+            logs_data.append(row)
+        archived_total += 1
+    return logs_data, hot_total + archived_total
+
+# --- Keyset (cursor) pagination ---
+def encode_cursor(event, direction):
+    """Opaque cursor for the position of `event` in (timestamp desc, id desc) order."""
+    raw = json.dumps({"t": event.timestamp.isoformat(), "i": event.id, "d": direction}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """:return: (timestamp, id, direction); raises ValueError for anything that isn't one of our cursors."""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        direction = raw["d"]
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        return datetime.fromisoformat(raw["t"]), int(raw["i"]), direction
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor.")
+
+def _seek_page(query, cursor, per_page):
+    """
+    One page in (timestamp desc, id desc) order starting after/before the cursor. The seek predicate
+    is answered from the (timestamp, id) index, so the cost doesn't depend on how deep the page is.
+    :return: (events, has_next, has_prev)
+    """
+    direction = "next"
+    if cursor:
+        timestamp, event_id, direction = decode_cursor(cursor)
+        if direction == "next":
+            query = query.filter(tuple_(EventLog.timestamp, EventLog.id) < tuple_(timestamp, event_id))
+        else:
+            query = query.filter(tuple_(EventLog.timestamp, EventLog.id) > tuple_(timestamp, event_id))
+
+    if direction == "next":
+        events = query.order_by(EventLog.timestamp.desc(), EventLog.id.desc()).limit(per_page + 1).all()
+        has_more = len(events) > per_page
+        events = events[:per_page]
+        return events, has_more, cursor is not None
+    # Walking backwards: read ascending from the cursor, then flip back to display order
+    events = query.order_by(EventLog.timestamp.asc(), EventLog.id.asc()).limit(per_page + 1).all()
+    has_more = len(events) > per_page
+    events = list(reversed(events[:per_page]))
+    return events, True, has_more
+
+def _estimated_total(args, filters):
+    """
+    Cheap total for cursor mode: exact from the rollups when only rollup dimensions are filtered,
+    otherwise the planner's row estimate on PostgreSQL. None when neither is available.
+    Cursor pages never read archive segments, so the rollup span starts where the hot partitions do
+    (rollups keep counting archived rows).
+    """
+    rollup_params = {"start_date", "end_date", "country", "status"}
+    used = {name for name in ("start_date", "end_date", "ip_address", "user_agent_contains", "url_accessed_contains",
+                              "country", "status", "invalid_reason_contains", "reason_code") if args.get(name)}
+    if used <= rollup_params:
+        start_date = datetime.fromisoformat(args["start_date"].replace("Z", "")) if args.get("start_date") else None
+        end_date = datetime.fromisoformat(args["end_date"].replace("Z", "")) if args.get("end_date") else None
+        hot_start = hot_range_start()
+        if hot_start is not None and (start_date is None or start_date < hot_start):
+            start_date = hot_start
+            if end_date is not None and end_date < hot_start:
+                return 0
+        status = (args.get("status") or "all").lower()
+        valid_filter = True if status == "valid" else False if status == "invalid" else None
+        dimension_filters = [("country", args["country"])] if args.get("country") else []
+        return count_events(start_date, end_date, dimension_filters, valid_filter)[0]
+    if db.engine.dialect.name == "postgresql":
+        statement = db.session.query(EventLog.id).filter(and_(*filters)).statement
+        compiled = statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+        plan = db.session.execute(db.text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return None
+
+def _log_filters(args):
+    """
+    EventLog filters for the /logs query parameters.
+    :return: (filters, start_date, end_date)
+    :raises ValueError: With a message suitable for a 400 response.
+    """
+    filters = []
+    start_date = end_date = None
+    if args.get("start_date"):
+        try:
+            start_date = datetime.fromisoformat(args["start_date"].replace("Z", ""))
+            filters.append(EventLog.timestamp >= start_date)
+        except ValueError:
+            raise ValueError("Invalid start_date format. Use ISO format.")
+    if args.get("end_date"):
+        try:
+            end_date = datetime.fromisoformat(args["end_date"].replace("Z", ""))
+            filters.append(EventLog.timestamp <= end_date)
+        except ValueError:
+            raise ValueError("Invalid end_date format. Use ISO format.")
+
+    if args.get("ip_address"):
+        filters.append(EventLog.ip_address == args["ip_address"])
+    # Substring filters go through the trigram/FTS5 search index where one exists (event_search.py)
+    if args.get("user_agent_contains"):
+        filters.append(contains_filter("user_agent", args["user_agent_contains"]))
+    if args.get("url_accessed_contains"):
+        filters.append(contains_filter("url_accessed", args["url_accessed_contains"]))
+    if args.get("country"):
+        filters.append(EventLog.country == args["country"])
+    if args.get("invalid_reason_contains"):
+        filters.append(contains_filter("invalid_reason", args["invalid_reason_contains"]))
+    if args.get("reason_code"):
+        reason_code = args["reason_code"].upper()
+        if reason_code not in REASON_CODES:
+            raise ValueError(f"Invalid reason_code value. Use one of: {', '.join(REASON_CODES)}.")
+        filters.append(reason_code_filter(reason_code))
+
+    status = args.get("status")
+    if status:
+        if status.lower() == "valid":
+            filters.append(EventLog.is_valid_click == True)
+        elif status.lower() == "invalid":
+            filters.append(EventLog.is_valid_click == False)
+        elif status.lower() != "all":
+            raise ValueError("Invalid status value. Use 'valid', 'invalid', or 'all'.")
+    return filters, start_date, end_date
+
 @logs_bp.route("/logs", methods=["GET"])
+@watermark_cached("logs", lambda args: _log_filters(args)[0])
 def get_logs():
     # Pagination parameters
     page = request.args.get("page", 1, type=int)
@@ -23,60 +169,79 @@ def get_logs():
     country = request.args.get("country")
     status = request.args.get("status") # 'valid', 'invalid', or 'all'
     invalid_reason_contains = request.args.get("invalid_reason_contains")
+    reason_code = request.args.get("reason_code") # Structured rule code, e.g. HIGH_IP_FREQUENCY
+    include_archived = request.args.get("include_archived", "false").lower() == "true" # Also read archive segments
+    # Cursor mode: seek pagination with next_cursor/prev_cursor; ?page= offset mode stays the default
+    cursor = request.args.get("cursor")
+    cursor_mode = bool(cursor) or request.args.get("pagination", "offset").lower() == "cursor"
+    total_mode = request.args.get("total", "estimate").lower() # Cursor mode only: 'exact', 'estimate' or 'none'
 
     query = EventLog.query
-    filters = []
-
-    if start_date_str:
-        try:
-            start_date = datetime.fromisoformat(start_date_str.replace("Z", ""))
-            filters.append(EventLog.timestamp >= start_date)
-        except ValueError:
-            return jsonify({"error": "Invalid start_date format. Use ISO format."}), 400
-    
-    if end_date_str:
-        try:
-            end_date = datetime.fromisoformat(end_date_str.replace("Z", ""))
-            filters.append(EventLog.timestamp <= end_date)
-        except ValueError:
-            return jsonify({"error": "Invalid end_date format. Use ISO format."}), 400
-
-    if ip_address:
-        filters.append(EventLog.ip_address == ip_address)
-    if user_agent_contains:
-        filters.append(EventLog.user_agent.ilike(f"%{user_agent_contains}%"))
-    if url_accessed_contains:
-        filters.append(EventLog.url_accessed.ilike(f"%{url_accessed_contains}%"))
-    if country:
-        filters.append(EventLog.country == country)
-    if invalid_reason_contains:
-        filters.append(EventLog.invalid_reason.ilike(f"%{invalid_reason_contains}%"))
-
-    if status:
-        if status.lower() == "valid":
-            filters.append(EventLog.is_valid_click == True)
-        elif status.lower() == "invalid":
-            filters.append(EventLog.is_valid_click == False)
-        elif status.lower() != "all":
-            return jsonify({"error": "Invalid status value. Use 'valid', 'invalid', or 'all'."}), 400
+    try:
+        filters, start_date, end_date = _log_filters(request.args)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
 
     if filters:
         query = query.filter(and_(*filters))
+
+    if cursor_mode:
+        if include_archived:
+            return jsonify({"error": "include_archived is only supported with offset pagination."}), 400
+        if total_mode not in ("exact", "estimate", "none"):
+            return jsonify({"error": "Invalid total value. Use 'exact', 'estimate' or 'none'."}), 400
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError as ve:
+                return jsonify({"error": str(ve)}), 400
     
     query = query.order_by(EventLog.timestamp.desc())
 
     try:
-        paginated_logs = query.paginate(page=page, per_page=per_page, error_out=False)
-        logs_data = [log.to_dict() for log in paginated_logs.items]
-        
-        return jsonify({
+        if cursor_mode:
+            events, has_next, has_prev = _seek_page(query.order_by(None).with_entities(*event_columns()), cursor, per_page)
+            logs_data = event_dicts(events)
+            pagination = {
+                "pagination": "cursor",
+                "per_page": per_page,
+                "next_cursor": encode_cursor(events[-1], "next") if events and has_next else None,
+                "prev_cursor": encode_cursor(events[0], "prev") if events and has_prev else None,
+                "has_next": has_next,
+                "has_prev": has_prev
+            }
+            if total_mode == "exact":
+                pagination["total_logs"] = query.order_by(None).count()
+            elif total_mode == "estimate":
+                pagination["estimated_total_logs"] = _estimated_total(request.args, filters)
+        elif include_archived:
+            archive_filters = {
+                "start_date": start_date, "end_date": end_date, "ip_address": ip_address, "country": country,
+                "user_agent_contains": user_agent_contains, "url_accessed_contains": url_accessed_contains,
+                "invalid_reason_contains": invalid_reason_contains, "status": status,
+                "reason_code": reason_code.upper() if reason_code else None
+            }
+            logs_data, total_logs = _page_with_archive(query, archive_filters, page, per_page)
+            total_pages = (total_logs + per_page - 1) // per_page
+            pagination = {"total_logs": total_logs, "current_page": page, "per_page": per_page, "total_pages": total_pages,
+                          "has_next": page < total_pages, "has_prev": page > 1}
+        else:
+            # Column tuples instead of EventLog objects: no ORM hydration or to_dict() per row
+            paginated_logs = query.with_entities(*event_columns()).paginate(page=page, per_page=per_page, error_out=False)
+            logs_data = event_dicts(paginated_logs.items)
+            pagination = {
+                "total_logs": paginated_logs.total,
+                "current_page": paginated_logs.page,
+                "per_page": paginated_logs.per_page,
+                "total_pages": paginated_logs.pages,
+                "has_next": paginated_logs.has_next,
+                "has_prev": paginated_logs.has_prev
+            }
+
+        return json_response({
             "logs": logs_data,
-            "total_logs": paginated_logs.total,
-            "current_page": paginated_logs.page,
-            "per_page": paginated_logs.per_page,
-            "total_pages": paginated_logs.pages,
-            "has_next": paginated_logs.has_next,
-            "has_prev": paginated_logs.has_prev,
+            **pagination,
+            "include_archived": include_archived,
             "filters_applied": {
                 "start_date": start_date_str,
                 "end_date": end_date_str,
@@ -85,9 +250,10 @@ def get_logs():
                 "url_accessed_contains": url_accessed_contains,
                 "country": country,
                 "status": status,
-                "invalid_reason_contains": invalid_reason_contains
+                "invalid_reason_contains": invalid_reason_contains,
+                "reason_code": reason_code
             }
-        }), 200
+        })
 
     except Exception as e:
         print(f"Error querying logs (DB might be unavailable or not migrated): {e}")
@@ -107,7 +273,8 @@ def get_logs():
                 "url_accessed_contains": url_accessed_contains,
                 "country": country,
                 "status": status,
-                "invalid_reason_contains": invalid_reason_contains
+                "invalid_reason_contains": invalid_reason_contains,
+                "reason_code": reason_code
             }
         }), 503
 
@@ -25,18 +25,38 @@ def create_app():
     db.init_app(app)
     migrate.init_app(app, db) # For Flask-Migrate
     CORS(app) # Enable CORS for all routes
-    socketio.init_app(app, cors_allowed_origins="*") # Initialize SocketIO
+    # SOCKETIO_MESSAGE_QUEUE (e.g. Redis) fans emits out to clients connected to any worker process
+    from socket_fanout import socketio_options
+    socketio.init_app(app, cors_allowed_origins="*", **socketio_options()) # Initialize SocketIO
 
     # Import blueprints after app and extensions are initialized
     from events import events_bp
     from metrics import metrics_bp
     from export import export_bp
     from logs import logs_bp
+    from rules import rules_bp
+    from internal import internal_bp
 
     app.register_blueprint(events_bp, url_prefix='/api')
     app.register_blueprint(metrics_bp, url_prefix='/api')
     app.register_blueprint(export_bp, url_prefix='/api')
     app.register_blueprint(logs_bp, url_prefix='/api')
+    app.register_blueprint(rules_bp, url_prefix='/api')
+    # Prometheus scrape endpoint and sampling profiler; also times every request
+    app.register_blueprint(internal_bp, url_prefix='/internal')
+
+    # flask storage ensure-partitions | archive | list
+    from event_storage import storage_cli
+    app.cli.add_command(storage_cli)
+    # flask rollups rebuild
+    from rollups import rollups_cli
+    app.cli.add_command(rollups_cli)
+    # flask search ensure-indexes | backfill-reason-codes
+    from event_search import search_cli
+    app.cli.add_command(search_cli)
+    # flask ads process-exclusions | exclusion-stats
+    from ads_exclusion_queue import ads_cli
+    app.cli.add_command(ads_cli)
 
     # Route to serve static files (like a React frontend build) or a simple welcome message
     @app.route('/', defaults={'path': ''})
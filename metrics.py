@@ -1,12 +1,78 @@
 from flask import Blueprint, request, jsonify
 from src.main import db # Assuming db is initialized in main
-from src.models.event_log import EventLog
+from src.models.event_log import EventLog, EventRollup
+from src.services.rollups import plan_range, span_filter, edge_filter, count_events
+from src.services.hyperloglog import HyperLogLog
+from src.services.response_cache import watermark_cached, response_cache
 from sqlalchemy import func, and_
 from datetime import datetime, timedelta
+import os
+
+# 'rollup' answers counts from event_rollups (backfilled by their migration); 'raw' scans event_logs
+METRICS_SOURCE = os.getenv("METRICS_SOURCE", "rollup").lower()
 
 metrics_bp = Blueprint("metrics", __name__)
 
+def _approximate_unique_ips(start_date, end_date, dimension_filters, valid_filter):
+    """
+    Unique IPs from the rollup HyperLogLog sketches merged over the range, plus the distinct IPs of the raw
+    edges hashed into the same sketch. Returns None if some bucket has no sketch yet (not rebuilt since upgrade).
+    """
+    spans, edges = plan_range(start_date, end_date)
+    sketch = HyperLogLog()
+    if spans:
+        rollup_filters = [span_filter(spans)] + [getattr(EventRollup, name) == value for name, value in dimension_filters]
+        if valid_filter is not None:
+            rollup_filters.append(EventRollup.is_valid_click == valid_filter)
+        for (blob,) in db.session.query(EventRollup.ip_sketch).filter(and_(*rollup_filters)):
+            if blob is None:
+                return None
+            sketch.merge(HyperLogLog.from_bytes(blob))
+    if edges:
+        raw_filters = [edge_filter(edges)] + [getattr(EventLog, name) == value for name, value in dimension_filters]
+        if valid_filter is not None:
+            raw_filters.append(EventLog.is_valid_click == valid_filter)
+        for (ip_address,) in db.session.query(EventLog.ip_address).filter(and_(*raw_filters)).distinct():
+            sketch.add(ip_address)
+    return sketch.estimate()
+
+def _parse_filters(args):
+    """
+    Parses the dashboard filters shared by /metrics and /metrics/timeseries.
+    :return: dict with the parsed dates, the EventLog filters, the rollup dimension filters and the validity filter.
+    :raises ValueError: With a message suitable for a 400 response.
+    """
+    parsed = {"start_date": None, "end_date": None, "filters": [], "dimension_filters": [], "valid_filter": None}
+    for key in ("start_date", "end_date"):
+        if args.get(key):
+            try:
+                parsed[key] = datetime.fromisoformat(args[key].replace("Z", ""))
+            except ValueError:
+                raise ValueError(f"Invalid {key} format. Use ISO format.")
+    if parsed["start_date"]:
+        parsed["filters"].append(EventLog.timestamp >= parsed["start_date"])
+    if parsed["end_date"]:
+        parsed["filters"].append(EventLog.timestamp <= parsed["end_date"])
+
+    for name in ("channel", "country", "device_type"):
+        if args.get(name):
+            parsed["filters"].append(getattr(EventLog, name) == args[name])
+            parsed["dimension_filters"].append((name, args[name]))
+
+    status = args.get("status")
+    if status:
+        if status.lower() == "valid":
+            parsed["valid_filter"] = True
+        elif status.lower() == "invalid":
+            parsed["valid_filter"] = False
+        elif status.lower() != "all":
+            raise ValueError("Invalid status value. Use 'valid', 'invalid', or 'all'.")
+        if parsed["valid_filter"] is not None:
+            parsed["filters"].append(EventLog.is_valid_click == parsed["valid_filter"])
+    return parsed
+
 @metrics_bp.route("/metrics", methods=["GET"])
+@watermark_cached("metrics", lambda args: _parse_filters(args)["filters"])
 def get_metrics():
     # Query parameters for filtering
     start_date_str = request.args.get("start_date")
@@ -15,6 +81,9 @@ def get_metrics():
     country = request.args.get("country")
     device_type = request.args.get("device_type")
     status = request.args.get("status") # 'valid', 'invalid', or 'all'
+    # unique_ips is an exact COUNT(DISTINCT ip_address) by default; exact=false opts into merging the
+    # per-bucket HyperLogLog sketches instead (unique_ips_exact/unique_ips_error describe the answer)
+    exact = request.args.get("exact", "true").lower() != "false"
 
     query = db.session.query(
         func.count(EventLog.id).label("total_events"),
@@ -23,35 +92,11 @@ def get_metrics():
         func.count(func.distinct(EventLog.ip_address)).label("unique_ips")
     )
 
-    filters = []
-    if start_date_str:
-        try:
-            start_date = datetime.fromisoformat(start_date_str.replace("Z", ""))
-            filters.append(EventLog.timestamp >= start_date)
-        except ValueError:
-            return jsonify({"error": "Invalid start_date format. Use ISO format."}), 400
-    
-    if end_date_str:
-        try:
-            end_date = datetime.fromisoformat(end_date_str.replace("Z", ""))
-            filters.append(EventLog.timestamp <= end_date)
-        except ValueError:
-            return jsonify({"error": "Invalid end_date format. Use ISO format."}), 400
-
-    if channel:
-        filters.append(EventLog.channel == channel)
-    if country:
-        filters.append(EventLog.country == country)
-    if device_type:
-        filters.append(EventLog.device_type == device_type)
-    
-    if status:
-        if status.lower() == "valid":
-            filters.append(EventLog.is_valid_click == True)
-        elif status.lower() == "invalid":
-            filters.append(EventLog.is_valid_click == False)
-        elif status.lower() != "all":
-            return jsonify({"error": "Invalid status value. Use 'valid', 'invalid', or 'all'."}), 400
+    try:
+        parsed = _parse_filters(request.args)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    filters = parsed["filters"]
 
     if filters:
         query = query.filter(and_(*filters))
@@ -60,12 +105,25 @@ def get_metrics():
     # Note: This will fail if the database is not set up and migrations are not run.
     # For now, we'll proceed with the logic, assuming the DB will be available later.
     try:
-        result = query.one()
+        if METRICS_SOURCE == "rollup":
+            total_events, valid_clicks, invalid_clicks = count_events(parsed["start_date"], parsed["end_date"], parsed["dimension_filters"], parsed["valid_filter"])
+            unique_ips = None if exact else _approximate_unique_ips(parsed["start_date"], parsed["end_date"], parsed["dimension_filters"], parsed["valid_filter"])
+            unique_ips_exact = unique_ips is None
+            if unique_ips_exact:
+                unique_ips = db.session.query(func.count(func.distinct(EventLog.ip_address))).filter(and_(*filters)).scalar()
+        else:
+            result = query.one()
+            total_events, valid_clicks, invalid_clicks, unique_ips = result.total_events, result.valid_clicks, result.invalid_clicks, result.unique_ips
+            unique_ips_exact = True
         metrics_data = {
-            "total_events": result.total_events or 0,
-            "valid_clicks": result.valid_clicks or 0,
-            "invalid_clicks": result.invalid_clicks or 0,
-            "unique_ips": result.unique_ips or 0,
+            "total_events": total_events or 0,
+            "valid_clicks": valid_clicks or 0,
+            "invalid_clicks": invalid_clicks or 0,
+            "unique_ips": unique_ips or 0,
+            "unique_ips_exact": unique_ips_exact,
+            # Relative standard error of the estimate (~95% of answers fall within twice this)
+            "unique_ips_error": 0.0 if unique_ips_exact else round(HyperLogLog().standard_error, 4),
+            "source": METRICS_SOURCE,
             "filters_applied": {
                 "start_date": start_date_str,
                 "end_date": end_date_str,
@@ -96,9 +154,176 @@ def get_metrics():
             }
         }), 503 # Service Unavailable or appropriate error
 
-# Placeholder for more detailed metrics, e.g., time series data
-# @metrics_bp.route("/metrics/timeseries", methods=["GET"])
-# def get_metrics_timeseries():
-#     # ... logic to return data puntos for charts ...
-#     return jsonify({"message": "Timeseries metrics endpoint placeholder"}), 200
+# --- Timeseries ---
+# Bucket ladder: each size is a multiple of the previous one, so downsampling merges whole buckets exactly
+BUCKET_SECONDS = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "3h": 10800, "6h": 21600,
+                  "12h": 43200, "1d": 86400, "7d": 604800}
+REQUESTABLE_BUCKETS = ("1m", "5m", "1h", "1d")
+GROUP_BY_DIMENSIONS = ("channel", "country", "device_type")
+TIMESERIES_MAX_POINTS = int(os.getenv("TIMESERIES_MAX_POINTS", "2000")) # Hard cap on points across all series
+TIMESERIES_DEFAULT_WINDOW = timedelta(hours=24)
+OTHER_KEY = object() # group_by series that the cap folds together, reported as "other"
+EPOCH = datetime(1970, 1, 1)
+
+def _epoch_seconds(moment):
+    return int((moment - EPOCH).total_seconds())
+
+def _epoch_bucket(column, size):
+    """SQL expression for the epoch second at which `column`'s bucket of `size` seconds starts."""
+    if db.engine.dialect.name == "postgresql":
+        return (func.floor(func.extract("epoch", column) / size) * size).label("bucket")
+    return ((func.cast(func.strftime("%s", column), db.Integer) / size) * size).label("bucket")
+
+def _pick_bucket(requested, first, last, series_count, max_points):
+    """
+    Smallest ladder bucket at or above `requested` whose points (per series x series) fit under max_points.
+    :return: The bucket label, or None if even the widest bucket has too many points.
+    """
+    labels = list(BUCKET_SECONDS)
+    for label in labels[labels.index(requested):]:
+        if _bucket_count(first, last, BUCKET_SECONDS[label]) * max(series_count, 1) <= max_points:
+            return label
+    return None
+
+def _bucket_count(first, last, size):
+    return (last // size) - (first // size) + 1
+
+def _grouped_counts(leading, model, count, filters, group_by):
+    """One GROUP BY (leading, [group_by], is_valid_click) query; yields (leading, group key, is_valid, count)."""
+    columns = [leading] + ([getattr(model, group_by)] if group_by else []) + [model.is_valid_click]
+    query = db.session.query(*columns, count).filter(and_(*filters)).group_by(*columns)
+    for row in query:
+        yield row[0], (row[1] or None) if group_by else None, row[-2], row[-1]
+
+def _timeseries_rows(parsed, start, end, size, group_by):
+    """
+    Yields (bucket epoch second, group key, is_valid, count) from one grouped query over the rollups
+    (plus the raw partial minutes at the edges), or one grouped query over event_logs with METRICS_SOURCE=raw.
+    """
+    if METRICS_SOURCE != "rollup":
+        filters = parsed["filters"] + [EventLog.timestamp >= start, EventLog.timestamp <= end]
+        yield from _grouped_counts(_epoch_bucket(EventLog.timestamp, size), EventLog, func.count(EventLog.id), filters, group_by)
+        return
+
+    max_grain = "day" if size % 86400 == 0 else "hour" if size % 3600 == 0 else "minute"
+    spans, edges = plan_range(start, end, max_grain)
+    dimension_filters, valid_filter = parsed["dimension_filters"], parsed["valid_filter"]
+    if spans:
+        filters = [span_filter(spans)] + [getattr(EventRollup, name) == value for name, value in dimension_filters]
+        if valid_filter is not None:
+            filters.append(EventRollup.is_valid_click == valid_filter)
+        for bucket_start, key, is_valid, count in _grouped_counts(
+                EventRollup.bucket_start, EventRollup, func.sum(EventRollup.event_count), filters, group_by):
+            yield _epoch_seconds(bucket_start) // size * size, key, is_valid, count
+    if edges:
+        # Each edge is under a minute long, so it falls inside a single bucket
+        edge_index = db.case(*((edge_filter([edge]), index) for index, edge in enumerate(edges)), else_=-1)
+        filters = [edge_filter(edges)] + [getattr(EventLog, name) == value for name, value in dimension_filters]
+        if valid_filter is not None:
+            filters.append(EventLog.is_valid_click == valid_filter)
+        for index, key, is_valid, count in _grouped_counts(edge_index, EventLog, func.count(EventLog.id), filters, group_by):
+            yield _epoch_seconds(edges[index][0]) // size * size, key, is_valid, count
+
+@metrics_bp.route("/metrics/timeseries", methods=["GET"])
+@watermark_cached("metrics_timeseries", lambda args: _parse_filters(args)["filters"])
+def get_metrics_timeseries():
+    """
+    Dense total/valid/invalid series for charts.
+    Query parameters: the /metrics filters, bucket (1m, 5m, 1h, 1d), group_by (channel, country, device_type)
+    and max_points (capped by TIMESERIES_MAX_POINTS). Buckets are coarsened automatically to respect the cap; past the
+    widest bucket, group_by keeps its largest series and folds the rest into "other", and a single series that still
+    does not fit is a 400.
+    """
+    requested_bucket = request.args.get("bucket", "1h")
+    group_by = request.args.get("group_by") or None
+    max_points = min(request.args.get("max_points", TIMESERIES_MAX_POINTS, type=int), TIMESERIES_MAX_POINTS)
+    if requested_bucket not in REQUESTABLE_BUCKETS:
+        return jsonify({"error": f"Invalid bucket. Use one of: {', '.join(REQUESTABLE_BUCKETS)}."}), 400
+    if group_by and group_by not in GROUP_BY_DIMENSIONS:
+        return jsonify({"error": f"Invalid group_by. Use one of: {', '.join(GROUP_BY_DIMENSIONS)}."}), 400
+    if max_points < 1:
+        return jsonify({"error": "max_points must be positive."}), 400
+    try:
+        parsed = _parse_filters(request.args)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    end = parsed["end_date"] or datetime.utcnow()
+    start = parsed["start_date"] or end - TIMESERIES_DEFAULT_WINDOW
+    if start > end:
+        return jsonify({"error": "start_date must be before end_date."}), 400
+    first, last = _epoch_seconds(start), _epoch_seconds(end)
+
+    # Query at the coarsest bucket the cap allows for a single series; merge further once the series count is known
+    bucket = _pick_bucket(requested_bucket, first, last, 1, max_points)
+    if bucket is None:
+        widest = list(BUCKET_SECONDS)[-1]
+        return jsonify({"error": f"The range needs more than {max_points} points even with {widest} buckets. "
+                                 "Narrow the date range or raise max_points."}), 400
+    size = BUCKET_SECONDS[bucket]
+    try:
+        counts = {}
+        for bucket_second, key, is_valid, count in _timeseries_rows(parsed, start, end, size, group_by):
+            slot = (key, int(bucket_second), bool(is_valid))
+            counts[slot] = counts.get(slot, 0) + int(count)
+    except Exception as e:
+        print(f"Error querying timeseries (DB might be unavailable or not migrated): {e}")
+        return jsonify({
+            "warning": "Timeseries could not be retrieved. Database may be unavailable or not yet migrated.",
+            "details": str(e),
+            "series": []
+        }), 503
+
+    keys = sorted({key for key, _, _ in counts}, key=lambda key: (key is None, key or "")) if group_by else [None]
+    final_bucket = _pick_bucket(bucket, first, last, len(keys), max_points)
+    folded_keys = 0
+    series_key = {key: key for key in keys}
+    if final_bucket is None:
+        # Too many keys even at the widest bucket: keep the largest series and fold the rest into "other"
+        final_bucket = list(BUCKET_SECONDS)[-1]
+        allowed = max_points // _bucket_count(first, last, BUCKET_SECONDS[final_bucket]) # >= 1: one series fit above
+        totals = {}
+        for (key, _, _), count in counts.items():
+            totals[key] = totals.get(key, 0) + count
+        kept = set(sorted(keys, key=lambda key: -totals.get(key, 0))[:allowed - 1])
+        folded_keys = len(keys) - len(kept)
+        series_key = {key: key if key in kept else OTHER_KEY for key in keys}
+        keys = [key for key in keys if key in kept] + [OTHER_KEY]
+    final_size = BUCKET_SECONDS[final_bucket]
+    merged = {}
+    for (key, bucket_second, is_valid), count in counts.items():
+        slot = merged.setdefault((series_key[key], bucket_second // final_size * final_size), [0, 0])
+        slot[0 if is_valid else 1] += count
+
+    bucket_seconds = range(first // final_size * final_size, last // final_size * final_size + 1, final_size)
+    series = []
+    for key in keys:
+        points = []
+        for bucket_second in bucket_seconds: # Gap filling: every bucket in range gets a point
+            valid, invalid = merged.get((key, bucket_second), (0, 0))
+            points.append({
+                "timestamp": (EPOCH + timedelta(seconds=bucket_second)).isoformat() + "Z",
+                "total": valid + invalid,
+                "valid": valid,
+                "invalid": invalid
+            })
+        series.append({"key": "other" if key is OTHER_KEY else key if group_by else "all", "points": points})
+
+    return jsonify({
+        "bucket": final_bucket,
+        "requested_bucket": requested_bucket,
+        "downsampled": final_bucket != requested_bucket,
+        "group_by": group_by,
+        "start": start.isoformat() + "Z",
+        "end": end.isoformat() + "Z",
+        "points": len(keys) * len(bucket_seconds),
+        "max_points": max_points,
+        "folded_keys": folded_keys,
+        "source": METRICS_SOURCE,
+        "series": series,
+        "filters_applied": {name: request.args.get(name) for name in ("start_date", "end_date", "channel", "country", "device_type", "status")}
+    }), 200
 
+@metrics_bp.route("/metrics/cache/stats", methods=["GET"])
+def get_response_cache_stats():
+    # Hit ratio of the /metrics and /logs response cache, for sizing RESPONSE_CACHE_MAX_ENTRIES / TTL
+    return jsonify(response_cache.stats()), 200
@@ -0,0 +1,59 @@
+"""initial schema: event_logs and invalid_click_rules
+
+Revision ID: 3f1c2a9b7d10
+Revises: 
+Create Date: 2026-10-18 09:12:41.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created before migrations were committed already have event_logs; only create what's missing.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('event_logs'):
+        op.create_table('event_logs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('ip_address', sa.String(length=45), nullable=False),
+            sa.Column('user_agent', sa.Text(), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=False),
+            sa.Column('url_accessed', sa.Text(), nullable=True),
+            sa.Column('referer_url', sa.Text(), nullable=True),
+            sa.Column('country', sa.String(length=100), nullable=True),
+            sa.Column('city', sa.String(length=100), nullable=True),
+            sa.Column('region', sa.String(length=100), nullable=True),
+            sa.Column('isp', sa.String(length=255), nullable=True),
+            sa.Column('latitude', sa.Float(), nullable=True),
+            sa.Column('longitude', sa.Float(), nullable=True),
+            sa.Column('channel', sa.String(length=100), nullable=True),
+            sa.Column('device_type', sa.String(length=50), nullable=True),
+            sa.Column('is_valid_click', sa.Boolean(), nullable=False),
+            sa.Column('invalid_reason', sa.String(length=255), nullable=True),
+            sa.Column('raw_request_data', sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if not inspector.has_table('invalid_click_rules'):
+        op.create_table('invalid_click_rules',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('parameter', sa.String(length=100), nullable=False),
+            sa.Column('value', sa.String(length=255), nullable=False),
+            sa.Column('time_window_seconds', sa.Integer(), nullable=True),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.Column('cost', sa.Integer(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('invalid_click_rules')
+    op.drop_table('event_logs')
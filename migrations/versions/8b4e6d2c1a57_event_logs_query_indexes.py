@@ -0,0 +1,39 @@
+"""event_logs indexes for the metrics, logs, export and frequency queries
+
+Revision ID: 8b4e6d2c1a57
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 09:47:03.552916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d2c1a57'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Every endpoint filters on a timestamp range and sorts by timestamp desc
+    op.create_index('ix_event_logs_timestamp', 'event_logs', ['timestamp'], unique=False, if_not_exists=True)
+    # ClickValidator frequency check (ip_address, timestamp >= window) and /logs?ip_address=
+    op.create_index('ix_event_logs_ip_address_timestamp', 'event_logs', ['ip_address', 'timestamp'], unique=False, if_not_exists=True)
+    # Equality dimension + timestamp range used by /metrics, /logs and /export
+    op.create_index('ix_event_logs_channel_timestamp', 'event_logs', ['channel', 'timestamp'], unique=False, if_not_exists=True)
+    op.create_index('ix_event_logs_country_timestamp', 'event_logs', ['country', 'timestamp'], unique=False, if_not_exists=True)
+    op.create_index('ix_event_logs_device_type_timestamp', 'event_logs', ['device_type', 'timestamp'], unique=False, if_not_exists=True)
+    # Invalid clicks are a small slice of the table, so status=invalid gets a partial index (PostgreSQL and SQLite)
+    op.create_index('ix_event_logs_invalid_timestamp', 'event_logs', ['timestamp'], unique=False, if_not_exists=True,
+                    postgresql_where=sa.text('is_valid_click = false'), sqlite_where=sa.text('is_valid_click = 0'))
+
+
+def downgrade():
+    op.drop_index('ix_event_logs_invalid_timestamp', table_name='event_logs')
+    op.drop_index('ix_event_logs_device_type_timestamp', table_name='event_logs')
+    op.drop_index('ix_event_logs_country_timestamp', table_name='event_logs')
+    op.drop_index('ix_event_logs_channel_timestamp', table_name='event_logs')
+    op.drop_index('ix_event_logs_ip_address_timestamp', table_name='event_logs')
+    op.drop_index('ix_event_logs_timestamp', table_name='event_logs')
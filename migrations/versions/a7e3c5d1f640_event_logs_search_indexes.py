@@ -0,0 +1,89 @@
+"""event_logs substring search indexes and structured reason codes
+
+Revision ID: a7e3c5d1f640
+Revises: f2c6a1d9b834
+Create Date: 2026-10-18 15:21:44.208613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e3c5d1f640'
+down_revision = 'f2c6a1d9b834'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = ('user_agent', 'url_accessed', 'invalid_reason')
+
+# Reason text prefix -> code, frozen copy of the rules in src/services/rule_engine.py at this revision
+REASON_PREFIXES = {
+    'IP_BLACKLISTED': 'Blacklisted IP:',
+    'EMPTY_USER_AGENT': 'Empty or Generic User Agent',
+    'GEO_MISMATCH': 'Geolocation Mismatch:',
+    'SUSPICIOUS_USER_AGENT': 'Suspicious User Agent:',
+    'HIGH_IP_FREQUENCY': 'High IP Frequency:',
+}
+
+
+def upgrade():
+    op.create_table('event_reason_codes',
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('event_id', 'code')
+    )
+    op.create_index('ix_event_reason_codes_code_event_id', 'event_reason_codes', ['code', 'event_id'], unique=False)
+    for code, prefix in REASON_PREFIXES.items():
+        op.execute(sa.text(
+            "INSERT INTO event_reason_codes (event_id, code) SELECT id, :code FROM event_logs "
+            "WHERE is_valid_click = :invalid AND invalid_reason LIKE :pattern"
+        ).bindparams(code=code, invalid=False, pattern=f"%{prefix}%"))
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # pg_trgm GIN indexes let the planner answer ILIKE '%term%' without a sequential scan
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for column in SEARCH_COLUMNS:
+            op.execute(f"CREATE INDEX IF NOT EXISTS ix_event_logs_{column}_trgm ON event_logs USING gin ({column} gin_trgm_ops)")
+    elif dialect == 'sqlite':
+        # External-content FTS5 table with the trigram tokenizer, kept in sync by triggers
+        try:
+            op.execute(
+                "CREATE VIRTUAL TABLE event_logs_fts USING fts5(user_agent, url_accessed, invalid_reason, "
+                "content='event_logs', content_rowid='id', tokenize='trigram')"
+            )
+            op.execute(
+                "CREATE TRIGGER event_logs_fts_ai AFTER INSERT ON event_logs BEGIN "
+                "INSERT INTO event_logs_fts(rowid, user_agent, url_accessed, invalid_reason) "
+                "VALUES (new.id, new.user_agent, new.url_accessed, new.invalid_reason); END"
+            )
+            op.execute(
+                "CREATE TRIGGER event_logs_fts_ad AFTER DELETE ON event_logs BEGIN "
+                "INSERT INTO event_logs_fts(event_logs_fts, rowid, user_agent, url_accessed, invalid_reason) "
+                "VALUES ('delete', old.id, old.user_agent, old.url_accessed, old.invalid_reason); END"
+            )
+            op.execute(
+                "CREATE TRIGGER event_logs_fts_au AFTER UPDATE ON event_logs BEGIN "
+                "INSERT INTO event_logs_fts(event_logs_fts, rowid, user_agent, url_accessed, invalid_reason) "
+                "VALUES ('delete', old.id, old.user_agent, old.url_accessed, old.invalid_reason); "
+                "INSERT INTO event_logs_fts(rowid, user_agent, url_accessed, invalid_reason) "
+                "VALUES (new.id, new.user_agent, new.url_accessed, new.invalid_reason); END"
+            )
+            op.execute("INSERT INTO event_logs_fts(event_logs_fts) VALUES('rebuild')")
+        except Exception as e:
+            # SQLite builds without FTS5 (or older than 3.34) keep the ILIKE scan
+            print(f"WARN: FTS5 trigram search table not created, /api/logs substring filters will scan: {e}")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for column in SEARCH_COLUMNS:
+            op.execute(f"DROP INDEX IF EXISTS ix_event_logs_{column}_trgm")
+    elif dialect == 'sqlite':
+        for trigger in ('event_logs_fts_ai', 'event_logs_fts_ad', 'event_logs_fts_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS event_logs_fts")
+    op.drop_index('ix_event_reason_codes_code_event_id', table_name='event_reason_codes')
+    op.drop_table('event_reason_codes')
@@ -0,0 +1,51 @@
+"""Google Ads IP exclusion queue and excluded-IP cache
+
+Revision ID: b5d2e8a4c913
+Revises: a7e3c5d1f640
+Create Date: 2026-10-18 19:05:37.482190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d2e8a4c913'
+down_revision = 'a7e3c5d1f640'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ads_exclusion_queue',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('customer_id', sa.String(length=20), nullable=False),
+    sa.Column('campaign_id', sa.String(length=20), nullable=False),
+    sa.Column('ip_address', sa.String(length=45), nullable=False),
+    sa.Column('reason', sa.String(length=255), nullable=True),
+    sa.Column('enqueued_at', sa.DateTime(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('claim_token', sa.String(length=32), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('customer_id', 'campaign_id', 'ip_address', name='uq_ads_exclusion_queue_target')
+    )
+    op.create_index('ix_ads_exclusion_queue_next_attempt_at', 'ads_exclusion_queue', ['next_attempt_at'], unique=False)
+    op.create_table('ads_ip_exclusions',
+    sa.Column('customer_id', sa.String(length=20), nullable=False),
+    sa.Column('campaign_id', sa.String(length=20), nullable=False),
+    sa.Column('ip_address', sa.String(length=45), nullable=False),
+    sa.Column('resource_name', sa.String(length=255), nullable=True),
+    sa.Column('excluded_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('customer_id', 'campaign_id', 'ip_address')
+    )
+    op.create_index('ix_ads_ip_exclusions_campaign_excluded_at', 'ads_ip_exclusions',
+                    ['customer_id', 'campaign_id', 'excluded_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_ads_ip_exclusions_campaign_excluded_at', table_name='ads_ip_exclusions')
+    op.drop_table('ads_ip_exclusions')
+    op.drop_index('ix_ads_exclusion_queue_next_attempt_at', table_name='ads_exclusion_queue')
+    op.drop_table('ads_exclusion_queue')
@@ -0,0 +1,121 @@
+"""move raw_request_data to event_payloads; range-partition event_logs by month (PostgreSQL)
+
+Revision ID: c7d91e4f2b08
+Revises: 8b4e6d2c1a57
+Create Date: 2026-10-18 11:12:40.318204
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d91e4f2b08'
+down_revision = '8b4e6d2c1a57'
+branch_labels = None
+depends_on = None
+
+EVENT_LOG_INDEXES = [
+    ('ix_event_logs_timestamp', ['timestamp']),
+    ('ix_event_logs_ip_address_timestamp', ['ip_address', 'timestamp']),
+    ('ix_event_logs_channel_timestamp', ['channel', 'timestamp']),
+    ('ix_event_logs_country_timestamp', ['country', 'timestamp']),
+    ('ix_event_logs_device_type_timestamp', ['device_type', 'timestamp']),
+]
+
+
+def _months(first, last):
+    month = datetime(first.year, first.month, 1)
+    while month <= last:
+        next_month = datetime(month.year + (month.month == 12), month.month % 12 + 1, 1)
+        yield month, next_month
+        month = next_month
+
+
+def _partition_event_logs(bind):
+    # Partitioned tables need the partition key in the primary key, so it becomes (id, timestamp)
+    op.execute("ALTER TABLE event_logs RENAME TO event_logs_unpartitioned")
+    _drop_event_log_indexes()
+    op.execute(
+        "CREATE TABLE event_logs (LIKE event_logs_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY RANGE (timestamp)"
+    )
+    op.execute("ALTER TABLE event_logs ALTER COLUMN timestamp SET NOT NULL")
+    op.execute("ALTER TABLE event_logs ADD PRIMARY KEY (id, timestamp)")
+
+    now = datetime.utcnow()
+    oldest = bind.execute(sa.text("SELECT min(timestamp) FROM event_logs_unpartitioned")).scalar() or now
+    newest = datetime(now.year + (now.month >= 11), (now.month + 1) % 12 + 1, 1) # Two months ahead
+    for start, end in _months(oldest, newest):
+        op.execute(
+            f"CREATE TABLE event_logs_p{start:%Y%m} PARTITION OF event_logs "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        )
+    op.execute("CREATE TABLE event_logs_default PARTITION OF event_logs DEFAULT")
+
+    op.execute("INSERT INTO event_logs SELECT * FROM event_logs_unpartitioned")
+    op.execute("ALTER SEQUENCE event_logs_id_seq OWNED BY event_logs.id")
+    op.execute("DROP TABLE event_logs_unpartitioned")
+    _create_event_log_indexes()
+
+
+def _drop_event_log_indexes():
+    # Index names stay with a renamed table, so they are freed before the new table takes them
+    for name, _ in EVENT_LOG_INDEXES + [('ix_event_logs_invalid_timestamp', None)]:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def _create_event_log_indexes():
+    for name, columns in EVENT_LOG_INDEXES:
+        op.create_index(name, 'event_logs', columns, unique=False)
+    op.create_index('ix_event_logs_invalid_timestamp', 'event_logs', ['timestamp'], unique=False,
+                    postgresql_where=sa.text('is_valid_click = false'))
+
+
+def _unpartition_event_logs():
+    # Back to a plain table with PRIMARY KEY (id). Months already archived by `flask storage archive` are not
+    # restored: their rows only exist in the EVENT_ARCHIVE_DIR segments.
+    op.execute("ALTER TABLE event_logs RENAME TO event_logs_partitioned")
+    _drop_event_log_indexes()
+    op.execute(
+        "CREATE TABLE event_logs (LIKE event_logs_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    op.execute("ALTER TABLE event_logs ADD PRIMARY KEY (id)")
+    op.execute("INSERT INTO event_logs SELECT * FROM event_logs_partitioned")
+    # Re-owned first: dropping the old table would otherwise drop the sequence the new id default uses
+    op.execute("ALTER SEQUENCE event_logs_id_seq OWNED BY event_logs.id")
+    op.execute("DROP TABLE event_logs_partitioned") # Every monthly partition and event_logs_default with it
+    _create_event_log_indexes()
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.create_table('event_payloads',
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('raw_request_data', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('event_id')
+    )
+    op.execute(
+        "INSERT INTO event_payloads (event_id, raw_request_data) "
+        "SELECT id, raw_request_data FROM event_logs WHERE raw_request_data IS NOT NULL"
+    )
+    with op.batch_alter_table('event_logs') as batch_op:
+        batch_op.drop_column('raw_request_data')
+
+    # SQLite keeps a single table; event_storage.py treats each month range of it as a partition
+    if bind.dialect.name == 'postgresql':
+        _partition_event_logs(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        _unpartition_event_logs()
+    with op.batch_alter_table('event_logs') as batch_op:
+        batch_op.add_column(sa.Column('raw_request_data', sa.Text(), nullable=True))
+    op.execute(
+        "UPDATE event_logs SET raw_request_data = "
+        "(SELECT raw_request_data FROM event_payloads WHERE event_payloads.event_id = event_logs.id)"
+    )
+    op.drop_table('event_payloads')
@@ -0,0 +1,27 @@
+"""event_rollups.ip_sketch: HyperLogLog of unique IPs per rollup bucket
+
+Revision ID: e19b5c7a3d46
+Revises: d4a8f3b61e92
+Create Date: 2026-10-18 13:21:44.270935
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e19b5c7a3d46'
+down_revision = 'd4a8f3b61e92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('event_rollups') as batch_op:
+        batch_op.add_column(sa.Column('ip_sketch', sa.LargeBinary(), nullable=True))
+    # Existing buckets get sketches from: flask rollups rebuild
+
+
+def downgrade():
+    with op.batch_alter_table('event_rollups') as batch_op:
+        batch_op.drop_column('ip_sketch')
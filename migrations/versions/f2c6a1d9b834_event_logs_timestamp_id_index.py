@@ -0,0 +1,27 @@
+"""event_logs (timestamp, id) index for keyset pagination on /api/logs
+
+Revision ID: f2c6a1d9b834
+Revises: e19b5c7a3d46
+Create Date: 2026-10-18 14:02:09.651378
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6a1d9b834'
+down_revision = 'e19b5c7a3d46'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Supersedes ix_event_logs_timestamp: same leading column, plus the id tie-break of the cursor order
+    op.create_index('ix_event_logs_timestamp_id', 'event_logs', ['timestamp', 'id'], unique=False, if_not_exists=True)
+    op.drop_index('ix_event_logs_timestamp', table_name='event_logs', if_exists=True)
+
+
+def downgrade():
+    op.create_index('ix_event_logs_timestamp', 'event_logs', ['timestamp'], unique=False, if_not_exists=True)
+    op.drop_index('ix_event_logs_timestamp_id', table_name='event_logs')
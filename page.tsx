@@ -23,6 +23,15 @@ interface EventLog {
   invalid_reason: string | null;
 }
 
+interface LiveEventsBatch {
+  mode: 'events' | 'summary';
+  window_ms: number;
+  count: number;
+  valid_clicks: number;
+  invalid_clicks: number;
+  events: EventLog[];
+}
+
 interface Metrics {
   total_events: number;
   valid_clicks: number;
@@ -106,6 +115,12 @@ export default function DashboardPage() {
     socket.on('connect', () => {
       console.log('Connected to WebSocket server in /tracking namespace');
       setIsConnected(true);
+      // The server only sends events matching these filters (channel, country, status)
+      socket.emit('subscribe', {
+        channel: currentFilters?.channel || undefined,
+        country: currentFilters?.country || undefined,
+        status: currentFilters?.status || undefined
+      });
     });
 
     socket.on('disconnect', () => {
@@ -113,26 +128,13 @@ export default function DashboardPage() {
       setIsConnected(false);
     });
 
-    socket.on('new_event', (newEvent: EventLog) => {
-      console.log('Received new_event:', newEvent);
-      // Check if the new event matches current filters before adding to the live table
-      // This is a simplified check; a more robust one would involve checking all filter criteria
-      let matchesFilters = true;
-      if (currentFilters) {
-        if (currentFilters.status && currentFilters.status !== 'all') {
-          if ((currentFilters.status === 'valid' && !newEvent.is_valid_click) || 
-              (currentFilters.status === 'invalid' && newEvent.is_valid_click)) {
-            matchesFilters = false;
-          }
-        }
-        // Add more checks for other filters if desired for live updates
-      }
-
-      if (matchesFilters) {
-        setEvents(prevEvents => [newEvent, ...prevEvents].slice(0, logsPagination.perPage)); // Keep only one page size for live view
+    // One message per window (LIVE_FEED_WINDOW_MS); under load the window only carries summary counts
+    socket.on('live_events', (batch: LiveEventsBatch) => {
+      if (batch.mode === 'events' && batch.events.length) {
+        const newest = [...batch.events].reverse();
+        setEvents(prevEvents => [...newest, ...prevEvents].slice(0, logsPagination.perPage)); // Keep only one page size for live view
       }
-      // Always update metrics, or refetch if complex
-      fetchMetrics(currentFilters); 
+      fetchMetrics(currentFilters);
     });
 
     socket.on('connect_error', (error) => {
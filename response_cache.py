@@ -0,0 +1,153 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/response_cache.py
+import os
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, make_response
+from sqlalchemy import and_
+from src.main import db
+from src.models.event_log import EventLog
+
+# --- Configuration for the dashboard response cache (can be overridden in .env) ---
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512")) # 0 disables the cache
+# Upper bound on staleness for changes the watermark can't see (archival, rule edits, out-of-order commits)
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+
+def current_watermark():
+    """Ingest watermark: the highest event id. Every persisted event moves it forward."""
+    return db.session.query(db.func.max(EventLog.id)).scalar() or 0
+
+def has_new_events(watermark, filters):
+    """True if some event newer than `watermark` matches the filters (a short scan of the newest ids)."""
+    query = db.session.query(EventLog.id).filter(EventLog.id > watermark)
+    if filters:
+        query = query.filter(and_(*filters))
+    return query.limit(1).first() is not None
+
+class CacheEntry:
+    __slots__ = ("body", "mimetype", "etag", "watermark", "expires_at")
+
+    def __init__(self, body, mimetype, etag, watermark, expires_at):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = etag
+        self.watermark = watermark
+        self.expires_at = expires_at
+
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS):
+        """
+        LRU of rendered JSON responses keyed by endpoint + normalized filters. An entry computed at
+        watermark W stays valid while no event with id > W matches its filters (and its TTL hasn't expired).
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "revalidations": 0, "misses": 0, "not_modified": 0, "evictions": 0, "expirations": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def record(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key, watermark, filters):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at <= time.monotonic():
+                    del self._entries[key]
+                    self._counters["expirations"] += 1
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+        if entry is None:
+            return None
+        if entry.watermark != watermark:
+            # New events exist; only a match inside this entry's filters invalidates it
+            if has_new_events(entry.watermark, filters):
+                return None
+            entry.watermark = watermark
+            self.record("revalidations")
+        return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), max_entries=self.max_entries, ttl_seconds=self.ttl_seconds)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+response_cache = ResponseCache()
+
+def _cache_key(endpoint, args):
+    # Normalized filter set: empty parameters dropped, order-independent, status case-insensitive
+    items = []
+    for name in sorted(args):
+        values = [value for value in args.getlist(name) if value != ""]
+        if values:
+            items.append((name, tuple(value.lower() for value in values) if name == "status" else tuple(values)))
+    return (endpoint, tuple(items))
+
+def watermark_cached(endpoint, filters_for):
+    """
+    Caches a GET view's 200 JSON responses and answers If-None-Match with 304.
+    :param endpoint: Name used in the cache key.
+    :param filters_for: Function(request.args) -> list of EventLog filters matching the rows the response
+                        depends on. Raising ValueError bypasses the cache (the view reports the 400).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not response_cache.enabled:
+                return view(*args, **kwargs)
+            try:
+                filters = filters_for(request.args)
+                key = _cache_key(endpoint, request.args)
+                # Read before computing, so events landing mid-computation invalidate the entry next time
+                watermark = current_watermark()
+                entry = response_cache.get(key, watermark, filters)
+            except Exception:
+                return view(*args, **kwargs)
+
+            if entry is not None:
+                response_cache.record("hits")
+                response = make_response(entry.body)
+                response.mimetype = entry.mimetype
+                response.set_etag(entry.etag)
+                response.headers["X-Cache"] = "HIT"
+            else:
+                response_cache.record("misses")
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                response_cache.put(key, CacheEntry(body, response.mimetype, etag, watermark,
+                                                   time.monotonic() + response_cache.ttl_seconds))
+                response.set_etag(etag)
+                response.headers["X-Cache"] = "MISS"
+            response.headers["Cache-Control"] = "no-cache" # Browsers may keep it but must revalidate
+            response.make_conditional(request)
+            if response.status_code == 304:
+                response_cache.record("not_modified")
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,342 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/rollups.py
+import os
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, update, and_, or_, bindparam, func, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from src.main import db
+from src.models.event_log import EventLog, EventRollup
+from src.services.hyperloglog import HyperLogLog
+
+GRAINS = ("minute", "hour", "day") # Finest to coarsest
+DIMENSIONS = ("channel", "country", "device_type")
+REBUILD_CHUNK = timedelta(days=1)
+REBUILD_BATCH_ROWS = 5000
+SKETCH_MERGE_CHUNK_KEYS = 500 # Keys per SELECT when merging sketches (six bound parameters each)
+
+# --- Configuration for event rollups (can be overridden in .env) ---
+# Single-event inserts queue their unique-IP sketches and a background thread merges them this often
+ROLLUP_SKETCH_FLUSH_SECONDS = float(os.getenv("ROLLUP_SKETCH_FLUSH_SECONDS", "5"))
+
+def floor_to_grain(moment, grain):
+    if grain == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if grain == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def ceil_to_grain(moment, grain):
+    floored = floor_to_grain(moment, grain)
+    if floored == moment:
+        return floored
+    return floored + {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}[grain]
+
+def _rollup_keys(row):
+    get = row.get if isinstance(row, dict) else (lambda key, row=row: getattr(row, key))
+    timestamp = get("timestamp") or datetime.utcnow()
+    dimensions = tuple(get(name) or "" for name in DIMENSIONS)
+    is_valid = bool(get("is_valid_click"))
+    return [(grain, floor_to_grain(timestamp, grain)) + dimensions + (is_valid,) for grain in GRAINS]
+
+def rollup_deltas(rows):
+    """
+    Aggregates EventLog rows into rollup increments.
+    :param rows: Iterable of dictionaries (or objects) with timestamp, channel, country, device_type and is_valid_click.
+    :return: Counter keyed by (grain, bucket_start, channel, country, device_type, is_valid_click).
+    """
+    deltas = Counter()
+    for row in rows:
+        deltas.update(_rollup_keys(row))
+    return deltas
+
+def sketch_deltas(rows):
+    """Unique-IP sketches per rollup key for the same rows (rows also need ip_address)."""
+    sketches = {}
+    for row in rows:
+        ip_address = row["ip_address"] if isinstance(row, dict) else row.ip_address
+        for key in _rollup_keys(row):
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = HyperLogLog()
+            sketch.add(ip_address)
+    return sketches
+
+def _delta_rows(deltas):
+    keys = ("grain", "bucket_start") + DIMENSIONS + ("is_valid_click",)
+    # Sorted so concurrent writers take the rollup row locks in the same order
+    return [dict(zip(keys, key), event_count=count) for key, count in sorted(deltas.items())]
+
+def apply_rollup_deltas(connection, deltas, sketches=None):
+    """
+    Adds the increments to event_rollups with INSERT ... ON CONFLICT DO UPDATE (PostgreSQL, SQLite),
+    on the caller's connection so the rollups commit or roll back together with the events.
+    :param sketches: Optional {key: HyperLogLog} merged into the rows' ip_sketch.
+    """
+    if not deltas:
+        return
+    rows = _delta_rows(deltas)
+    table = EventRollup.__table__
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        statement = (postgresql.insert(table) if dialect == "postgresql" else sqlite.insert(table))
+        statement = statement.on_conflict_do_update(
+            index_elements=["grain", "bucket_start"] + list(DIMENSIONS) + ["is_valid_click"],
+            set_={"event_count": table.c.event_count + statement.excluded.event_count}
+        )
+        connection.execute(statement, rows)
+    else:
+        # Other databases: update, then insert the buckets that didn't exist yet
+        for row in rows:
+            key_filter = and_(*(table.c[name] == row[name] for name in row if name != "event_count"))
+            updated = connection.execute(update(table).where(key_filter).values(event_count=table.c.event_count + row["event_count"]))
+            if updated.rowcount == 0:
+                connection.execute(insert(table), row)
+    if sketches:
+        _merge_sketches(connection, sketches)
+
+def _merge_sketches(connection, sketches):
+    # FOR UPDATE (a no-op on SQLite, where the write lock serializes flushes) keeps read-merge-write from losing
+    # a concurrent merge; rows are read in key order so concurrent flushes lock them in the same order
+    table = EventRollup.__table__
+    key_columns = [table.c.grain, table.c.bucket_start] + [table.c[name] for name in DIMENSIONS] + [table.c.is_valid_click]
+    keys = sorted(sketches)
+    for offset in range(0, len(keys), SKETCH_MERGE_CHUNK_KEYS):
+        existing = connection.execute(
+            db.select(table.c.id, table.c.ip_sketch, *key_columns)
+            .where(tuple_(*key_columns).in_(keys[offset:offset + SKETCH_MERGE_CHUNK_KEYS]))
+            .order_by(*key_columns).with_for_update()
+        )
+        _write_merged_sketches(connection, table, existing, sketches)
+
+def _write_merged_sketches(connection, table, existing, sketches):
+    updates = []
+    for row in existing:
+        key = tuple(row[2:])
+        sketch = sketches.get(key)
+        if sketch is None:
+            continue
+        if row.ip_sketch is not None:
+            sketch = HyperLogLog.from_bytes(row.ip_sketch).merge(sketch)
+        blob = sketch.to_bytes()
+        if blob != row.ip_sketch: # Repeat visitors usually leave the sketch unchanged
+            updates.append({"row_id": row.id, "sketch": blob})
+    if updates:
+        connection.execute(update(table).where(table.c.id == bindparam("row_id")).values(ip_sketch=bindparam("sketch")), updates)
+
+def record_events(connection, rows, sketches=True):
+    """
+    Updates the minute, hour and day rollups (counts and unique-IP sketches) for newly inserted EventLog rows.
+    :param sketches: False to update only the counts; the caller then hands the rows to sketch_buffer after committing.
+    """
+    apply_rollup_deltas(connection, rollup_deltas(rows), sketch_deltas(rows) if sketches else None)
+
+class SketchBuffer:
+    def __init__(self, flush_seconds=ROLLUP_SKETCH_FLUSH_SECONDS):
+        """
+        Unique-IP sketches of single-event inserts, merged into event_rollups every `flush_seconds` in one
+        transaction, so an insert doesn't read and rewrite the minute/hour/day sketches under their row locks.
+        Counts stay in the insert's transaction; sketches still queued when a worker dies are lost until
+        `flask rollups rebuild` recomputes that range (they only feed approximate unique_ips).
+        """
+        self.flush_seconds = flush_seconds
+        self._pending = {} # rollup key -> HyperLogLog
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._app = None
+        self._thread = None
+
+    def add(self, app, rows):
+        """Queues the sketches of committed EventLog rows (dictionaries keyed by column name)."""
+        self._fold(sketch_deltas(rows))
+        self._ensure_started(app)
+
+    def _fold(self, sketches):
+        with self._lock:
+            for key, sketch in sketches.items():
+                pending = self._pending.get(key)
+                self._pending[key] = pending.merge(sketch) if pending is not None else sketch
+
+    def _ensure_started(self, app):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                # Started lazily so each gunicorn worker gets its own flusher after the fork
+                self._app = app
+                self._thread = threading.Thread(target=self._run, name="rollup-sketches", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            with self._app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"DB_WARN: Rollup sketch flush failed, retrying next pass: {e}")
+
+    def flush(self):
+        """
+        Merges every queued sketch into event_rollups (needs an app context). Keys whose rollup row doesn't exist
+        (its insert rolled back, or the range was rebuilt) are skipped.
+        :return: Number of rollup keys merged.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            with db.engine.begin() as connection:
+                _merge_sketches(connection, pending)
+        except Exception:
+            self._fold(pending) # Retried by the next flush
+            raise
+        return len(pending)
+
+    def stats(self):
+        with self._lock:
+            return {"pending_keys": len(self._pending), "flush_seconds": self.flush_seconds}
+
+# Process-wide buffer for EVENT_WRITE_MODE=single; group commits and batches merge sketches in their own transaction
+sketch_buffer = SketchBuffer()
+
+# --- Query planning: aligned spans from rollups, unaligned edges from raw rows ---
+def plan_range(start, end, max_grain="day"):
+    """
+    Splits the inclusive range [start, end] into rollup spans and raw-row edges. Each rollup span uses the
+    coarsest grain that fits, so a 90-day range becomes ~90 day rows plus at most a few hours and minutes
+    on each side, and at most one partial minute at each end is read from event_logs.
+    :param start: datetime or None (unbounded).
+    :param end: datetime or None (unbounded).
+    :param max_grain: Coarsest grain to use (timeseries buckets must not be split by a rollup row).
+    :return: (spans, edges) where spans are (grain, lo, hi) with lo <= bucket_start < hi (None = unbounded)
+             and edges are (lo, hi, hi_inclusive) timestamp ranges to aggregate from event_logs.
+    """
+    spans, edges = [], []
+    lo = ceil_to_grain(start, "minute") if start else None
+    hi = floor_to_grain(end, "minute") if end else None
+    if lo is not None and hi is not None and lo >= hi:
+        return [], [(start, end, True)] # Shorter than a minute
+    if start and lo != start:
+        edges.append((start, lo, False))
+    if end:
+        edges.append((hi, end, True))
+
+    def split(lo, hi, grain_index):
+        grain = GRAINS[grain_index]
+        if grain == max_grain:
+            spans.append((grain, lo, hi))
+            return
+        coarser = GRAINS[grain_index + 1]
+        inner_lo = ceil_to_grain(lo, coarser) if lo else None
+        inner_hi = floor_to_grain(hi, coarser) if hi else None
+        if inner_lo is not None and inner_hi is not None and inner_lo >= inner_hi:
+            spans.append((grain, lo, hi))
+            return
+        if lo is not None and inner_lo != lo:
+            spans.append((grain, lo, inner_lo))
+        if hi is not None and inner_hi != hi:
+            spans.append((grain, inner_hi, hi))
+        split(inner_lo, inner_hi, grain_index + 1)
+
+    split(lo, hi, 0)
+    return spans, edges
+
+def span_filter(spans):
+    """OR of the (grain, bucket_start range) conditions for a plan_range() result."""
+    conditions = []
+    for grain, lo, hi in spans:
+        condition = [EventRollup.grain == grain]
+        if lo is not None:
+            condition.append(EventRollup.bucket_start >= lo)
+        if hi is not None:
+            condition.append(EventRollup.bucket_start < hi)
+        conditions.append(and_(*condition))
+    return or_(*conditions)
+
+def edge_filter(edges):
+    """OR of the raw EventLog timestamp ranges for a plan_range() result."""
+    return or_(*(and_(EventLog.timestamp >= lo, EventLog.timestamp <= hi if inclusive else EventLog.timestamp < hi)
+                 for lo, hi, inclusive in edges))
+
+def count_events(start_date, end_date, dimension_filters=(), valid_filter=None):
+    """
+    (total, valid, invalid) event counts for the inclusive range: aligned minutes, hours and days from
+    event_rollups, plus the partial minutes at the edges from event_logs.
+    :param dimension_filters: (column name, value) pairs for channel, country and device_type.
+    :param valid_filter: True/False to count only valid/invalid clicks, None for both.
+    """
+    spans, edges = plan_range(start_date, end_date)
+    total = valid = invalid = 0
+    if spans:
+        rollup_filters = [span_filter(spans)] + [getattr(EventRollup, name) == value for name, value in dimension_filters]
+        if valid_filter is not None:
+            rollup_filters.append(EventRollup.is_valid_click == valid_filter)
+        row = db.session.query(
+            func.sum(EventRollup.event_count),
+            func.sum(db.case((EventRollup.is_valid_click == True, EventRollup.event_count), else_=0)),
+            func.sum(db.case((EventRollup.is_valid_click == False, EventRollup.event_count), else_=0))
+        ).filter(and_(*rollup_filters)).one()
+        total, valid, invalid = (value or 0 for value in row)
+    if edges:
+        raw_filters = [edge_filter(edges)] + [getattr(EventLog, name) == value for name, value in dimension_filters]
+        if valid_filter is not None:
+            raw_filters.append(EventLog.is_valid_click == valid_filter)
+        row = db.session.query(
+            func.count(EventLog.id),
+            func.sum(db.case((EventLog.is_valid_click == True, 1), else_=0)),
+            func.sum(db.case((EventLog.is_valid_click == False, 1), else_=0))
+        ).filter(and_(*raw_filters)).one()
+        total, valid, invalid = total + (row[0] or 0), valid + (row[1] or 0), invalid + (row[2] or 0)
+    return total, valid, invalid
+
+# --- Backfill / rebuild ---
+def rebuild_rollups(start=None, end=None):
+    """
+    Recomputes the rollups from event_logs one day at a time (each day in its own transaction).
+    Rebuilding a day that is still receiving events can miss clicks written during the rebuild, so run it
+    for past days, or for today while ingest is paused. Don't pass a start inside archived ranges: their raw
+    rows are gone and the rollups are the only copy left.
+    :return: Number of events aggregated.
+    """
+    if start is None:
+        start = db.session.query(db.func.min(EventLog.timestamp)).scalar()
+        if start is None:
+            return 0
+    start = floor_to_grain(start, "day")
+    end = ceil_to_grain(end or datetime.utcnow(), "day")
+    columns = [EventLog.timestamp, EventLog.ip_address, EventLog.channel, EventLog.country, EventLog.device_type, EventLog.is_valid_click]
+    total = 0
+    day = start
+    while day < end:
+        next_day = day + REBUILD_CHUNK
+        with db.engine.begin() as connection:
+            connection.execute(EventRollup.__table__.delete().where(and_(
+                EventRollup.bucket_start >= day, EventRollup.bucket_start < next_day)))
+            result = connection.execution_options(yield_per=REBUILD_BATCH_ROWS).execute(
+                db.select(*columns).where(EventLog.timestamp >= day, EventLog.timestamp < next_day))
+            deltas, sketches = Counter(), {}
+            for partition in result.partitions():
+                rows = [row._asdict() for row in partition]
+                deltas.update(rollup_deltas(rows))
+                for key, sketch in sketch_deltas(rows).items():
+                    sketches[key] = sketches[key].merge(sketch) if key in sketches else sketch
+                total += len(rows)
+            apply_rollup_deltas(connection, deltas, sketches)
+        day = next_day
+    return total
+
+# --- CLI: flask rollups rebuild [--start ...] [--end ...] ---
+rollups_cli = AppGroup("rollups", help="Pre-aggregated event rollups behind /api/metrics.")
+
+@rollups_cli.command("rebuild")
+@click.option("--start", default=None, help="ISO date; defaults to the oldest event.")
+@click.option("--end", default=None, help="ISO date; defaults to now.")
+def rebuild_command(start, end):
+    """Backfill or rebuild the minute/hour/day rollups from event_logs."""
+    total = rebuild_rollups(datetime.fromisoformat(start) if start else None, datetime.fromisoformat(end) if end else None)
+    click.echo(f"Rolled up {total} events.")
@@ -0,0 +1,385 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/rule_engine.py
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from src.main import db
+from src.models.event_log import EventLog, InvalidClickRule
+from src.services.ip_frequency import create_ip_frequency_tracker
+from src.services.ua_matcher import UserAgentMatcher
+
+# --- Configuration for the click rule engine (can be overridden in .env) ---
+CLICK_RULES_SOURCE = os.getenv("CLICK_RULES_SOURCE", "config").lower() # 'config' (file/built-in) or 'db' (invalid_click_rules table)
+CLICK_RULES_FILE = os.getenv("CLICK_RULES_FILE", "") # JSON list of rules; empty = built-in defaults
+CLICK_RULES_MODE = os.getenv("CLICK_RULES_MODE", "collect_all").lower() # 'first_hit' or 'collect_all' (audit)
+CLICK_RULES_RELOAD_SECONDS = float(os.getenv("CLICK_RULES_RELOAD_SECONDS", "30"))
+
+EVALUATION_MODES = ("first_hit", "collect_all")
+
+class Rule:
+    """Base class for compiled rules. check() returns a reason string on a hit, None otherwise."""
+    parameter = None
+    code = None
+    reason_prefix = None # Start of the reason text check() returns; maps stored invalid_reason text back to codes
+    default_cost = 50
+
+    def __init__(self, name, value=None, time_window_seconds=None, cost=None, rule_id=None):
+        self.name = name
+        self.rule_id = rule_id if rule_id is not None else name # Stats key; names need not be unique
+        self.value = value
+        self.time_window_seconds = time_window_seconds
+        self.cost = cost if cost is not None else self.default_cost
+
+    def check(self, click):
+        raise NotImplementedError
+
+    def skip(self, click):
+        """Called instead of check() when a first_hit evaluation stopped before this rule."""
+        pass
+
+    def describe(self):
+        return {
+            "id": self.rule_id,
+            "name": self.name,
+            "parameter": self.parameter,
+            "code": self.code,
+            "value": self.value,
+            "time_window_seconds": self.time_window_seconds,
+            "cost": self.cost
+        }
+
+class IpBlacklistRule(Rule):
+    parameter = "ip_blacklist"
+    code = "IP_BLACKLISTED"
+    reason_prefix = "Blacklisted IP:"
+    default_cost = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ip_addresses = {ip.strip() for ip in (self.value or "").split("|") if ip.strip()}
+
+    def check(self, click):
+        if click.ip_address in self.ip_addresses:
+            return f"Blacklisted IP: {click.ip_address}"
+        return None
+
+class EmptyUserAgentRule(Rule):
+    parameter = "user_agent_empty"
+    code = "EMPTY_USER_AGENT"
+    reason_prefix = "Empty or Generic User Agent"
+    default_cost = 1
+
+    def check(self, click):
+        from src.services.click_validator import EMPTY_OR_GENERIC_USER_AGENTS
+        if not click.user_agent or click.user_agent in EMPTY_OR_GENERIC_USER_AGENTS:
+            return "Empty or Generic User Agent"
+        return None
+
+class GeoMismatchRule(Rule):
+    parameter = "geo_mismatch"
+    code = "GEO_MISMATCH"
+    reason_prefix = "Geolocation Mismatch:"
+    default_cost = 2
+
+    def check(self, click):
+        campaign_country = click.campaign_country
+        click_country = click.event_data.get("country")
+        if campaign_country and click_country:
+            if click_country.upper() != campaign_country.upper() and click_country not in ["Unknown", "Local"]:
+                return f"Geolocation Mismatch: Click from {click_country}, expected {campaign_country}"
+        return None
+
+class UserAgentSignatureRule(Rule):
+    parameter = "user_agent_blacklist"
+    code = "SUSPICIOUS_USER_AGENT"
+    reason_prefix = "Suspicious User Agent:"
+    default_cost = 5
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # "default" (or empty) uses the shared matcher over SUSPICIOUS_USER_AGENT_SUBSTRINGS / UA_SIGNATURES_FILE
+        signatures = [s.strip().lower() for s in (self.value or "").split("|") if s.strip() and s.strip() != "default"]
+        if signatures:
+            self.matcher = UserAgentMatcher(signatures, path="")
+        else:
+            from src.services.click_validator import user_agent_matcher
+            self.matcher = user_agent_matcher
+
+    def check(self, click):
+        substring = self.matcher.match(click.raw_user_agent)
+        if substring is not None:
+            return f"Suspicious User Agent: contains '{substring}'"
+        return None
+
+class IpFrequencyRule(Rule):
+    parameter = "ip_frequency"
+    code = "HIGH_IP_FREQUENCY"
+    reason_prefix = "High IP Frequency:"
+    default_cost = 10
+
+    _trackers = {} # window_seconds -> tracker, shared by every compiled rule with that window
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from src.services.click_validator import CLICK_FREQ_LIMIT, CLICK_FREQ_WINDOW_SECONDS, ip_frequency_tracker, LOCAL_IP_ADDRESSES
+        self.limit = int(self.value) if self.value not in (None, "", "default") else CLICK_FREQ_LIMIT
+        self.window_seconds = self.time_window_seconds or CLICK_FREQ_WINDOW_SECONDS
+        self.local_ip_addresses = LOCAL_IP_ADDRESSES
+        if ip_frequency_tracker is None: # IP_FREQ_BACKEND=db
+            self.tracker = None
+            self.cost = max(self.cost, 100)
+        elif self.window_seconds == CLICK_FREQ_WINDOW_SECONDS:
+            self.tracker = ip_frequency_tracker
+        else:
+            if self.window_seconds not in IpFrequencyRule._trackers:
+                IpFrequencyRule._trackers[self.window_seconds] = create_ip_frequency_tracker(self.window_seconds)
+            self.tracker = IpFrequencyRule._trackers[self.window_seconds]
+
+    def _recent_clicks(self, click):
+        if click.recent_clicks_count is not None: # Pre-computed by ClickValidator.validate_batch()
+            return click.recent_clicks_count
+        if self.tracker is not None:
+            return self.tracker.hit(click.ip_address)
+        time_window_start = datetime.utcnow() - timedelta(seconds=self.window_seconds)
+        return EventLog.query.filter(
+            EventLog.ip_address == click.ip_address,
+            EventLog.timestamp >= time_window_start
+        ).count()
+
+    def check(self, click):
+        if not click.ip_address or click.ip_address in self.local_ip_addresses:
+            return None # Do not check local IPs for frequency
+        try:
+            recent_clicks_count = self._recent_clicks(click)
+        except Exception as e:
+            print(f"DB_WARN: Could not check IP frequency for {click.ip_address} (DB might be unavailable or not migrated): {e}")
+            return None # Fail open
+        if recent_clicks_count >= self.limit:
+            return f"High IP Frequency: {recent_clicks_count + 1} clicks in {self.window_seconds}s"
+        return None
+
+    def skip(self, click):
+        # The sliding window must still see this click, or later clicks from the IP would be under-counted
+        if self.tracker is not None and click.ip_address and click.ip_address not in self.local_ip_addresses and click.recent_clicks_count is None:
+            try:
+                self.tracker.hit(click.ip_address)
+            except Exception as e:
+                print(f"FREQ_WARN: Could not record click for {click.ip_address}: {e}")
+
+RULE_TYPES = {rule_class.parameter: rule_class for rule_class in (
+    IpBlacklistRule, EmptyUserAgentRule, GeoMismatchRule, UserAgentSignatureRule, IpFrequencyRule
+)}
+
+REASON_CODES = tuple(rule_class.code for rule_class in RULE_TYPES.values())
+
+def reason_codes_for(invalid_reason):
+    """
+    Structured codes for a stored invalid_reason string (reasons are joined with ", ", which can also
+    appear inside a single reason, so this matches on each rule's reason prefix instead of splitting).
+    """
+    if not invalid_reason:
+        return []
+    return [rule_class.code for rule_class in RULE_TYPES.values() if rule_class.reason_prefix in invalid_reason]
+
+# Equivalent of the original hard-coded checks. The geolocation rule ships inactive, as it was before.
+DEFAULT_RULES = [
+    {"name": "Empty or generic User-Agent", "parameter": "user_agent_empty", "value": "default"},
+    {"name": "Suspicious User-Agent", "parameter": "user_agent_blacklist", "value": "default"},
+    {"name": "High IP frequency", "parameter": "ip_frequency", "value": "default"},
+    {"name": "Geolocation mismatch", "parameter": "geo_mismatch", "value": "default", "is_active": False},
+]
+
+def compile_rule(definition, position=None):
+    """
+    Builds a Rule from a dict (config) or an InvalidClickRule row.
+    :param position: Index in the source, used as the rule id when the definition has no "id".
+    :return: Rule instance, or None if inactive or of an unknown type.
+    :raises: ValueError/TypeError for an invalid value (e.g. a non-numeric ip_frequency limit).
+    """
+    get = definition.get if isinstance(definition, dict) else lambda key, default=None: getattr(definition, key, default)
+    if get("is_active", True) is False:
+        return None
+    rule_class = RULE_TYPES.get(get("parameter"))
+    if rule_class is None:
+        print(f"RULES_WARN: Unknown rule parameter '{get('parameter')}' in rule '{get('name')}', skipping it.")
+        return None
+    rule_id = get("id")
+    if rule_id is None and position is not None:
+        rule_id = f"#{position}"
+    return rule_class(get("name"), value=get("value"), time_window_seconds=get("time_window_seconds"), cost=get("cost"),
+                      rule_id=rule_id)
+
+def compile_rules(definitions):
+    """
+    Compiles each definition on its own, so one bad rule cannot take the whole set down.
+    :return: Tuple (rules, failed) with the compiled rules (None for inactive ones) and the number that failed to compile.
+    """
+    rules, failed = [], 0
+    for position, definition in enumerate(definitions):
+        try:
+            rules.append(compile_rule(definition, position))
+        except Exception as e:
+            name = definition.get("name") if isinstance(definition, dict) else getattr(definition, "name", None)
+            print(f"RULES_WARN: Could not compile rule '{name}', skipping it: {e}")
+            failed += 1
+    return rules, failed
+
+class _RuleStats:
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.skipped = 0
+        self.total_ms = 0.0
+
+    def to_dict(self):
+        return {
+            "evaluations": self.evaluations,
+            "hits": self.hits,
+            "skipped": self.skipped,
+            "hit_rate": round(self.hits / self.evaluations, 4) if self.evaluations else 0.0,
+            "avg_ms": round(self.total_ms / self.evaluations, 4) if self.evaluations else 0.0,
+            "total_ms": round(self.total_ms, 3)
+        }
+
+class ClickRuleEngine:
+    def __init__(self, source=CLICK_RULES_SOURCE, mode=CLICK_RULES_MODE, rules_file=CLICK_RULES_FILE,
+                 reload_seconds=CLICK_RULES_RELOAD_SECONDS):
+        """
+        Compiles click rules from config or from the invalid_click_rules table, orders them by cost
+        (cheap in-memory rules first) and hot-reloads them when their source changes.
+        :param source: 'config' or 'db'.
+        :param mode: Default evaluation mode, 'first_hit' or 'collect_all'.
+        """
+        if mode not in EVALUATION_MODES:
+            raise ValueError(f"Invalid CLICK_RULES_MODE '{mode}'. Use one of {EVALUATION_MODES}.")
+        self.source = source
+        self.mode = mode
+        self.rules_file = rules_file or None
+        self.reload_seconds = reload_seconds
+        self._rules = None
+        self._version = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.reloads = 0
+
+    # --- Loading ---
+    def _source_version(self):
+        """Cheap fingerprint of the rule source, compared on every reload check."""
+        if self.source == "db":
+            count, last_update = db.session.query(func.count(InvalidClickRule.id), func.max(InvalidClickRule.updated_at)).one()
+            return (count, last_update)
+        if self.rules_file:
+            return os.path.getmtime(self.rules_file)
+        return "defaults"
+
+    def _load_definitions(self):
+        if self.source == "db":
+            return InvalidClickRule.query.all()
+        if self.rules_file:
+            with open(self.rules_file, encoding="utf-8") as f:
+                return json.load(f)
+        return DEFAULT_RULES
+
+    def _compile(self):
+        try:
+            version = self._source_version()
+            if self._rules is not None and version == self._version:
+                return
+            definitions = self._load_definitions()
+        except Exception as e:
+            self._fall_back(f"Could not load click rules from {self.source}: {e}")
+            return
+        try:
+            rules, failed = compile_rules(definitions)
+        except Exception as e: # e.g. a rules file that is not a JSON list
+            self._fall_back(f"Could not compile click rules from {self.source}: {e}")
+            return
+        if failed and not any(rule is not None for rule in rules):
+            # Nothing usable; the version is still recorded so the same source is not recompiled on every click
+            self._fall_back(f"None of the click rules from {self.source} compiled")
+            self._version = version
+            return
+        self._install(rules, version)
+
+    def _fall_back(self, message):
+        """Keeps the last good rule set, or installs the built-in defaults if there is none yet."""
+        if self._rules is None:
+            print(f"RULES_WARN: {message}, using built-in defaults.")
+            self._install(compile_rules(DEFAULT_RULES)[0], None)
+        else:
+            print(f"RULES_WARN: {message}, keeping the current set.")
+
+    def _install(self, rules, version):
+        rules = sorted((rule for rule in rules if rule is not None), key=lambda rule: rule.cost) # Stable: ties keep source order
+        for rule in rules:
+            self._stats.setdefault(rule.rule_id, _RuleStats())
+        self._rules = rules
+        self._version = version
+        self.reloads += 1
+
+    def rules(self):
+        """Returns the compiled rules in evaluation order, reloading them if the source changed."""
+        now = time.monotonic()
+        if self._rules is None or now >= self._next_check:
+            with self._lock:
+                if self._rules is None or now >= self._next_check:
+                    self._next_check = now + self.reload_seconds
+                    self._compile()
+        return self._rules
+
+    def reload(self):
+        """Forces a reload on the next evaluation."""
+        with self._lock:
+            self._next_check = 0.0
+            self._version = None
+
+    # --- Evaluation ---
+    def evaluate(self, click, mode=None):
+        """
+        Runs the rules against a click (a ClickValidator instance).
+        :param mode: 'first_hit' stops at the first hit; 'collect_all' runs every rule. Defaults to CLICK_RULES_MODE.
+        :return: List of (rule, reason) for each hit, in evaluation order.
+        """
+        mode = mode or self.mode
+        rules = self.rules()
+        hits = []
+        timings = []
+        for position, rule in enumerate(rules):
+            started = time.perf_counter()
+            reason = rule.check(click)
+            timings.append((rule, (time.perf_counter() - started) * 1000, reason is not None))
+            if reason is not None:
+                hits.append((rule, reason))
+                if mode == "first_hit":
+                    for skipped_rule in rules[position + 1:]:
+                        skipped_rule.skip(click)
+                    break
+
+        with self._lock:
+            for rule, elapsed_ms, hit in timings:
+                stats = self._stats[rule.rule_id]
+                stats.evaluations += 1
+                stats.total_ms += elapsed_ms
+                if hit:
+                    stats.hits += 1
+            if mode == "first_hit" and hits:
+                for skipped_rule in rules[len(timings):]:
+                    self._stats[skipped_rule.rule_id].skipped += 1
+        return hits
+
+    def stats(self):
+        """Returns the active rules (in evaluation order) with their latency and hit-rate counters."""
+        rules = self.rules()
+        with self._lock:
+            return {
+                "source": self.source,
+                "mode": self.mode,
+                "reloads": self.reloads,
+                "rules": [dict(rule.describe(), **self._stats[rule.rule_id].to_dict()) for rule in rules]
+            }
+
+# Process-wide engine used by ClickValidator.validate()
+click_rule_engine = ClickRuleEngine()
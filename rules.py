@@ -0,0 +1,20 @@
+from flask import Blueprint, jsonify
+from src.services.rule_engine import click_rule_engine
+from src.routes.internal import require_internal_access
+
+rules_bp = Blueprint("rules", __name__)
+
+@rules_bp.route("/rules", methods=["GET"])
+def get_rules():
+    # Active click rules in evaluation order, with per-rule latency and hit-rate counters
+    return jsonify(click_rule_engine.stats()), 200
+
+@rules_bp.route("/rules/reload", methods=["POST"])
+def reload_rules():
+    # Rules also reload on their own every CLICK_RULES_RELOAD_SECONDS when the source changes.
+    # Reloading swaps the global rule set, so it needs the same token (or loopback) as /internal/*
+    denied = require_internal_access()
+    if denied is not None:
+        return denied
+    click_rule_engine.reload()
+    return jsonify(click_rule_engine.stats()), 200
@@ -0,0 +1,100 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/serialization.py
+import io
+import csv
+import json
+from flask import current_app
+from src.models.event_log import EventLog
+
+try:
+    import orjson # Optional dependency: encodes row-heavy payloads several times faster than the stdlib
+except ImportError:
+    orjson = None
+
+# Serialized EventLog columns, in EventLog.to_dict() order
+EVENT_FIELDS = ('id', 'ip_address', 'user_agent', 'timestamp', 'url_accessed', 'referer_url', 'country', 'city', 'region',
+                'isp', 'latitude', 'longitude', 'channel', 'device_type', 'is_valid_click', 'invalid_reason')
+CHUNK_BYTES = 65536 # Default size of the byte chunks yielded by the streaming encoders
+
+# Fallback encoder when orjson isn't installed: compact, keys in insertion order (Flask's provider sorts
+# them) and no circular-reference bookkeeping, which plain rows never need
+_json_encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False)
+
+def event_columns(fields=EVENT_FIELDS):
+    """
+    Table columns for `fields`; select these (or Query.with_entities(*event_columns())) to get plain
+    row tuples instead of hydrated EventLog objects.
+    """
+    return [EventLog.__table__.c[field] for field in fields]
+
+def format_timestamp(value):
+    """Timestamp as EventLog.to_dict() renders it (naive UTC datetime, ISO 8601 with a 'Z' suffix)."""
+    return value.isoformat() + 'Z' if value is not None else None
+
+def event_dicts(rows, fields=EVENT_FIELDS):
+    """to_dict()-shaped dictionaries from row tuples whose values are in `fields` order."""
+    dicts = [dict(zip(fields, row)) for row in rows]
+    if "timestamp" in fields:
+        for event_dict in dicts:
+            event_dict["timestamp"] = format_timestamp(event_dict["timestamp"])
+    return dicts
+
+def event_row_dict(event_id, row):
+    """to_dict()-shaped dictionary for a just-inserted row (a dict keyed by column name), without building an EventLog."""
+    event_dict = {field: row.get(field) for field in EVENT_FIELDS}
+    event_dict["id"] = event_id
+    event_dict["timestamp"] = format_timestamp(event_dict["timestamp"])
+    return event_dict
+
+def encode_json(payload):
+    """UTF-8 JSON bytes for a payload of plain dicts/lists/scalars (orjson when installed, else the stdlib)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError: # e.g. an integer beyond 64 bits, which the stdlib encoder still handles
+            pass
+    return _json_encoder.encode(payload).encode("utf-8")
+
+def json_response(payload, status=200):
+    """Like jsonify(), with encode_json() (no key sorting, no pretty printing in debug)."""
+    return current_app.response_class(encode_json(payload), status=status, mimetype="application/json")
+
+def _formatted(records, fields):
+    # Rows with the timestamp rendered; every other value is passed through as selected
+    if "timestamp" not in fields:
+        return records
+    index = fields.index("timestamp")
+    return (record[:index] + (format_timestamp(record[index]),) + record[index + 1:] for record in records)
+
+def csv_chunks(records, fields, chunk_bytes=CHUNK_BYTES):
+    """
+    Encodes row tuples as CSV (header row first) and yields UTF-8 chunks of about `chunk_bytes`.
+    :param records: Tuples of values in `fields` order (see export_jobs.iter_export_records).
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(fields)
+    for record in _formatted(records, fields):
+        writer.writerow(record)
+        if output.tell() >= chunk_bytes:
+            yield output.getvalue().encode("utf-8")
+            output.seek(0)
+            output.truncate()
+    if output.tell():
+        yield output.getvalue().encode("utf-8")
+
+def ndjson_chunks(records, fields, chunk_bytes=CHUNK_BYTES):
+    """Encodes row tuples as one JSON object per line and yields UTF-8 chunks of about `chunk_bytes`."""
+    lines = []
+    size = 0
+    for record in _formatted(records, fields):
+        line = encode_json(dict(zip(fields, record)))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= chunk_bytes:
+            lines.append(b"")
+            yield b"\n".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        lines.append(b"")
+        yield b"\n".join(lines)
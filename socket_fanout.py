@@ -0,0 +1,52 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/socket_fanout.py
+import os
+
+# --- Configuration for cross-process Socket.IO fan-out (can be overridden in .env) ---
+# With a message queue every emit goes through it, so clients on any gunicorn worker receive it.
+# Empty keeps the in-process server (only safe with a single worker).
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "") # e.g. redis://localhost:6379/1 (any Redis-compatible server)
+SOCKETIO_CHANNEL = os.getenv("SOCKETIO_CHANNEL", "traffic-tracker") # Pub/sub channel; separates apps sharing one server
+
+_external_emitter = None
+_redis_client = None
+_redis_checked = False
+
+def socketio_options():
+    """Keyword arguments for socketio.init_app() (see main.create_app)."""
+    if not SOCKETIO_MESSAGE_QUEUE:
+        return {}
+    return {"message_queue": SOCKETIO_MESSAGE_QUEUE, "channel": SOCKETIO_CHANNEL}
+
+def uses_redis_queue():
+    return SOCKETIO_MESSAGE_QUEUE.startswith(("redis://", "rediss://", "unix://"))
+
+def external_emitter():
+    """
+    Write-only Socket.IO emitter for processes that do not serve clients (background ingest workers, scripts).
+    Its emits are published on the message queue and delivered by the workers that hold the connections.
+    :return: A flask_socketio.SocketIO with emit(), or None when no message queue is configured.
+    """
+    global _external_emitter
+    if not SOCKETIO_MESSAGE_QUEUE:
+        return None
+    if _external_emitter is None:
+        from flask_socketio import SocketIO
+        _external_emitter = SocketIO(message_queue=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL)
+    return _external_emitter
+
+def shared_redis_client():
+    """
+    Client for state that every worker must see (e.g. live feed subscription rooms), on the message queue server.
+    :return: redis.Redis, or None without a Redis message queue or if it is unreachable.
+    """
+    global _redis_client, _redis_checked
+    if not _redis_checked and uses_redis_queue():
+        _redis_checked = True # Tried once per process; an unreachable server is reported a single time
+        try:
+            import redis # Optional dependency, already required by Socket.IO's Redis message queue
+            client = redis.Redis.from_url(SOCKETIO_MESSAGE_QUEUE, decode_responses=True)
+            client.ping()
+            _redis_client = client
+        except Exception as e:
+            print(f"SOCKET_WARN: Redis at {SOCKETIO_MESSAGE_QUEUE} unavailable for shared Socket.IO state: {e}")
+    return _redis_client
@@ -0,0 +1,26 @@
+# Shared setup for the pytest suite: a temporary SQLite database and the background loops turned off.
+#
+# Usage (from the project root, with pytest installed):
+#   python -m pytest -q tests
+import os
+import tempfile
+
+import pytest
+
+# Read at import time by the services, so these must be set before anything imports src.main
+os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "tests.db")
+os.environ["GEO_CACHE_DB_PATH"] = ""
+os.environ["INGEST_MODE"] = "sync"
+os.environ["EVENT_WRITE_MODE"] = "single"
+os.environ["ADS_EXCLUSION_ENABLED"] = "true"
+os.environ["GOOGLE_ADS_CUSTOMER_ID_TO_UPDATE"] = "1234567890"
+os.environ["ADS_EXCLUSION_POLL_SECONDS"] = "3600" # The tests drive their own processors, not the background loop
+
+@pytest.fixture
+def app():
+    from src.main import app, db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
@@ -0,0 +1,87 @@
+# Fake Google Ads client for the exclusion queue tests: records mutate requests and keeps the campaign criteria in
+# memory, so GoogleAdsManager and ExclusionProcessor run without credentials or network access.
+import re
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+CUSTOMER_ID = "1234567890"
+
+
+class FakeNotFound(Exception):
+    def __str__(self):
+        return "mutate_error: RESOURCE_NOT_FOUND"
+
+class FakeCampaignCriterionService:
+    def __init__(self, limit):
+        self.limit = limit
+        self.requests = [] # (customer_id, removed resource names, created IPs)
+        self.criteria = {} # criterion resource name -> (campaign resource name, IP)
+        self.fail_next = 0
+        self._next_id = 1
+
+    def campaign_ips(self, campaign):
+        return {ip for owner, ip in self.criteria.values() if owner == campaign}
+
+    def add(self, campaign, ip):
+        """An exclusion made outside the app (e.g. in the Google Ads UI)."""
+        resource_name = f"{campaign}~{self._next_id}".replace("/campaigns/", "/campaignCriteria/")
+        self._next_id += 1
+        self.criteria[resource_name] = (campaign, ip)
+        return resource_name
+
+    def mutate_campaign_criteria(self, customer_id, operations):
+        if self.fail_next:
+            self.fail_next -= 1
+            raise RuntimeError("RESOURCE_TEMPORARILY_EXHAUSTED")
+        removes = [operation.remove for operation in operations if operation.remove]
+        creates = [operation.create for operation in operations if not operation.remove]
+        if any(resource_name not in self.criteria for resource_name in removes):
+            raise FakeNotFound()
+        campaign = creates[0].campaign if creates else None
+        before = dict(self.criteria)
+        for resource_name in removes:
+            del self.criteria[resource_name]
+        results = [SimpleNamespace(resource_name=resource_name) for resource_name in removes]
+        for criterion in creates:
+            assert criterion.negative, "IP exclusions must be negative criteria"
+            results.append(SimpleNamespace(resource_name=self.add(campaign, criterion.ip_block.ip_address)))
+        if len(self.campaign_ips(campaign)) > self.limit: # The API rejects the whole request
+            self.criteria = before
+            raise RuntimeError(f"Too many IP exclusions for {campaign}")
+        self.requests.append((customer_id, removes, [criterion.ip_block.ip_address for criterion in creates]))
+        return SimpleNamespace(results=results)
+
+class FakeGoogleAdsService:
+    def __init__(self, criterion_service):
+        self.criterion_service = criterion_service
+        self.searches = 0
+
+    def search(self, customer_id, query):
+        self.searches += 1
+        campaign_id = re.search(r"campaign\.id = (\d+)", query).group(1)
+        campaign = f"customers/{customer_id}/campaigns/{campaign_id}"
+        return [SimpleNamespace(campaign_criterion=SimpleNamespace(resource_name=resource_name, ip_block=SimpleNamespace(ip_address=ip)))
+                for resource_name, (owner, ip) in self.criterion_service.criteria.items() if owner == campaign]
+
+class FakeGoogleAdsClient:
+    """Stand-in for GoogleAdsClient: the services and the one type GoogleAdsManager uses for IP exclusions."""
+    def __init__(self, limit):
+        self.criterion_service = FakeCampaignCriterionService(limit)
+        self.ads_service = FakeGoogleAdsService(self.criterion_service)
+        self.campaign_service = SimpleNamespace(campaign_path=lambda customer_id, campaign_id: f"customers/{customer_id}/campaigns/{campaign_id}")
+
+    def get_service(self, name):
+        return {"CampaignCriterionService": self.criterion_service, "CampaignService": self.campaign_service,
+                "GoogleAdsService": self.ads_service}[name]
+
+    def get_type(self, name):
+        assert name == "CampaignCriterionOperation"
+        return SimpleNamespace(remove="", create=SimpleNamespace(campaign=None, negative=False, ip_block=SimpleNamespace(ip_address=None)))
+
+class ShiftedClock:
+    """datetime.utcnow() moved forward by `offset`, so rows are due as soon as they are queued and delays can be skipped."""
+    def __init__(self):
+        self.offset = timedelta()
+
+    def __call__(self):
+        return datetime.utcnow() + self.offset
@@ -0,0 +1,174 @@
+from types import SimpleNamespace
+from datetime import timedelta
+
+import pytest
+
+from fake_google_ads import CUSTOMER_ID, FakeGoogleAdsClient, ShiftedClock
+from src.main import db
+from src.models.event_log import AdsExclusionQueueItem, AdsIpExclusion
+from src.services.google_ads_manager import GoogleAdsManager, get_ads_client, forget_ads_client, resource_cache
+from src.services.ads_exclusion_queue import ExclusionProcessor, TokenBucket, enqueue_exclusions, exclusion_candidate, exclusion_cache
+
+CAMPAIGN_111 = f"customers/{CUSTOMER_ID}/campaigns/111"
+CAMPAIGN_222 = f"customers/{CUSTOMER_ID}/campaigns/222"
+
+@pytest.fixture(autouse=True)
+def clean_caches(app):
+    exclusion_cache.clear()
+    resource_cache.invalidate(CUSTOMER_ID)
+    yield
+    exclusion_cache.clear()
+    resource_cache.invalidate(CUSTOMER_ID)
+
+def queued():
+    return db.session.query(AdsExclusionQueueItem).count()
+
+def build(batch_size=3, list_limit=5, operation_bucket=None, request_bucket=None):
+    client = FakeGoogleAdsClient(list_limit)
+    clock = ShiftedClock()
+    processor = ExclusionProcessor(manager_factory=lambda customer_id: GoogleAdsManager(customer_id, client=client),
+                                   batch_size=batch_size, max_delay_seconds=60, list_limit=list_limit, max_attempts=2,
+                                   request_bucket=request_bucket, operation_bucket=operation_bucket or TokenBucket(1000, 1000),
+                                   clock=clock)
+    return processor, client, clock
+
+def candidates(campaign_id, ips):
+    return [exclusion_candidate(ip, campaign_id, False, "High IP Frequency: 9 clicks in 60s") for ip in ips]
+
+def test_valid_clicks_and_unflagged_reasons_are_not_candidates():
+    assert exclusion_candidate("8.8.8.8", "111", True, None) is None
+    assert exclusion_candidate("8.8.8.8", "111", False, "Geolocation Mismatch: Click from Chile, expected BR") is None
+    assert exclusion_candidate("8.8.8.8", None, False, "Blacklisted IP: 8.8.8.8") is None
+
+def test_enqueue_deduplicates_and_skips_private_or_invalid_ips():
+    ips = ["8.8.8.8", "8.8.8.8", "10.0.0.1", "127.0.0.1", "not-an-ip", "9.9.9.9, 10.0.0.2"]
+    assert enqueue_exclusions(candidates("111", ips)) == 2 and queued() == 2
+    assert enqueue_exclusions(candidates("111", ["8.8.8.8"])) == 0 and queued() == 2
+
+def test_batches_flush_when_full_or_after_the_max_delay():
+    processor, client, clock = build()
+    service = client.criterion_service
+    enqueue_exclusions(candidates("111", ["8.8.8.8", "9.9.9.9"]))
+    processor.process()
+    assert not service.requests and queued() == 2 # A partial batch waits
+    enqueue_exclusions(candidates("111", ["1.1.1.1"]))
+    processor.process()
+    assert len(service.requests) == 1 and len(service.requests[0][2]) == 3 and queued() == 0
+    assert db.session.query(AdsIpExclusion).count() == 3
+    assert enqueue_exclusions(candidates("111", ["1.1.1.1"])) == 0 # Excluded IPs are remembered
+
+    enqueue_exclusions(candidates("111", ["2.2.2.2"]) + candidates("222", ["2.2.2.2"]))
+    processor.process()
+    assert len(service.requests) == 1 and queued() == 2 # Campaigns are batched separately
+    clock.offset += timedelta(seconds=61)
+    processor.process()
+    assert len(service.requests) == 3 and queued() == 0
+
+def test_a_full_campaign_rotates_out_its_oldest_exclusions():
+    processor, client, clock = build(batch_size=3, list_limit=5)
+    service = client.criterion_service
+    enqueue_exclusions(candidates("111", [f"1.0.0.{i}" for i in range(1, 8)]))
+    processor.process(force=True)
+    assert len(service.requests) == 3 and sum(len(request[1]) for request in service.requests) == 2
+    assert service.campaign_ips(CAMPAIGN_111) == {"1.0.0.3", "1.0.0.4", "1.0.0.5", "1.0.0.6", "1.0.0.7"}
+    assert enqueue_exclusions(candidates("111", ["1.0.0.1"])) == 1 # Rotated IPs can be queued again
+
+def test_failed_mutates_back_off_and_are_dropped_after_max_attempts():
+    processor, client, clock = build()
+    service = client.criterion_service
+    service.fail_next = 1
+    enqueue_exclusions(candidates("111", ["3.3.3.3"]))
+    processor.process(force=True)
+    row = db.session.query(AdsExclusionQueueItem).one()
+    assert not service.requests and row.attempts == 1 and row.next_attempt_at > clock()
+    processor.process(force=True)
+    assert not service.requests # Not retried early
+    clock.offset += row.next_attempt_at - clock()
+    processor.process(force=True)
+    assert len(service.requests) == 1 and queued() == 0
+
+    service.fail_next = 2
+    enqueue_exclusions(candidates("111", ["4.4.4.4"]))
+    processor.process(force=True)
+    clock.offset += timedelta(hours=2)
+    processor.process(force=True)
+    assert queued() == 0 and len(service.requests) == 1
+
+def test_steady_state_batches_use_the_cached_exclusions():
+    processor, client, clock = build(batch_size=2, list_limit=4)
+    service = client.criterion_service
+    for ips in (["6.6.6.1", "6.6.6.2"], ["6.6.6.3", "6.6.6.4"], ["6.6.6.5", "6.6.6.6"]):
+        enqueue_exclusions(candidates("111", ips))
+        processor.process()
+    assert client.ads_service.searches == 1 and len(service.requests) == 3
+
+def test_exclusions_made_outside_the_app_count_towards_the_limit_and_are_kept():
+    processor, client, clock = build(batch_size=2, list_limit=4)
+    service = client.criterion_service
+    for ip in ("6.6.7.1", "6.6.7.2", "6.6.7.3"):
+        service.add(CAMPAIGN_222, ip)
+    enqueue_exclusions(candidates("222", ["6.6.7.4", "6.6.7.5"]))
+    processor.process(force=True)
+    assert service.campaign_ips(CAMPAIGN_222) == {"6.6.7.1", "6.6.7.2", "6.6.7.3", "6.6.7.4"} and queued() == 1
+
+def test_not_found_drops_the_cached_exclusions_and_the_retry_reloads_them():
+    processor, client, clock = build(batch_size=1, list_limit=2)
+    service = client.criterion_service
+    enqueue_exclusions(candidates("111", ["7.7.7.1", "7.7.7.2"]))
+    processor.process(force=True)
+    oldest = next(name for name, (_, ip) in service.criteria.items() if ip == "7.7.7.1")
+    del service.criteria[oldest] # Removed in the Google Ads UI; the cached resource name is now stale
+    enqueue_exclusions(candidates("111", ["7.7.7.3"]))
+    processor.process(force=True)
+    assert queued() == 1 and resource_cache.get(CUSTOMER_ID, "ip_exclusions", "111") is None
+    assert client.ads_service.searches == 1
+    clock.offset += timedelta(hours=1)
+    processor.process(force=True)
+    assert queued() == 0 and client.ads_service.searches == 2
+    assert service.campaign_ips(CAMPAIGN_111) == {"7.7.7.2", "7.7.7.3"} and db.session.query(AdsIpExclusion).count() == 2
+
+def test_managers_share_one_long_lived_client_per_customer():
+    loads = []
+    def loader():
+        loads.append(1)
+        return FakeGoogleAdsClient(5)
+    forget_ads_client("999")
+    try:
+        first = get_ads_client("999", loader=loader)
+        GoogleAdsManager("999").ip_exclusions("111")
+        assert len(loads) == 1 and GoogleAdsManager("999").client is first and get_ads_client("999", loader=loader) is first
+        forget_ads_client("999")
+        assert get_ads_client("999", loader=loader) is not first and len(loads) == 2
+    finally:
+        forget_ads_client("999")
+
+def test_token_bucket_spaces_requests_and_refills():
+    ticks = SimpleNamespace(now=0.0)
+    waits = []
+    def fake_sleep(seconds):
+        waits.append(seconds)
+        ticks.now += seconds
+    bucket = TokenBucket(rate=2, capacity=1, clock=lambda: ticks.now)
+    assert bucket.acquire(sleep=fake_sleep) == 0.0
+    assert bucket.acquire(sleep=fake_sleep) == 0.5
+    assert waits == [0.5]
+    assert not bucket.try_acquire()
+    ticks.now += 10
+    assert bucket.try_acquire() and not bucket.try_acquire() # Refills up to the capacity only
+    assert bucket.wait_time(5) == 0.5 # Requests larger than the bucket wait for a full bucket
+
+def test_the_daily_operation_budget_defers_the_rest_of_the_queue():
+    processor, client, clock = build(batch_size=3, operation_bucket=TokenBucket(0.0001, 4))
+    enqueue_exclusions(candidates("111", ["5.5.5.1", "5.5.5.2", "5.5.5.3"]) + candidates("222", ["5.5.5.4", "5.5.5.5", "5.5.5.6"]))
+    result = processor.process()
+    assert result["deferred"] and len(client.criterion_service.requests) == 1 and queued() == 3
+
+def test_the_event_pipeline_queues_a_flagged_clicks_ip():
+    from src.routes.events import _stage_exclude
+    ctx = {"ip_address": "203.0.113.9", "google_campaign_id": "333", "is_valid": False,
+           "reason_string": "Suspicious User Agent: contains 'bot'"}
+    _stage_exclude(ctx) # 203.0.113.0/24 is documentation space, not a global address
+    _stage_exclude(dict(ctx, ip_address="8.8.4.4", google_campaign_id=None))
+    assert queued() == 0
+    _stage_exclude(dict(ctx, ip_address="8.8.4.4"))
+    assert queued() == 1
@@ -0,0 +1,67 @@
+import pytest
+
+from src.services.hyperloglog import HyperLogLog, merge_serialized
+
+def sketch_of(values, precision=12):
+    sketch = HyperLogLog(precision)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+def registers(sketch):
+    """Register contents regardless of the encoding, for comparing sketches."""
+    if sketch._dense is not None:
+        return bytes(sketch._dense)
+    dense = bytearray(sketch.m)
+    for index, rank in sketch._sparse.items():
+        dense[index] = rank
+    return bytes(dense)
+
+def test_small_sketches_stay_sparse_and_round_trip():
+    sketch = sketch_of(f"10.0.0.{i}" for i in range(50))
+    assert sketch._dense is None
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored._dense is None
+    assert restored._sparse == sketch._sparse
+    assert restored.estimate() == sketch.estimate()
+
+def test_large_sketches_densify_and_round_trip():
+    sketch = sketch_of(f"ip-{i}" for i in range(20000))
+    assert sketch._dense is not None
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored._dense == sketch._dense
+    assert restored.estimate() == sketch.estimate()
+
+@pytest.mark.parametrize("count", [0, 1, 100, 5000, 100000])
+def test_estimate_is_within_a_few_standard_errors(count):
+    sketch = sketch_of(f"ip-{i}" for i in range(count))
+    assert abs(sketch.estimate() - count) <= max(2, 4 * sketch.standard_error * count)
+
+def test_duplicates_do_not_count():
+    assert sketch_of(["1.1.1.1"] * 1000).estimate() == 1
+
+@pytest.mark.parametrize("left_count, right_count", [(30, 40), (30, 20000), (20000, 30), (20000, 15000)])
+def test_merge_matches_a_sketch_of_the_union(left_count, right_count):
+    left_values = [f"a-{i}" for i in range(left_count)]
+    right_values = [f"b-{i}" for i in range(right_count)] + left_values[:10]
+    union = sketch_of(left_values + right_values)
+    merged = sketch_of(left_values).merge(sketch_of(right_values))
+    assert registers(merged) == registers(union)
+    assert merged.estimate() == union.estimate()
+
+def test_merge_serialized_skips_missing_blobs():
+    blobs = [sketch_of(f"{part}-{i}" for i in range(3000)).to_bytes() for part in "abc"]
+    merged = merge_serialized([blobs[0], None, blobs[1], blobs[2]])
+    expected = sketch_of(f"{part}-{i}" for part in "abc" for i in range(3000))
+    assert registers(merged) == registers(expected)
+    assert merge_serialized([]).estimate() == 0
+
+def test_merging_different_precisions_is_rejected():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(14))
+
+def test_invalid_precision_and_unknown_format_version_are_rejected():
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+    with pytest.raises(ValueError):
+        HyperLogLog.from_bytes(b"\x09" + HyperLogLog().to_bytes()[1:])
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import glob
+import subprocess
+import sys
+import threading
+from datetime import datetime
+
+import pytest
+
+from src.services.ingest_pipeline import IngestPipeline
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+def spilled(n):
+    return json.dumps({"n": n, "timestamp": {"__datetime__": "2026-10-18T12:00:00"}}) + "\n"
+
+@pytest.fixture
+def pipeline(app, tmp_path):
+    seen = []
+    pipeline = IngestPipeline([("record", lambda context: seen.append(context))], queue_size=1, workers=1,
+                              backpressure="spill", spill_path=str(tmp_path / "spill.ndjson"))
+    pipeline._app = app # Drained inline below, without starting the workers
+    pipeline.seen = seen
+    return pipeline
+
+def numbers(pipeline):
+    return sorted(context["n"] for context in pipeline.seen)
+
+def test_spilled_events_are_drained_with_their_datetimes(pipeline):
+    assert pipeline._spill({"n": 1, "timestamp": datetime(2026, 10, 18, 12, 0, 1)})
+    assert pipeline._spill({"n": 2, "timestamp": datetime(2026, 10, 18, 12, 0, 2)})
+    pipeline._drain_spill(pipeline.spill_path)
+    assert [(context["n"], context["timestamp"]) for context in pipeline.seen] == [
+        (1, datetime(2026, 10, 18, 12, 0, 1)), (2, datetime(2026, 10, 18, 12, 0, 2))]
+    assert not glob.glob(pipeline.spill_path + "*")
+    assert pipeline.stats()["counters"]["recovered_from_spill"] == 2
+
+def test_unreadable_lines_are_quarantined(pipeline):
+    truncated = '{"n": 2, "timestamp": {"__da\n'
+    with open(pipeline.spill_path, "w", encoding="utf-8") as f:
+        f.write(spilled(1) + truncated + "[1, 2]\n\n" + spilled(3) + spilled(4)[:-6])
+    pipeline._drain_spill(pipeline.spill_path)
+    assert numbers(pipeline) == [1, 3]
+    with open(pipeline.quarantine_path, encoding="utf-8") as f:
+        assert f.read() == truncated + "[1, 2]\n" + spilled(4)[:-6] + "\n"
+    counters = pipeline.stats()["counters"]
+    assert counters["quarantined"] == 3 and counters["recovered_from_spill"] == 2 and counters["processed"] == 2
+    assert not os.path.exists(pipeline.spill_path) and not os.path.exists(pipeline.spill_path + ".draining")
+
+def test_an_interrupted_drain_is_finished_first(pipeline):
+    with open(pipeline.spill_path + ".draining", "w", encoding="utf-8") as f:
+        f.write(spilled(1))
+    with open(pipeline.spill_path, "w", encoding="utf-8") as f:
+        f.write(spilled(2))
+    pipeline._drain_spill(pipeline.spill_path)
+    assert numbers(pipeline) == [1]
+    pipeline._drain_spill(pipeline.spill_path)
+    assert numbers(pipeline) == [1, 2]
+
+def test_orphaned_spills_of_dead_processes_are_recovered(pipeline):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    base = pipeline._spill_base
+    with open(f"{base}.{dead.pid}", "w", encoding="utf-8") as f:
+        f.write(spilled(1) + "garbage\n")
+    with open(f"{base}.{dead.pid}.draining", "w", encoding="utf-8") as f:
+        f.write(spilled(2))
+    alive = f"{base}.{os.getppid()}"
+    with open(alive, "w", encoding="utf-8") as f:
+        f.write(spilled(3))
+    pipeline._recover_orphaned_spills()
+    wait_for(lambda: not glob.glob(f"{base}.{dead.pid}*") and not glob.glob(f"{pipeline.spill_path}.recovering.*"))
+    assert numbers(pipeline) == [1, 2]
+    assert os.path.exists(alive) # Its owner is still running and drains it itself
+    assert pipeline.stats()["counters"]["quarantined"] == 1
+
+def test_a_full_queue_spills_and_the_workers_drain_it_later(app, tmp_path):
+    seen = []
+    release = threading.Event()
+    def record(context):
+        release.wait(10)
+        seen.append(context["n"])
+    pipeline = IngestPipeline([("record", record)], queue_size=1, workers=1, backpressure="spill",
+                              spill_path=str(tmp_path / "spill.ndjson"))
+    assert pipeline.submit(app, {"n": 1})
+    wait_for(lambda: pipeline._queue.qsize() == 0) # The worker holds the first event
+    assert all(pipeline.submit(app, {"n": n}) for n in range(2, 6))
+    counters = pipeline.stats()["counters"]
+    assert counters["spilled"] == 3 and counters["shed"] == 0 and os.path.exists(pipeline.spill_path)
+    release.set()
+    wait_for(lambda: len(seen) == 5)
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+    wait_for(lambda: not glob.glob(pipeline.spill_path + "*"))
@@ -0,0 +1,32 @@
+import base64
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from src.routes.logs import decode_cursor, encode_cursor
+
+@pytest.mark.parametrize("direction", ["next", "prev"])
+@pytest.mark.parametrize("timestamp", [datetime(2026, 10, 18, 12, 30), datetime(2026, 10, 18, 12, 30, 5, 123456)])
+def test_round_trip(direction, timestamp):
+    cursor = encode_cursor(SimpleNamespace(timestamp=timestamp, id=987654321), direction)
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor # Safe in a query string as is
+    assert decode_cursor(cursor) == (timestamp, 987654321, direction)
+
+def opaque(raw):
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not a cursor!",
+    opaque("not json"),
+    opaque("[1, 2]"),
+    opaque('{"t": "2026-10-18T12:30:00", "i": 1}'),
+    opaque('{"t": "2026-10-18T12:30:00", "i": 1, "d": "sideways"}'),
+    opaque('{"t": "yesterday", "i": 1, "d": "next"}'),
+    opaque('{"t": "2026-10-18T12:30:00", "i": "one", "d": "next"}'),
+    opaque('{"t": "2026-10-18T12:30:00", "i": null, "d": "next"}'),
+])
+def test_anything_else_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
@@ -0,0 +1,80 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.services.rollups import GRAINS, floor_to_grain, plan_range
+
+def coverage(moment, spans, edges):
+    """How many spans and edges of a plan_range() result read an event at `moment`."""
+    count = 0
+    for grain, lo, hi in spans:
+        bucket_start = floor_to_grain(moment, grain)
+        if (lo is None or bucket_start >= lo) and (hi is None or bucket_start < hi):
+            count += 1
+    for lo, hi, inclusive in edges:
+        if lo <= moment and (moment <= hi if inclusive else moment < hi):
+            count += 1
+    return count
+
+def probes(start, end):
+    """Moments in and around the range: every boundary it could be split on, plus a random sample."""
+    rng = random.Random(f"{start}-{end}")
+    anchors = [moment for moment in (start, end) if moment is not None]
+    lowest = min(anchors) - timedelta(days=2)
+    highest = max(anchors) + timedelta(days=2)
+    moments = []
+    for anchor in anchors:
+        for grain in GRAINS:
+            floored = floor_to_grain(anchor, grain)
+            for step in (timedelta(minutes=1), timedelta(hours=1), timedelta(days=1)):
+                for boundary in (floored, floored + step, floored - step):
+                    moments += [boundary - timedelta(microseconds=1), boundary, boundary + timedelta(microseconds=1)]
+        moments += [anchor - timedelta(microseconds=1), anchor, anchor + timedelta(microseconds=1)]
+    span = (highest - lowest).total_seconds()
+    moments += [lowest + timedelta(seconds=rng.uniform(0, span)) for _ in range(2000)]
+    return moments
+
+def in_range(moment, start, end):
+    return (start is None or moment >= start) and (end is None or moment <= end)
+
+RANGES = [
+    (datetime(2026, 1, 1), datetime(2026, 3, 31, 23, 59, 59)),
+    (datetime(2026, 1, 1, 10, 17, 42, 500), datetime(2026, 4, 1, 3, 4, 5)),
+    (datetime(2026, 5, 3, 22, 59, 30), datetime(2026, 5, 4, 1, 0, 30)),
+    (datetime(2026, 5, 3, 12, 0, 10), datetime(2026, 5, 3, 12, 0, 50)), # Within one minute
+    (datetime(2026, 5, 3, 12, 0, 50), datetime(2026, 5, 3, 12, 1, 10)), # Across one minute boundary
+    (datetime(2026, 5, 3, 12, 0), datetime(2026, 5, 3, 12, 0)),
+    (datetime(2026, 5, 3, 12, 0), datetime(2026, 5, 3, 13, 0)),
+    (None, datetime(2026, 5, 3, 12, 30, 15)),
+    (datetime(2026, 5, 3, 12, 30, 15), None),
+]
+
+@pytest.mark.parametrize("start, end", RANGES)
+@pytest.mark.parametrize("max_grain", GRAINS)
+def test_every_moment_is_read_exactly_once(start, end, max_grain):
+    spans, edges = plan_range(start, end, max_grain=max_grain)
+    assert all(GRAINS.index(grain) <= GRAINS.index(max_grain) for grain, _, _ in spans)
+    for moment in probes(start, end):
+        assert coverage(moment, spans, edges) == (1 if in_range(moment, start, end) else 0), moment
+
+def test_long_range_uses_the_coarsest_grain():
+    start, end = datetime(2026, 1, 1, 10, 17, 42), datetime(2026, 4, 1, 3, 4, 5)
+    spans, edges = plan_range(start, end)
+    assert [(grain, lo, hi) for grain, lo, hi in spans if grain == "day"] == [("day", datetime(2026, 1, 2), datetime(2026, 4, 1))]
+    assert sum(1 for grain, _, _ in spans if grain == "hour") == 2
+    assert sum(1 for grain, _, _ in spans if grain == "minute") == 2
+    assert edges == [(start, datetime(2026, 1, 1, 10, 18), False), (datetime(2026, 4, 1, 3, 4), end, True)]
+
+def test_aligned_start_has_no_leading_edge():
+    spans, edges = plan_range(datetime(2026, 5, 3), datetime(2026, 5, 5))
+    assert spans == [("day", datetime(2026, 5, 3), datetime(2026, 5, 5))]
+    assert edges == [(datetime(2026, 5, 5), datetime(2026, 5, 5), True)]
+
+def test_sub_minute_range_is_read_from_raw_rows():
+    start, end = datetime(2026, 5, 3, 12, 0, 10), datetime(2026, 5, 3, 12, 0, 50)
+    assert plan_range(start, end) == ([], [(start, end, True)])
+
+def test_max_grain_caps_the_span_grain():
+    spans, _ = plan_range(datetime(2026, 5, 1), datetime(2026, 5, 10), max_grain="hour")
+    assert spans == [("hour", datetime(2026, 5, 1), datetime(2026, 5, 10))]
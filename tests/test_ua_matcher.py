@@ -0,0 +1,40 @@
+import pytest
+
+from src.services.ua_matcher import AhoCorasick
+
+def naive_first_match(patterns, text):
+    return next((index for index, pattern in enumerate(patterns) if pattern and pattern in text), None)
+
+def test_earlier_pattern_wins_over_an_earlier_position():
+    matcher = AhoCorasick(["spider", "bot"])
+    # 'bot' appears first in the text, but 'spider' is listed first
+    assert matcher.first_match("bot-like spider") == 0
+
+def test_pattern_found_through_a_suffix_link():
+    matcher = AhoCorasick(["googlebot", "bot"])
+    assert matcher.first_match("mozilla/5.0 (compatible; googlebot/2.1)") == 0
+    assert matcher.first_match("yandexbot") == 1
+    # 'less' ends inside the path of the longer 'headlesschrome', so only the folded suffix output reports it
+    assert AhoCorasick(["headlesschrome", "less"]).first_match("headlessfirefox") == 1
+
+def test_overlapping_patterns_and_duplicates():
+    patterns = ["java/", "headless", "less", "headless"]
+    matcher = AhoCorasick(patterns)
+    assert matcher.first_match("headlesschrome") == 1
+    assert matcher.first_match("wireless") == 2
+    assert matcher.first_match("java/1.8") == 0
+
+def test_no_match_and_empty_patterns():
+    matcher = AhoCorasick(["", "curl"])
+    assert matcher.first_match("mozilla/5.0 (windows nt 10.0)") is None
+    assert matcher.first_match("") is None
+    assert AhoCorasick([]).first_match("anything") is None
+
+@pytest.mark.parametrize("text", [
+    "python-requests/2.31", "scrapy/2.11 (+https://scrapy.org)", "mozilla/5.0 (x11; linux) headlesschrome/120",
+    "go-http-client/1.1", "slurp", "ia_archiver", "msnbot-media", "mozilla/5.0 (iphone) safari/604.1", "sogouspiderbot",
+])
+def test_agrees_with_a_naive_scan(text):
+    patterns = ["bot", "crawler", "spider", "headless", "python-requests", "curl", "go-http-client", "scrapy",
+                "googlebot", "bingbot", "slurp", "baiduspider", "sogou", "ia_archiver", "spiderbot"]
+    assert AhoCorasick(patterns).first_match(text) == naive_first_match(patterns, text)
@@ -0,0 +1,153 @@
+# /home/ubuntu/traffic_tracker_backend/src/services/ua_matcher.py
+import os
+import time
+import threading
+from collections import deque
+from functools import lru_cache
+
+# --- Configuration for the User-Agent matcher (can be overridden in .env) ---
+# One signature per line ('#' starts a comment). Empty = the built-in list in click_validator.py.
+UA_SIGNATURES_FILE = os.getenv("UA_SIGNATURES_FILE", "")
+UA_SIGNATURES_RELOAD_SECONDS = float(os.getenv("UA_SIGNATURES_RELOAD_SECONDS", "30"))
+UA_VERDICT_CACHE_SIZE = int(os.getenv("UA_VERDICT_CACHE_SIZE", "10000"))
+
+class AhoCorasick:
+    def __init__(self, patterns):
+        """
+        Multi-pattern substring automaton; matching is a single pass over the text
+        regardless of how many patterns there are.
+        :param patterns: List of (already lowercased) signatures. Earlier entries win ties.
+        """
+        self.patterns = patterns
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None] # Lowest pattern index ending at this node or any of its suffix nodes
+
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(None)
+                node = next_node
+            if self._best[node] is None or index < self._best[node]:
+                self._best[node] = index
+
+        # Breadth-first pass to wire failure links and fold suffix outputs into each node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (self._best[child] is None or inherited < self._best[child]):
+                    self._best[child] = inherited
+
+    def first_match(self, text):
+        """
+        Returns the index of the earliest-listed pattern found in `text`, or None.
+        """
+        goto, fail, best = self._goto, self._fail, self._best
+        node = 0
+        found = None
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            candidate = best[node]
+            if candidate is not None and (found is None or candidate < found):
+                found = candidate
+                if found == 0:
+                    break
+        return found
+
+class UserAgentMatcher:
+    def __init__(self, default_signatures, path=UA_SIGNATURES_FILE, cache_size=UA_VERDICT_CACHE_SIZE,
+                 reload_seconds=UA_SIGNATURES_RELOAD_SECONDS):
+        """
+        Compiled signature matcher with an LRU of verdicts keyed by the raw User-Agent.
+        The signature file is re-read when its mtime changes (checked every `reload_seconds`).
+        :param default_signatures: Signatures used when no file is configured or it can't be read.
+        :param path: Optional signature file path.
+        :param cache_size: Number of distinct User-Agent verdicts to remember.
+        """
+        self.default_signatures = default_signatures
+        self.path = path or None
+        self.cache_size = cache_size
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self.reloads = 0
+        self._compile(self._read_signatures() if self.path else list(default_signatures))
+
+    def _read_signatures(self):
+        try:
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                signatures = [line.split("#", 1)[0].strip().lower() for line in f]
+            return [signature for signature in signatures if signature]
+        except OSError as e:
+            print(f"UA_WARN: Could not read User-Agent signatures from {self.path}, using built-in list: {e}")
+            return list(self.default_signatures)
+
+    def _compile(self, signatures):
+        automaton = AhoCorasick([signature.lower() for signature in signatures])
+
+        @lru_cache(maxsize=self.cache_size)
+        def verdict(raw_user_agent):
+            index = automaton.first_match(raw_user_agent.lower())
+            return automaton.patterns[index] if index is not None else None
+
+        # Swapped in one assignment; in-flight lookups finish against the old automaton
+        self._verdict = verdict
+        self.signature_count = len(automaton.patterns)
+
+    def reload(self):
+        """Re-reads the signature file and recompiles the automaton (also clears the verdict cache)."""
+        with self._lock:
+            self._compile(self._read_signatures() if self.path else list(self.default_signatures))
+            self.reloads += 1
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if not self.path or now < self._next_check:
+            return
+        self._next_check = now + self.reload_seconds
+        try:
+            changed = os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return
+        if changed:
+            self.reload()
+
+    def match(self, raw_user_agent):
+        """
+        Returns the first matching signature (in list order) for a User-Agent, or None.
+        """
+        if not raw_user_agent:
+            return None
+        self._maybe_reload()
+        return self._verdict(raw_user_agent)
+
+    def stats(self):
+        info = self._verdict.cache_info()
+        return {
+            "signatures": self.signature_count,
+            "signatures_file": self.path,
+            "reloads": self.reloads,
+            "cache_hits": info.hits,
+            "cache_misses": info.misses,
+            "cache_entries": info.currsize,
+            "cache_size": info.maxsize
+        }